@@ -670,10 +670,12 @@ class UserActions:
 
     def surrounding_text() -> Optional[SurroundingText]:
         # TODO: If the voicemacs server is inactive, return nothing.
-        raw_info = jetbrains_rpc_call("surroundingText", [30000, 30000])
-        return SurroundingText(
-            text_before=raw_info["textBefore"], text_after=raw_info["textAfter"]
-        )
+        def fetch(chars_before, chars_after):
+            raw_info = jetbrains_rpc_call("surroundingText", [chars_before, chars_after])
+            return raw_info["textBefore"], raw_info["textAfter"]
+
+        # Lazy, so we only fetch as much as the formatters actually read.
+        return SurroundingText(fetch=fetch)
 
     # TODO: Click buttons by index
     # TODO: Focus by index
@@ -3,7 +3,7 @@ from typing import Optional
 from talon import Context, Module, actions, ui
 from talon_init import TALON_USER
 
-from user.emacs.utils.voicemacs import rpc_call
+from user.emacs.utils.voicemacs import rpc_call, rpc_batch
 from user.apps.generic.code_editor import DocumentPositionInfo
 
 key = actions.key
@@ -96,8 +96,7 @@ class Actions:
         from user.misc.text import CUSTOM_WORDS_PATH
 
         user.open_in_emacs(CUSTOM_WORDS_PATH)
-        emacs_command("end-of-buffer")
-        emacs_command("sp-skip-backward-to-symbol")
+        user.emacs_commands(["end-of-buffer", "sp-skip-backward-to-symbol"])
         key("enter")
 
     def emacs_switch_buffer() -> None:
@@ -346,7 +345,10 @@ class UserActions:
 
         Note: path may be None for buffers without files (e.g. *scratch*, output buffers).
         """
+        row, column, offset = rpc_batch(
+            [("current-row", []), ("current-column", []), ("point", [])]
+        )
         return DocumentPositionInfo(path=actions.app.path(),  # May be None for non-file buffers
-                                    row=rpc_call("current-row"),
-                                    column=rpc_call("current-column"),
-                                    offset=rpc_call("point"))
+                                    row=row,
+                                    column=column,
+                                    offset=offset)
@@ -1,4 +1,3 @@
-from collections import defaultdict
 from typing import List
 import threading
 
@@ -6,28 +5,47 @@ from talon import Module, Context, actions
 
 from user.utils import spoken_form
 from user.utils.formatting import separate_words
+from user.utils.name_index import PhraseIndex
+from user.utils.list_publisher import ListPublisher
 from user.emacs.utils.voicemacs import emacs_state, rpc_call
 
 
 BUFFER_LIST_KEY = "buffer-list"
-TALON_BUFFER_LIST = "emacs_partial_buffer_names"
-NAMESPACED_BUFFER_LIST = f"self.{TALON_BUFFER_LIST}"
+TALON_WORDS_LIST = "emacs_buffer_name_words"
+NAMESPACED_WORDS_LIST = f"self.{TALON_WORDS_LIST}"
+# Safety valve for the grammar. Words shared by the most buffers are kept.
+MAX_BUFFER_NAME_WORDS = 5000
 
 
 module = Module()
 module.list(
-    TALON_BUFFER_LIST,
-    desc="Partial names that can be used to switch to specific buffers.",
+    TALON_WORDS_LIST,
+    desc="Individual words from the names of open buffers.",
 )
 
 
+@module.capture(rule=f"{{{NAMESPACED_WORDS_LIST}}}+")
+def emacs_partial_buffer_name(m) -> str:
+    """Part of a buffer's name - a run of words from it."""
+    return " ".join(m.emacs_buffer_name_words_list)
+
+
 context = Context()
-# TODO: Could also have two lists, one for exact matches and one for non-exact
-#   matches.
-context.lists[NAMESPACED_BUFFER_LIST] = {}
+context.lists[NAMESPACED_WORDS_LIST] = {}
+# Buffer lists change in bursts (e.g. when a project is opened), so coalesce
+# them - but not for long, so new buffers are speakable quickly.
+words_publisher = ListPublisher(
+    context,
+    NAMESPACED_WORDS_LIST,
+    max_entries=MAX_BUFFER_NAME_WORDS,
+    delay="50ms",
+    min_interval=0,
+)
 
 
-_partial_buffers_map = defaultdict(list)
+# Partial names are resolved against this when they're spoken, so runs of
+# words never need to be listed up front.
+_buffer_index = PhraseIndex([])
 _buffers_lock = threading.Lock()
 
 
@@ -40,7 +58,7 @@ def emacs_partial_buffer_switch(partial_name: str) -> None:
 
     """
     with _buffers_lock:
-        candidates = _partial_buffers_map.get(partial_name, [])
+        candidates = _buffer_index.find(partial_name.split(" "))
     if len(candidates) == 1:
         try:
             rpc_call("voicemacs-switch-to-existing-buffer", [candidates[0]])
@@ -64,19 +82,14 @@ def _split_name(text):
 
 
 def _update_partial_buffer_names(state):
-    buffer_names = state.get(BUFFER_LIST_KEY, [])
-    partial_names = set()
+    global _buffer_index
+    buffer_names = state.get(BUFFER_LIST_KEY) or []
+    index = PhraseIndex((_split_name(name), name) for name in buffer_names)
     with _buffers_lock:
-        _partial_buffers_map.clear()
-        for name in buffer_names:
-            words = _split_name(name)
-            for i in range(0, len(words)):
-                for j in range(i, len(words) + 1):
-                    partial_name = " ".join(words[i:j])
-                    _partial_buffers_map[partial_name].append(name)
-                    partial_names.add(partial_name)
-        if set(context.lists[NAMESPACED_BUFFER_LIST]) != partial_names:
-            context.lists[NAMESPACED_BUFFER_LIST] = partial_names
+        _buffer_index = index
+    words_publisher.update(
+        (word, word) for word, _ in index.word_counts.most_common() if word
+    )
 
 
 emacs_state.hook_key(BUFFER_LIST_KEY, _update_partial_buffer_names)
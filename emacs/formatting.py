@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Optional, Tuple
 
 from talon import Context
 
@@ -13,16 +13,27 @@ tag: user.emacs
 """
 
 
+def fetch_text_around_point(chars_before: int, chars_after: int) -> Tuple[str, str]:
+    """Get the text ``(before, after)`` point.
+
+    Ask for as little text as you need - a short request is cheaper over RPC.
+
+    """
+    # TODO: Answer this from a local mirror of the text around point, kept
+    #   current by edit deltas over the `update` channel, & only fall back to
+    #   RPC when it's stale. Blocked until the Voicemacs server pushes deltas.
+    # TODO: If the voicemacs server is inactive, return nothing.
+    raw_info = rpc_call(
+        "voicemacs-surrounding-text",
+        [":chars-before", chars_before, ":chars-after", chars_after],
+        # Use a very long timeout
+        timeout=10,
+    )
+    return raw_info["text-before"], raw_info["text-after"]
+
+
 @context.action_class("self")
 class UserActions:
     def surrounding_text() -> Optional[SurroundingText]:
-        # TODO: If the voicemacs server is inactive, return nothing.
-        raw_info = rpc_call(
-            "voicemacs-surrounding-text",
-            [":chars-before", 30000, ":chars-after", 30000],
-            # Use a very long timeout
-            timeout=10,
-        )
-        return SurroundingText(
-            text_before=raw_info["text-before"], text_after=raw_info["text-after"]
-        )
+        # Lazy, so we only fetch as much as the formatters actually read.
+        return SurroundingText(fetch=fetch_text_around_point)
@@ -5,6 +5,7 @@ import re
 from talon import Module, Context
 
 from user.utils import spoken_form, single_spaces
+from user.utils.list_publisher import ListPublisher, most_common
 from user.emacs.utils.voicemacs import emacs_state
 
 
@@ -12,8 +13,15 @@ module = Module()
 module.list("selectable_words", desc="Words on screen that can be selected.")
 
 
+# Only the most frequent words on screen are speakable.
+MAX_SELECTABLE_WORDS = 300
+
+
 context = Context()
 context.lists["user.selectable_words"] = {}
+words_publisher = ListPublisher(
+    context, "user.selectable_words", max_entries=MAX_SELECTABLE_WORDS
+)
 
 
 _RE_NON_CHAR = re.compile(r"[^a-zA-Z0-9]")
@@ -24,14 +32,14 @@ def _extract_words(string):
 
 
 def _update_words(state):
-    words = {}
-    window_strings = state.get("visible-text", [])
-    for window_string in window_strings:
-        spoken_map = {spoken_form(word): word for word in _extract_words(window_string)}
-        words.update(spoken_map)
-    context.lists["user.selectable_words"] = words
+    window_strings = state.get("visible-text") or []
+    words = most_common(
+        word
+        for window_string in window_strings
+        for word in _extract_words(window_string)
+        if word
+    )
+    words_publisher.update((spoken_form(word), word) for word in words)
 
 
-# Temporarily disabled because it JIT-recompiles the grammar each time which
-# is noticeably laggy.
-# emacs_state.hook_key("visible-text", _update_words)
+emacs_state.hook_key("visible-text", _update_words)
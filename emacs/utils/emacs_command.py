@@ -42,6 +42,15 @@ class Actions:
         """Run an Emacs command."""
         voicemacs.run_command(command)
 
+    def emacs_commands(commands: List[str]) -> None:
+        """Run multiple Emacs commands in order, with one round trip.
+
+        Prefer this to repeated calls of `emacs_command` - it only has to wait
+        for the commands to be injected once.
+
+        """
+        voicemacs.run_commands(commands)
+
     def emacs_prefix_command(
         command: str, prefix_arg: Optional[Union[int, List[int]]] = [4]
     ) -> None:
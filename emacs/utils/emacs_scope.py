@@ -1,4 +1,5 @@
 import logging
+import threading
 
 from talon import Module
 
@@ -20,14 +21,39 @@ def _add_to_scope(scope, key, value):
     scope[f"emacs-{key}"] = value
 
 
+# Maps each state key to ``(raw_value, scope_value)``. State values are
+# replaced, not mutated, when they update - so if the raw value is the same
+# object, the cached scope value can be reused. This avoids rebuilding huge sets
+# (e.g. `defined-commands`) when an unrelated key changes.
+_scope_value_cache = {}
+_scope_value_cache_lock = threading.Lock()
+
+
+def _scope_value(key, value):
+    """Get the scope-legal form of ``value``, or None if it's not legal."""
+    cached = _scope_value_cache.get(key)
+    if cached and cached[0] is value:
+        return cached[1]
+    if isinstance(value, LEGAL_SCOPE_TYPES):
+        scope_value = value
+    elif _is_list_of_strings(value):
+        scope_value = set(value)
+    else:
+        scope_value = None
+    _scope_value_cache[key] = (value, scope_value)
+    return scope_value
+
+
 def _add_legal_values(scope, state):
     """Add all keys with scope-legal values in ``state`` to ``scope``."""
     for key, value in state.items():
         if isinstance(key, str):
-            if isinstance(value, LEGAL_SCOPE_TYPES):
-                _add_to_scope(scope, key, value)
-            elif _is_list_of_strings(value):
-                _add_to_scope(scope, key, set(value))
+            scope_value = _scope_value(key, value)
+            if scope_value is not None:
+                _add_to_scope(scope, key, scope_value)
+    # Drop cached values for deleted keys.
+    for key in _scope_value_cache.keys() - state.keys():
+        del _scope_value_cache[key]
 
 
 def _is_list_of_strings(thing):
@@ -61,7 +87,8 @@ def scope(*_):
     scope = {}
     # Allow the user to automatically match on any value that's legal within a
     # scope.
-    _add_legal_values(scope, state)
+    with _scope_value_cache_lock:
+        _add_legal_values(scope, state)
     # Referencing `major-mode` and `minor-mode` in .talon files is nicer than
     # referencing the set names passed by Voicemacs.
     _duplicate_key(scope, "major-mode-chain", "major-mode")
@@ -1,5 +1,4 @@
 import socket
-import re
 import json
 from typing import Optional, List
 import threading
@@ -10,6 +9,7 @@ from user.utils.key_value_store import KeyValueStore
 import platform
 import os
 import math
+import concurrent.futures
 
 from talon import ui, cron, Module, app, Context, scope, actions, imgui, canvas
 from talon.ui import Rect, Point2d
@@ -24,8 +24,13 @@ from talon.ui import Rect, Point2d
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
+# How long to collect state updates before running hooks, in secs. Emacs sends
+# bursts of updates (e.g. on buffer switch) - this means hooks only run once per
+# burst.
+STATE_COALESCE_WINDOW = 0.02
+
 # Holds various keys & values passed to us by Voicemacs.
-emacs_state = KeyValueStore()
+emacs_state = KeyValueStore(coalesce_window=STATE_COALESCE_WINDOW)
 
 
 # Interval between connection attempts, in ms
@@ -33,7 +38,12 @@ _CONNECT_ATTEMPT_INTERVAL = 1000
 # Frequency with which to ping Emacs, in ms
 _PING_INTERVAL = 1000
 _AUTH_TIMEOUT = 5  # In secs
-_RE_TERMINATION_CHAR = re.compile("\0")
+# Size of each socket read, in bytes. Initial state syncs (e.g.
+# `defined-commands`) are large, so this is generous.
+RECEIVE_BUFFER_SIZE = 64 * 1024
+# Set this to a file path to record the raw incoming stream, for use with
+# `replay_stream`.
+STREAM_RECORDING_PATH = None
 DISCONNECT_DEADZONE = 5.0
 # How long to wait after injecting a command, to ensure the command has been
 # processed before pressing any keys.
@@ -56,6 +66,10 @@ _pending_requests = {}
 # TODO: Simplify locking scheme? Do we need two locks?
 _pending_lock = threading.Lock()
 
+# Whether the server accepts JSON-RPC batches. None until we've tried one -
+# see `rpc_batch`. Reset on reconnect, in case the server was upgraded.
+_batch_supported = None
+
 
 module = Module()
 
@@ -73,30 +87,135 @@ def _notify_with_deadzone(title, message, deadzone=1):
 
 
 class DeferredResult(object):
-    # Time to sleep between each result check.
-    _SLEEP_PERIOD = 1.0 / 1000  # ms
+    """The result of a request. It will be set when the response arrives.
+
+    Waiters block on a condition variable, so they wake as soon as the result
+    is set. A deferred can also be cancelled - once cancelled, a late result is
+    silently dropped.
+
+    """
 
     def __init__(self):
         self._result = None
         self._result_set = False
-        self._result_lock = threading.Lock()
-
-    def get(self, timeout):
-        t1 = time.monotonic()
-        while time.monotonic() - t1 < timeout:
-            with self._result_lock:
-                if self._result_set:
-                    return self._result
-            time.sleep(self._SLEEP_PERIOD)
+        self._cancelled = False
+        self._condition = threading.Condition()
+        self._callbacks = []
+
+    def _finished(self):
+        return self._result_set or self._cancelled
+
+    def done(self):
+        """Has the result been set (or the deferred been cancelled)?"""
+        with self._condition:
+            return self._finished()
+
+    def cancelled(self):
+        """Was this deferred cancelled before its result arrived?"""
+        with self._condition:
+            return self._cancelled
+
+    def get(self, timeout, cancel_on_timeout=True):
+        """Wait for the result, up to ``timeout`` seconds.
+
+        If the request times out and ``cancel_on_timeout`` is set, the deferred
+        is cancelled so a late response will be dropped.
+
+        """
+        with self._condition:
+            finished = self._condition.wait_for(self._finished, timeout)
+            if self._result_set:
+                return self._result
+        if finished:
+            # Only way to finish without a result.
+            raise concurrent.futures.CancelledError("Request was cancelled.")
+        # The result may have arrived between the wait and this point. If so,
+        # the cancel will fail and we can still use it.
+        if cancel_on_timeout and not self.cancel():
+            return self._result
         raise TimeoutError("Request timed out.")
 
     def set(self, value):
-        with self._result_lock:
+        """Set the result & wake any waiters.
+
+        Returns True if the result was set, False if the deferred had already
+        been cancelled (in which case ``value`` is dropped).
+
+        """
+        with self._condition:
+            if self._cancelled:
+                return False
             if self._result_set:
                 raise RuntimeError("Result already set.")
 
             self._result = value
             self._result_set = True
+            self._condition.notify_all()
+        self._run_callbacks()
+        return True
+
+    def cancel(self):
+        """Cancel the deferred, unless the result has already been set.
+
+        Returns True if the deferred is cancelled after this call.
+
+        """
+        with self._condition:
+            if self._result_set:
+                return False
+            if self._cancelled:
+                return True
+            self._cancelled = True
+            self._condition.notify_all()
+        self._run_callbacks()
+        return True
+
+    def add_done_callback(self, function):
+        """Call ``function`` with this deferred once it's set or cancelled.
+
+        If it's already finished, ``function`` is called immediately.
+
+        """
+        with self._condition:
+            if not self._finished():
+                self._callbacks.append(function)
+                return
+        function(self)
+
+    def _run_callbacks(self):
+        with self._condition:
+            callbacks, self._callbacks = self._callbacks, []
+        for function in callbacks:
+            try:
+                function(self)
+            except Exception:
+                LOGGER.exception("Error in deferred result callback")
+
+    def to_future(self):
+        """Get a `concurrent.futures.Future` that tracks this deferred.
+
+        Cancelling the future will also cancel the deferred.
+
+        """
+        future = concurrent.futures.Future()
+
+        def copy_to_future(deferred):
+            if deferred.cancelled():
+                future.cancel()
+            elif not future.done():
+                try:
+                    future.set_result(deferred._result)
+                except concurrent.futures.InvalidStateError:
+                    # The future was cancelled from elsewhere.
+                    pass
+
+        def copy_to_deferred(future):
+            if future.cancelled():
+                self.cancel()
+
+        future.add_done_callback(copy_to_deferred)
+        self.add_done_callback(copy_to_future)
+        return future
 
 
 class VoicemacsError(RuntimeError):
@@ -169,6 +288,7 @@ def emacs_focussed():
 
 def _connect() -> None:
     global _socket, _outgoing_nonce, _receive_thread, voicemacs_connected
+    global _batch_supported
     host = "localhost"
     session_file_path = os.path.join(_TEMP_FOLDER, "voicemacs", "session.json")
     if os.path.isfile(session_file_path):
@@ -188,6 +308,7 @@ def _connect() -> None:
         with _socket_lock:
             with _pending_lock:
                 _outgoing_nonce = 1
+            _batch_supported = None
             _socket = socket.socket()
             _socket.connect((host, port))
             LOGGER.info("Voicemacs connected")
@@ -230,37 +351,103 @@ def _try_connect():
                 LOGGER.debug(f"Problem connecting to Voicemacs server: {e}")
 
 
+class _FrameDecoder(object):
+    """Incrementally split a byte stream into null-terminated frames.
+
+    Bytes are accumulated in a `bytearray`, and each byte is only scanned for a
+    terminator once. Frames are only decoded once they're complete, so
+    multibyte characters split across chunks are handled correctly.
+
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """Add ``chunk`` to the stream. Returns all newly completed frames."""
+        buffer = self._buffer
+        # Everything already buffered is known not to contain a terminator.
+        search_from = len(buffer)
+        buffer += chunk
+        frames = []
+        frame_start = 0
+        while True:
+            terminator = buffer.find(b"\0", search_from)
+            if terminator == -1:
+                break
+            # Empty frames are produced by the leading terminator of each
+            # message. Skip them.
+            if terminator > frame_start:
+                frames.append(bytes(buffer[frame_start:terminator]))
+            frame_start = search_from = terminator + 1
+        if frame_start:
+            del buffer[:frame_start]
+        return frames
+
+
 def _receive_until_closed(s: socket.socket) -> None:
+    recording = open(STREAM_RECORDING_PATH, "ab") if STREAM_RECORDING_PATH else None
     try:
-        message_so_far = ""
+        decoder = _FrameDecoder()
         while True:
-            chunk = _socket.recv(4096).decode("utf-8")
-            remaining_chunk = chunk
-            while True:
-                next_terminator = _RE_TERMINATION_CHAR.search(remaining_chunk)
-                if not next_terminator:
-                    break
-                full_message = (
-                    message_so_far + remaining_chunk[: next_terminator.start()]
-                )
-                if full_message:
-                    message_so_far = ""
+            chunk = s.recv(RECEIVE_BUFFER_SIZE)
+            if not chunk:
+                break
+            if recording:
+                recording.write(chunk)
+            # Updates that arrive together are applied as one batch.
+            with emacs_state.batch():
+                for frame in decoder.feed(chunk):
                     try:
-                        _handle_message(s, full_message)
+                        _handle_message(s, frame.decode("utf-8"))
                     except Exception as e:
                         # TODO: Error handling for broken handler?
                         LOGGER.info(f'Unexpected error handling message: "{e}"')
-                remaining_chunk = remaining_chunk[next_terminator.end() :]
-            # If there's an unfinished message, store it for subsequent chunks.
-            message_so_far += remaining_chunk
     except Exception as e:
         LOGGER.debug(f"Problem receiving voicemacs data: {e}")
+    finally:
+        if recording:
+            recording.close()
 
     # Treat all issues as a disconnect & force it to be consistent.
     LOGGER.info("Voicemacs disconnected")
     _force_disconnect()
 
 
+def replay_stream(path: str, chunk_size: int = RECEIVE_BUFFER_SIZE) -> float:
+    """Benchmark decoding of a recorded stream. Returns time taken, in secs.
+
+    Record a stream by setting `STREAM_RECORDING_PATH` & reconnecting - the
+    initial state sync is the interesting part. The stream is replayed in
+    ``chunk_size`` pieces, framed, decoded & parsed, and state updates are
+    applied to a scratch store (so no hooks run).
+
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    chunks = [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+    store = KeyValueStore()
+    n_messages = 0
+    start = time.perf_counter()
+    decoder = _FrameDecoder()
+    for chunk in chunks:
+        for frame in decoder.feed(chunk):
+            try:
+                message = json.loads(frame.decode("utf-8"))
+            except ValueError:
+                # e.g. pings
+                continue
+            n_messages += 1
+            if isinstance(message, dict) and message.get("type") == "update":
+                data_ = message.get("data", {})
+                store.update({data_.get("key"): data_.get("value")})
+    elapsed = time.perf_counter() - start
+    LOGGER.info(
+        f"Replayed {len(data)} bytes ({n_messages} messages) in {elapsed * 1000:.1f}ms"
+    )
+    return elapsed
+
+
 def _force_disconnect(*_, **__):
     """Force a disconnect.
 
@@ -356,13 +543,18 @@ def _handle_request(nonce: Optional[int], type_: str, data: dict):
 
 
 def _handle_response(nonce: Optional[int], type_: str, data: dict):
-    # TODO: Timeout on callback? So it won't be called if the response comes in
-    #   after the timeout.
     with _pending_lock:
-        deferred = _pending_requests.get(nonce)
-        if deferred:
-            deferred.set((type_, data))
-            del _pending_requests[nonce]
+        deferred = _pending_requests.pop(nonce, None)
+    # Set outside the lock - this runs the deferred's callbacks. If the request
+    # already timed out, the deferred was cancelled & the response is dropped.
+    if deferred:
+        deferred.set((type_, data))
+
+
+def _discard_request(nonce: int) -> None:
+    """Stop tracking the request with ``nonce``, if it's still pending."""
+    with _pending_lock:
+        _pending_requests.pop(nonce, None)
 
 
 def _authenticate(auth_key) -> None:
@@ -376,41 +568,104 @@ def _authenticate(auth_key) -> None:
         raise ServerError("Unknown response type", type_, data)
 
 
-def rpc_call(method: str, params: List = [], async_: bool = False, timeout=5):
-    deferred = send_request(
+def _make_rpc_call(method: str, params: List, id_: str) -> dict:
+    return {
+        "jsonrpc": "2.0",
+        "id": id_,
+        "method": method,
+        "params": params,
+    }
+
+
+def _send_rpc(call) -> DeferredResult:
+    """Send an RPC ``call``. It may be a single call, or a list (a batch)."""
+    return send_request(
         "json-rpc-call",
         {
             # RPC call has to be sent as an *encoded* string.
             #
             # TODO: This is because of the separation in `json-rpc-server.el`.
             #   Remove that abstraction in the Emacs package?
-            "call": json.dumps(
-                {
-                    "jsonrpc": "2.0",
-                    # Just use the request nonce for the ID. It will be unique.
-                    "id": str(_outgoing_nonce),
-                    "method": method,
-                    "params": params,
-                }
-            ),
+            "call": json.dumps(call),
         },
     )
+
+
+def _decode_rpc_response(type_: str, data: dict):
+    """Decode the JSON-RPC response object from a `json-rpc-call` response."""
+    if type_ == "json-rpc-result":
+        # The remote procedure was called - now establish whether it
+        # succeeded.
+        return json.loads(data["json-result"])
+    else:
+        raise ServerError("Internal error", type_, data)
+
+
+def _rpc_result(response: dict):
+    """Extract the result from one JSON-RPC response object."""
+    if "result" in response:
+        return response["result"]
+    else:
+        raise JsonRpcError('Error executing function: "{}"'.format(response["error"]))
+
+
+def rpc_call(method: str, params: List = [], async_: bool = False, timeout=5):
+    deferred = _send_rpc(
+        # Just use the request nonce for the ID. It will be unique.
+        _make_rpc_call(method, params, str(_outgoing_nonce))
+    )
     if async_:
         return None
     else:
-        type_, data = deferred.get(timeout)
-        if type_ == "json-rpc-result":
-            # The remote procedure was called - now establish whether it
-            # succeeded.
-            data = json.loads(data["json-result"])
-            if "result" in data:
-                return data["result"]
-            else:
-                raise JsonRpcError(
-                    'Error executing function: "{}"'.format(data["error"])
-                )
-        else:
-            raise ServerError("Internal error", type_, data)
+        return _rpc_result(_decode_rpc_response(*deferred.get(timeout)))
+
+
+def _rpc_sequential(calls: List, timeout) -> List:
+    return [rpc_call(method, params, timeout=timeout) for method, params in calls]
+
+
+def rpc_batch(calls: List, timeout=5) -> List:
+    """Make multiple RPC calls in a single round trip.
+
+    ``calls`` should be a list of ``(method, params)`` tuples. They're sent as
+    one JSON-RPC batch, in one message, and Emacs executes them in order.
+    Returns a list of the results, in the same order as ``calls``.
+
+    If the server doesn't accept batches, the calls are made one at a time
+    instead (and batches aren't tried again until we reconnect).
+
+    If any call fails, a `JsonRpcError` is raised for the first failure (the
+    other calls will still have been executed).
+
+    """
+    global _batch_supported
+    if not calls:
+        return []
+    if _batch_supported is False:
+        return _rpc_sequential(calls, timeout)
+    # IDs only need to be unique within the batch - we use them to match the
+    # responses back up to their calls.
+    batch = [
+        _make_rpc_call(method, params, str(i))
+        for i, (method, params) in enumerate(calls)
+    ]
+    try:
+        responses = _decode_rpc_response(*_send_rpc(batch).get(timeout))
+    except ServerError as e:
+        responses = e
+    if not isinstance(responses, list):
+        # The server rejected the batch as a whole, so none of the calls ran.
+        LOGGER.info(
+            f"Voicemacs server rejected an RPC batch, not batching: {responses}"
+        )
+        _batch_supported = False
+        return _rpc_sequential(calls, timeout)
+    _batch_supported = True
+    by_id = {response.get("id"): response for response in responses}
+    try:
+        return [_rpc_result(by_id[call["id"]]) for call in batch]
+    except KeyError as e:
+        raise JsonRpcError(f"No response to batched call with id {e}")
 
 
 def _make_error(nonce: Optional[int], error_type: str, error_message: str):
@@ -451,10 +706,13 @@ def _send_request(type_: str, data: dict) -> DeferredResult:
     with _pending_lock:
         # This will be used by the receiver to set the deferred result & invoke
         # the callback.
-        nonce = _outgoing_nonce
         _outgoing_nonce += 1
-        _pending_requests[_outgoing_nonce] = deferred
-    _send(_make_request(_outgoing_nonce, type_, data))
+        nonce = _outgoing_nonce
+        _pending_requests[nonce] = deferred
+    # Once the deferred is finished (or it times out & is cancelled), it no
+    # longer needs to be tracked. Without this, timed out requests would leak.
+    deferred.add_done_callback(lambda _: _discard_request(nonce))
+    _send(_make_request(nonce, type_, data))
     return deferred
 
 
@@ -508,6 +766,27 @@ def run_command(command, prefix_arg=None):
     return result
 
 
+def run_commands(commands: List[str]) -> List:
+    """Run multiple Emacs commands, in order, with one round trip.
+
+    Each element of ``commands`` is either a command name, or a ``(command,
+    prefix_arg)`` tuple. Because all the commands are injected at once, we
+    only need to wait for injection once.
+
+    """
+    calls = []
+    for command in commands:
+        if isinstance(command, str):
+            command, prefix_arg = command, None
+        else:
+            command, prefix_arg = command
+        calls.append(("voicemacs-inject-command", [command, prefix_arg]))
+    results = rpc_batch(calls)
+    # See `run_command` for why we wait.
+    actions.sleep(POST_COMMAND_INJECTION_WAIT)
+    return results
+
+
 # TODO: An overlay that shows voicemacs connection status (iff Emacs is active)
 
 
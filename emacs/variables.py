@@ -6,18 +6,24 @@ from talon import Context, actions
 from user.utils import spoken_form
 from user.emacs.utils.voicemacs import rpc_call, emacs_state
 from user.utils.formatting import separate_words
+from user.utils.list_publisher import ListPublisher
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.INFO)
 
 
 ACTIVE_SYMBOLS_KEY = "active-symbols"
+# Only this many symbols are speakable - the first ones Emacs sends.
+MAX_ACTIVE_SYMBOLS = 300
 
 
 context = Context()
 context.matches = """
 tag: user.emacs
 """
+symbols_publisher = ListPublisher(
+    context, "user.active_symbols", max_entries=MAX_ACTIVE_SYMBOLS
+)
 
 
 @context.action_class("user")
@@ -46,32 +52,16 @@ class EmacsActions:
 
 def _update_symbols(state):
     """Update the currently active symbols."""
-    global context
-    # TODO: Maybe add a hard cap on the total number here? Might be better to do
-    #   that in Emacs, but I think I want redundancy.
-    symbols = state.get(ACTIVE_SYMBOLS_KEY, [])
-    whole_symbols = {}
-    symbol_sections = {}
+    symbols = state.get(ACTIVE_SYMBOLS_KEY) or []
+    whole_symbols = []
     for symbol in symbols:
         # TODO: Clean up the `lower` calls here. Pull them into `spoken_form`.
         separated = separate_words(symbol)
         if len(separated) > 1:
-            whole_symbols[spoken_form(separated).lower()] = separated.lower()
-            for component in separated.split(" "):
-                # TODO: Don't allow clashes here? E.g. "Target" & "target". Might
-                #   not need to, Talon might optimize them.
-                symbol_sections[spoken_form(component).lower()] = component.lower()
-    LOGGER.debug(whole_symbols)
-    LOGGER.debug(
-        "Updating Emacs symbols: {} symbols, {} sections added.".format(
-            len(whole_symbols), len(symbol_sections),
-        )
-    )
-    context.lists["user.active_symbols"] = whole_symbols
-    # Don't assign sections for now. Can integrate them later.
-    # context.lists["user.active_symbol_sections"] = symbol_sections
+            whole_symbols.append((spoken_form(separated).lower(), separated.lower()))
+    LOGGER.debug(f"Updating Emacs symbols: {len(whole_symbols)} symbols.")
+    # Symbol sections aren't published for now. Can integrate them later.
+    symbols_publisher.update(whole_symbols)
 
 
-# TODO: Re-enable this at some point. The recompile is just too slow right
-#   now.
-# emacs_state.hook_key(ACTIVE_SYMBOLS_KEY, _update_symbols)
+emacs_state.hook_key(ACTIVE_SYMBOLS_KEY, _update_symbols)
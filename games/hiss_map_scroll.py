@@ -133,7 +133,7 @@ class EyeScroller(object):
 
     def _update_scroll(self):
         gaze_history = get_gaze_history()
-        if len(gaze_history.history) < 2:
+        if len(gaze_history) < 2:
             return
         latest = gaze_history.latest
         if latest is None:
@@ -7,6 +7,12 @@ import skia
 from talon import Module, Context, canvas, actions, ui, app
 from talon.ui import Rect
 
+from user.misc.clickable_overlay.hint_labels import (
+    LabelTrie,
+    assign_labels,
+    fitts_difficulty,
+)
+
 
 VALID_KEYS = "fjdkghtyruievnmcbwopaqzslx"
 RELATIVE_FONT_SIZE = 10
@@ -46,104 +52,222 @@ ACTION_COLORS = {
 
 candidates_lock = threading.RLock()
 active_candidates = []
+# Trie of every candidate's label, narrowed as keys are pressed.
+label_trie = None
 overlay_closed_callback = None
 
 
-def draw(c):
-    paint = c.paint
-
-    if app.platform == "windows":
-        default_font = "Consolas"
-    else:
-        default_font = "monospace"
-
-    auto_scaling_factor = max(c.width, c.height) / 1920
-
-    # Blend like this so we can have a translucent blackout background, but
-    # still have transparent sections for each button.
-    paint.blendmode = paint.Blend.SRC
-    # ['Blend', 'ClipOp', 'FilterQuality', 'Style', 'TextAlign', 'antialias', 'autohinted', 'blendmode', 'break_text', 'clone', 'color',
-    #  'colorfilter', 'dev_kern_text', 'dither', 'embedded_bitmap_text', 'fake_bold_text', 'filter_quality', 'font', 'handle', 'hinting',
-    #  'imagefilter', 'lcd_render_text', 'linear_text', 'maskfilter', 'measure_text', 'path_effect', 'shader', 'stroke_cap',
-    #  'stroke_join', 'stroke_miter', 'stroke_width', 'style', 'subpixel_text', 'text_align', 'text_scale_x', 'text_skew_x', 'textsize',
-    #  'typeface', 'verticaltext']
-    # ['CLEAR', 'COLOR', 'COLORBURN', 'COLORDODGE', 'DARKEN', 'DIFFERENCE', 'DST', 'DSTATOP', 'DSTIN', 'DSTOUT', 'DSTOVER', 'EXCLUSION',
-    #  'HARDLIGHT', 'HUE', 'LIGHTEN', 'LUMINOSITY', 'MODULATE', 'MULTIPLY', 'OVERLAY', 'PLUS', 'SATURATION', 'SCREEN', 'SOFTLIGHT',
-    #  'SRC', 'SRCATOP', 'SRCIN', 'SRCOUT', 'SRCOVER', 'XOR']
-
-    derived_textsize = auto_scaling_factor * RELATIVE_FONT_SIZE
-    paint.textsize = int(max(round(derived_textsize), MIN_FONT_SIZE))
-    paint.typeface = default_font
-    paint.embolden = True
-    paint.style = paint.Style.FILL
-    text_height = paint.measure_text("pgTlHjhgy")[1].height
-    tail_height = paint.measure_text("p")[1].height - paint.measure_text("o")[1].height
-
-    corner_radius = int(max(round(auto_scaling_factor * 3), 4))
-    box_stroke_width = max(round(auto_scaling_factor) * RELATIVE_BOX_STROKE_WIDTH, 1)
-    bounding_box_offset = int(round(box_stroke_width / 2))
-    bounding_box_reduction = int(round(box_stroke_width))
-    box_stroke_width = int(box_stroke_width)
-
-    text_offset = max(round(auto_scaling_factor * derived_textsize / 14), 1)
-    text_box_expansion = int(round(text_offset * 2))
-    text_offset = int(round(text_offset))
-
-    paint.color = "00000088"
-    c.draw_rect(c.rect)
+class _OverlayStyle:
+    """Sizes & font metrics for one canvas. These only depend on its size."""
 
-    with candidates_lock:
-        # TODO: Try batching draw calls with similar paint properties.
-        for candidate in active_candidates:
-            box_color, text_color = ACTION_COLORS[candidate.action_type]
+    def __init__(self, c):
+        paint = c.paint
+
+        if app.platform == "windows":
+            self.font = "Consolas"
+        else:
+            self.font = "monospace"
+
+        auto_scaling_factor = max(c.width, c.height) / 1920
+
+        derived_textsize = auto_scaling_factor * RELATIVE_FONT_SIZE
+        self.textsize = int(max(round(derived_textsize), MIN_FONT_SIZE))
+        self.apply_font(paint)
+        self.text_height = paint.measure_text("pgTlHjhgy")[1].height
+        self.tail_height = (
+            paint.measure_text("p")[1].height - paint.measure_text("o")[1].height
+        )
+
+        self.corner_radius = int(max(round(auto_scaling_factor * 3), 4))
+        box_stroke_width = max(
+            round(auto_scaling_factor) * RELATIVE_BOX_STROKE_WIDTH, 1
+        )
+        self.bounding_box_offset = int(round(box_stroke_width / 2))
+        self.bounding_box_reduction = int(round(box_stroke_width))
+        self.box_stroke_width = int(box_stroke_width)
+
+        text_offset = max(round(auto_scaling_factor * derived_textsize / 14), 1)
+        self.text_box_expansion = int(round(text_offset * 2))
+        self.text_offset = int(round(text_offset))
+
+    def apply_font(self, paint):
+        paint.textsize = self.textsize
+        paint.typeface = self.font
+        paint.embolden = True
 
+
+def _overlaps(a, b) -> bool:
+    return (
+        a.x < b.x + b.width
+        and b.x < a.x + a.width
+        and a.y < b.y + b.height
+        and b.y < a.y + a.height
+    )
+
+
+class _ScreenOverlay:
+    """The overlay canvas on one screen, and a cache of what it draws.
+
+    Each candidate's geometry and each label's text metrics are computed once,
+    on first draw. Only candidates that intersect the screen are drawn, and
+    the canvas is only redrawn when its labels or actions have changed.
+
+    """
+
+    def __init__(self, screen, candidates):
+        self.canvas = canvas.Canvas.from_screen(screen)
+        # HOTFIX: from_screen not working right on Windows
+        if app.platform == "windows":
+            hotfix_rect = Rect(*screen.rect)
+            hotfix_rect.height -= 1
+            self.canvas.rect = hotfix_rect
+        rect = self.canvas.rect
+        self._candidate_ids = {
+            id(candidate)
+            for candidate in candidates
+            if _overlaps(candidate.clickable.bounds, rect)
+        }
+        self._style = None
+        # Maps ``id(candidate)`` to ``(box_rrect, x, y)``.
+        self._boxes = {}
+        # Maps label text to ``(x_offset, width)``.
+        self._text_metrics = {}
+        # Maps ``(id(candidate), text)`` to the label's `RoundRect`.
+        self._label_rrects = {}
+        # What's drawn, as ``(candidate, text, action_type)`` tuples.
+        self._shown = None
+        self._pending = self._visible()
+        self.canvas.register("draw", self.draw)
+        self.canvas.register("focus", on_focus)
+        self.canvas.freeze()
+
+    def _visible(self):
+        depth = label_trie.depth
+        ids = self._candidate_ids
+        return [
+            (candidate, candidate.label[depth:], candidate.action_type)
+            for candidate in active_candidates
+            if id(candidate) in ids
+        ]
+
+    def redraw(self):
+        """Redraw the canvas - but only if its contents have changed."""
+        visible = self._visible()
+        if visible != self._shown:
+            self._pending = visible
+            self.canvas.resume()
+            self.canvas.freeze()
+
+    def close(self):
+        self.canvas.unregister("draw", self.draw)
+        self.canvas.unregister("focus", on_focus)
+        self.canvas.close()
+
+    def _box(self, candidate):
+        box = self._boxes.get(id(candidate))
+        if not box:
+            style = self._style
             bounds = Rect(*candidate.clickable.bounds)
-            bounds.x += bounding_box_offset
-            bounds.y += bounding_box_offset
-            bounds.width -= bounding_box_reduction
-            bounds.height -= bounding_box_reduction
-            rrect = skia.RoundRect.from_rect(bounds, x=corner_radius, y=corner_radius)
-            text = "".join(candidate.label)
+            bounds.x += style.bounding_box_offset
+            bounds.y += style.bounding_box_offset
+            bounds.width -= style.bounding_box_reduction
+            bounds.height -= style.bounding_box_reduction
+            rrect = skia.RoundRect.from_rect(
+                bounds, x=style.corner_radius, y=style.corner_radius
+            )
+            box = (rrect, bounds.x, bounds.y)
+            self._boxes[id(candidate)] = box
+        return box
+
+    def _label_rrect(self, candidate, text, paint):
+        key = (id(candidate), text)
+        label_rrect = self._label_rrects.get(key)
+        if not label_rrect:
+            style = self._style
+            _, x, y = self._box(candidate)
+            _, width = self._measure(text, paint)
+            label_rect = Rect(
+                x,
+                y,
+                width + style.text_box_expansion,
+                style.text_height + style.text_box_expansion,
+            )
+            label_rrect = skia.RoundRect.from_rect(
+                label_rect, x=style.corner_radius, y=style.corner_radius
+            )
+            self._label_rrects[key] = label_rrect
+        return label_rrect
+
+    def _measure(self, text, paint):
+        metrics = self._text_metrics.get(text)
+        if not metrics:
             _, text_dims = paint.measure_text(text)
+            metrics = (text_dims.x, text_dims.width)
+            self._text_metrics[text] = metrics
+        return metrics
+
+    def draw(self, c):
+        paint = c.paint
+        if not self._style:
+            self._style = _OverlayStyle(c)
+        style = self._style
+        style.apply_font(paint)
+
+        # Blend like this so we can have a translucent blackout background, but
+        # still have transparent sections for each button.
+        paint.blendmode = paint.Blend.SRC
+        # ['Blend', 'ClipOp', 'FilterQuality', 'Style', 'TextAlign', 'antialias', 'autohinted', 'blendmode', 'break_text', 'clone', 'color',
+        #  'colorfilter', 'dev_kern_text', 'dither', 'embedded_bitmap_text', 'fake_bold_text', 'filter_quality', 'font', 'handle', 'hinting',
+        #  'imagefilter', 'lcd_render_text', 'linear_text', 'maskfilter', 'measure_text', 'path_effect', 'shader', 'stroke_cap',
+        #  'stroke_join', 'stroke_miter', 'stroke_width', 'style', 'subpixel_text', 'text_align', 'text_scale_x', 'text_skew_x', 'textsize',
+        #  'typeface', 'verticaltext']
+        # ['CLEAR', 'COLOR', 'COLORBURN', 'COLORDODGE', 'DARKEN', 'DIFFERENCE', 'DST', 'DSTATOP', 'DSTIN', 'DSTOUT', 'DSTOVER', 'EXCLUSION',
+        #  'HARDLIGHT', 'HUE', 'LIGHTEN', 'LUMINOSITY', 'MODULATE', 'MULTIPLY', 'OVERLAY', 'PLUS', 'SATURATION', 'SCREEN', 'SOFTLIGHT',
+        #  'SRC', 'SRCATOP', 'SRCIN', 'SRCOUT', 'SRCOVER', 'XOR']
+        paint.style = paint.Style.FILL
+        paint.color = "00000088"
+        c.draw_rect(c.rect)
 
-            label_rect = Rect(bounds.x, bounds.y, text_dims.width, text_height)
-            label_rect.width += text_box_expansion
-            label_rect.height += text_box_expansion
+        with candidates_lock:
+            visible = self._pending
+            self._shown = visible
+            # Batch draw calls by paint state - group candidates by action,
+            # since that decides their colors.
+            by_action = {}
+            for candidate, text, action_type in visible:
+                by_action.setdefault(action_type, []).append((candidate, text))
 
             # TODO: Border, like a drop shadow.
-            # paint.stroke_width = int(
-            #     round(max(box_stroke_width * 2, box_stroke_width + 2))
-            # )
-            # c.draw_rrect(rrect)
-            # c.draw_rect(label_rect)
 
             # Override the underlying transparency - make the areas where
             # buttons are highlighted transparent
             paint.style = paint.Style.FILL
             paint.color = "00000000"
-            c.draw_rrect(rrect)
-
-            paint.style = paint.Style.STROKE
-            paint.color = box_color
-            paint.stroke_width = box_stroke_width
-            c.draw_rrect(rrect)
-
-            paint.style = paint.Style.STROKE_AND_FILL
-            c.draw_rrect(
-                rrect=skia.RoundRect.from_rect(
-                    label_rect, x=corner_radius, y=corner_radius
-                )
-            )
-            # c.draw_rect(label_rect)
-
-            paint.color = text_color
-            paint.style = paint.Style.FILL
-            # FIXME: Remove the .85 fudge factor. Derive it precisely.
-            c.draw_text(
-                text,
-                bounds.x + text_offset - text_dims.x,
-                bounds.y + text_offset + text_height - tail_height,
-            )
+            for candidate, _, _ in visible:
+                c.draw_rrect(self._box(candidate)[0])
+
+            paint.stroke_width = style.box_stroke_width
+            text_y_offset = style.text_offset + style.text_height - style.tail_height
+            for action_type, group in by_action.items():
+                box_color, text_color = ACTION_COLORS[action_type]
+
+                paint.style = paint.Style.STROKE
+                paint.color = box_color
+                for candidate, _ in group:
+                    c.draw_rrect(self._box(candidate)[0])
+
+                paint.style = paint.Style.STROKE_AND_FILL
+                for candidate, text in group:
+                    c.draw_rrect(self._label_rrect(candidate, text, paint))
+
+                paint.color = text_color
+                paint.style = paint.Style.FILL
+                for candidate, text in group:
+                    _, x, y = self._box(candidate)
+                    text_x, _ = self._measure(text, paint)
+                    c.draw_text(
+                        text, x + style.text_offset - text_x, y + text_y_offset
+                    )
 
 
 def on_key(event):
@@ -169,40 +293,29 @@ def on_overlay_closed():
         overlay_closed_callback = None
 
 
-canvases = []
+screen_overlays = []
 overlays_active_context = Context()
 
 
 def create_canvases():
     destroy_canvases()
-    for screen in ui.screens():
-        c = canvas.Canvas.from_screen(screen)
-        # HOTFIX: from_screen not working right on Windows
-        if app.platform == "windows":
-            hotfix_rect = Rect(*screen.rect)
-            hotfix_rect.height -= 1
-            c.rect = hotfix_rect
-        c.register("draw", draw)
-        c.register("focus", on_focus)
-        c.freeze()
-        canvases.append(c)
+    with candidates_lock:
+        for screen in ui.screens():
+            screen_overlays.append(_ScreenOverlay(screen, active_candidates))
     overlays_active_context.tags = ["user.clickable_overlay_active"]
-    # canvases[0].focused = True
+    # screen_overlays[0].canvas.focused = True
 
 
 def destroy_canvases():
     overlays_active_context.tags = []
-    for c in canvases:
-        c.unregister("draw", draw)
-        c.unregister("focus", on_focus)
-        c.close()
-    canvases.clear()
+    for overlay in screen_overlays:
+        overlay.close()
+    screen_overlays.clear()
 
 
 def redraw_canvases():
-    for c in canvases:
-        c.resume()
-        c.freeze()
+    for overlay in screen_overlays:
+        overlay.redraw()
 
 
 class LabelTypes(Enum):
@@ -280,30 +393,34 @@ class Actions:
         overlay_closed_callback_: Optional[Callable] = None,
     ):
         """Show all candidates in the clickable overlay"""
-        global active_candidates, overlay_closed_callback
+        global active_candidates, label_trie, overlay_closed_callback
 
-        # Now assign labels - this currently uses a naive method. Needs improving.
-        labels = []
-        labelled_candidates = []
-        for char_0 in VALID_KEYS:
-            child_set = set(VALID_KEYS)
-            child_set.remove(char_0)
-            for char_1 in child_set:
-                labels.append([char_0, char_1])
-        for i, candidate in enumerate(candidates):
-            if label_type == LabelTypes.FOCUSABLE:
-                action_type = ActionTypes.FOCUS
-            else:
-                action_type = ActionTypes.LEFT_CLICK
-            labelled_candidates.append(
-                # TODO: Remove label_type. Should I just color based on the
-                #   current action? Also narrow based on the current action? No,
-                #   do it per item. Ok but then how to arrange?
-                LabelledCandidate(candidate, labels[i], action_type)
-            )
+        if label_type == LabelTypes.FOCUSABLE:
+            action_type = ActionTypes.FOCUS
+        else:
+            action_type = ActionTypes.LEFT_CLICK
+        # The shortest labels go to the targets that are easiest to hit from
+        # the mouse's current position.
+        mouse_position = (actions.mouse_x(), actions.mouse_y())
+        labels = assign_labels(
+            candidates,
+            VALID_KEYS,
+            lambda candidate: fitts_difficulty(candidate.bounds, mouse_position),
+        )
+        labelled_candidates = [
+            # TODO: Remove label_type. Should I just color based on the
+            #   current action? Also narrow based on the current action? No,
+            #   do it per item. Ok but then how to arrange?
+            LabelledCandidate(candidate, label, action_type)
+            for candidate, label in zip(candidates, labels)
+        ]
 
         with candidates_lock:
             active_candidates = labelled_candidates
+            label_trie = LabelTrie(
+                [candidate.label for candidate in labelled_candidates],
+                labelled_candidates,
+            )
             overlay_closed_callback = overlay_closed_callback_
 
         create_canvases()
@@ -321,12 +438,7 @@ class Actions:
                 redraw_canvases()
         else:
             with candidates_lock:
-                active_candidates = list(
-                    filter(
-                        lambda it: it.label and it.label[0] == key,
-                        active_candidates,
-                    )
-                )
+                active_candidates = label_trie.narrow(key) or []
                 if len(active_candidates) == 0:
                     # Invalid key - stop narrowing and cancel
                     actions.self.clickable_cancel()
@@ -364,19 +476,17 @@ class Actions:
                         if candidate.clickable.post_click_callback:
                             candidate.clickable.post_click_callback()
                     finally:
-                        active_candidates.clear()
+                        active_candidates = []
                         destroy_canvases()
                         on_overlay_closed()
                 else:
                     # Now we target the next char in the label
-                    for candidate in active_candidates:
-                        candidate.label = candidate.label[1:]
                     redraw_canvases()
 
     def clickable_cancel():
         """Close the current clickable overlay and cancel the operation."""
-        global overlay_closed_callback
+        global active_candidates, overlay_closed_callback
         destroy_canvases()
         with candidates_lock:
-            active_candidates.clear()
+            active_candidates = []
             on_overlay_closed()
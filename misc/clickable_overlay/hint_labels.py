@@ -0,0 +1,119 @@
+"""Hint labels for the clickable overlay.
+
+Labels are prefix-free, so a label is selected as soon as it's fully typed.
+They're as short as possible - if there are more candidates than keys, only
+as many labels are lengthened as necessary - and the shortest labels go to
+the easiest targets.
+
+Narrowing walks a trie of the labels, so each keypress is a dict lookup no
+matter how many candidates there are.
+
+"""
+
+import math
+import itertools
+from typing import Any, List, Optional, Sequence
+
+
+def generate_labels(n: int, alphabet: str) -> List[str]:
+    """Generate ``n`` prefix-free labels, shortest first.
+
+    Earlier characters in ``alphabet`` are preferred, so put the easiest keys
+    first. Labels are at most one character longer than the shortest possible
+    for ``n``.
+
+    """
+    k = len(alphabet)
+    if n <= 0:
+        return []
+    if n <= k:
+        return list(alphabet[:n])
+    # Find the smallest depth with enough labels.
+    depth = 1
+    while k**depth < n:
+        depth += 1
+    n_short = k ** (depth - 1)
+    # Lengthen just enough of the shorter labels, worst first. Each one that's
+    # lengthened is replaced by ``k`` labels.
+    n_expanded = math.ceil((n - n_short) / (k - 1))
+    short = [
+        "".join(chars) for chars in itertools.product(alphabet, repeat=depth - 1)
+    ]
+    labels = short[: n_short - n_expanded]
+    for prefix in short[n_short - n_expanded :]:
+        labels.extend(prefix + char for char in alphabet)
+    return labels[:n]
+
+
+def fitts_difficulty(bounds, origin) -> float:
+    """How hard it would be to hit ``bounds`` from ``origin``.
+
+    Uses the Shannon formulation of Fitts' law, so large, nearby targets are
+    easiest. ``bounds`` is a `Rect`, ``origin`` an ``(x, y)`` tuple.
+
+    """
+    center_x = bounds.x + bounds.width / 2
+    center_y = bounds.y + bounds.height / 2
+    distance = math.hypot(center_x - origin[0], center_y - origin[1])
+    width = max(min(bounds.width, bounds.height), 1)
+    return math.log2(distance / width + 1)
+
+
+class _Node:
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children = {}
+        self.values = []
+
+
+class LabelTrie:
+    """Trie of labels, with a cursor that's narrowed one key at a time."""
+
+    def __init__(self, labels: Sequence[str], values: Sequence[Any]):
+        self.root = _Node()
+        for label, value in zip(labels, values):
+            node = self.root
+            node.values.append(value)
+            for char in label:
+                node = node.children.setdefault(char, _Node())
+                node.values.append(value)
+        self._node = self.root
+        self.depth = 0
+
+    @property
+    def values(self) -> List[Any]:
+        """The values whose labels match everything typed so far."""
+        return self._node.values
+
+    def narrow(self, key: str) -> Optional[List[Any]]:
+        """Narrow by one more key. Returns the values still matching.
+
+        Returns None (and doesn't move) if no label continues with ``key``.
+
+        """
+        node = self._node.children.get(key)
+        if node is None:
+            return None
+        self._node = node
+        self.depth += 1
+        return node.values
+
+
+def assign_labels(values: Sequence[Any], alphabet: str, difficulty=None) -> List[str]:
+    """Label each of ``values``, giving the shortest labels to the easiest.
+
+    ``difficulty`` maps a value to a sortable difficulty. If it's not
+    provided, labels are assigned in order.
+
+    Returns the labels, in the same order as ``values``.
+
+    """
+    labels = generate_labels(len(values), alphabet)
+    if difficulty is None:
+        return labels
+    order = sorted(range(len(values)), key=lambda i: difficulty(values[i]))
+    assigned = [None] * len(values)
+    for label, i in zip(labels, order):
+        assigned[i] = label
+    return assigned
@@ -0,0 +1,541 @@
+"""Persistent index of launchable programs - Appx packages and shortcuts.
+
+Enumerating Appx packages means spawning PowerShell, and finding shortcuts
+means walking the Start Menu, so both are slow. This index caches them as JSON
+and only rescans when something may have changed:
+
+- Shortcut directories are rescanned when any of their mtimes change.
+- Appx packages are re-listed when they're older than
+  `APPX_REFRESH_INTERVAL`, or on demand.
+
+Nothing in here depends on Talon, so the parsing & matching can be run against
+captured `Get-AppxPackage` output & fixture directories on any OS, without
+Talon installed - see `self_check`:
+
+    python -c "import runpy; runpy.run_path('misc/launcher_index.py')['self_check']()"
+
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+import tempfile
+import subprocess
+import importlib.util
+from itertools import chain
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from user.utils.name_index import NameIndex, RANKED_MIN_SCORE
+except ImportError:
+    # Outside Talon, `user.utils` can't be imported - its `__init__` needs
+    # Talon. `name_index` itself doesn't, so load it straight from its file.
+    _spec = importlib.util.spec_from_file_location(
+        "name_index", Path(__file__).parents[1] / "utils" / "name_index.py"
+    )
+    _name_index = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(_name_index)
+    NameIndex = _name_index.NameIndex
+    RANKED_MIN_SCORE = _name_index.RANKED_MIN_SCORE
+
+
+LOGGER = logging.getLogger(__name__)
+
+# Bump this when the format of the saved index changes.
+INDEX_VERSION = 1
+# Appx packages are re-listed after this many seconds.
+APPX_REFRESH_INTERVAL = 24 * 60 * 60
+# After a failed match, Appx packages are re-listed in the background - but no
+# more often than this, in seconds.
+MISS_REFRESH_INTERVAL = 60
+# For now, only use shortcuts
+LNK_PATTERN = "**/*.lnk"
+
+
+def parse_appx_packages(text: str) -> List[Dict[str, str]]:
+    """Parse the output of PowerShell's `Get-AppxPackage` into dicts."""
+    apps = []
+    for app_text in text.replace("\r\n", "\n").split("\n\n"):
+        app_dict = {}
+        lines = app_text.split("\n")
+        # Some sections will be empty - ignore them.
+        if len(lines) > 1:
+            for line in lines:
+                sections = line.split(":")
+                if len(sections) >= 2:
+                    app_dict[sections[0].strip()] = ":".join(sections[1:])[1:]
+            if app_dict:
+                apps.append(app_dict)
+    return apps
+
+
+def list_appx_packages() -> List[Dict[str, str]]:
+    out = subprocess.check_output(
+        # This will still flash the powershell window even with `-WindowStyle
+        # hidden`, which is a shame, but doesn't seem to be avoidable.
+        'powershell.exe -WindowStyle hidden -ExecutionPolicy Bypass -Command "Get-AppxPackage"',
+        shell=False,
+        text=True,
+    )
+    return parse_appx_packages(out)
+
+
+_RE_SPLIT_WORDS = re.compile(r"[0-9]+|[A-Z]+(?![a-z])|[A-Z]?[a-z]+")
+
+
+def spoken_tokens(name: str) -> List[str]:
+    """Split a program name into lowercase words.
+
+    Splits on punctuation, digits and camel case, so
+    "Microsoft.WindowsTerminal" -> ["microsoft", "windows", "terminal"].
+
+    """
+    return [word.lower() for word in _RE_SPLIT_WORDS.findall(name)]
+
+
+def appx_entries(packages: List[Dict[str, str]]) -> List[Dict]:
+    """Convert parsed Appx packages into index entries."""
+    entries = []
+    for package in packages:
+        name = package.get("Name")
+        family = package.get("PackageFamilyName")
+        if name and family:
+            entries.append(
+                {"name": name, "target": family, "tokens": spoken_tokens(name)}
+            )
+    return entries
+
+
+def shortcut_roots(environ=os.environ) -> List[Path]:
+    """Get the directories to search for shortcuts, highest priority first."""
+    roots = []
+    appdata = environ.get("APPDATA")
+    program_data = environ.get("PROGRAMDATA")
+    if appdata:
+        # Note this will only work if the desktop is on the default path
+        roots.append(Path(appdata) / "Desktop")
+        roots.append(Path(appdata) / "Microsoft/Windows/Start Menu/Programs")
+    if program_data:
+        roots.append(Path(program_data) / "Microsoft/Windows/Start Menu/Programs")
+    return roots
+
+
+def directory_mtimes(roots: List[Path]) -> Dict[str, float]:
+    """Get the mtime of every directory under ``roots``.
+
+    A directory's mtime changes when an entry is added to or removed from it,
+    so if none of these have changed, the shortcuts haven't either.
+
+    """
+    mtimes = {}
+    for root in roots:
+        for directory, _, _ in os.walk(root):
+            try:
+                mtimes[directory] = os.stat(directory).st_mtime
+            except OSError:
+                pass
+    return mtimes
+
+
+def _mtimes_changed(mtimes: Dict[str, float]) -> bool:
+    for directory, mtime in mtimes.items():
+        try:
+            if os.stat(directory).st_mtime != mtime:
+                return True
+        except OSError:
+            return True
+    return False
+
+
+def scan_shortcuts(roots: List[Path]) -> List[Dict]:
+    """Find every shortcut under ``roots``, as index entries.
+
+    Earlier roots take priority. Within that, shorter names come first.
+
+    """
+    entries = []
+    seen = set()
+    # Note we remove the file extension when matching against the program name.
+    # We also never match against the folder.
+    #
+    # TODO: Match against the folder too, maybe?
+    for root in roots:
+        for path in Path(root).glob(LNK_PATTERN):
+            key = (path.stem.lower(), str(path))
+            if key not in seen:
+                seen.add(key)
+                entries.append(
+                    {
+                        "name": path.stem,
+                        "target": str(path),
+                        "tokens": spoken_tokens(path.stem),
+                    }
+                )
+    # HACK: Sort by length of name, so Linux versions get lower priority
+    entries.sort(key=lambda it: len(it["name"]))
+    return entries
+
+
+class LauncherIndex(object):
+    """Cached list of Appx packages & shortcuts, saved as JSON at ``path``.
+
+    Entries are dicts with the program's ``name``, its ``target`` (a package
+    family name for Appx packages, a path for shortcuts) and its spoken
+    ``tokens``.
+
+    `generation` is bumped whenever the entries change, so consumers can
+    cache anything they derive from them.
+
+    """
+
+    def __init__(self, path, roots: List[Path], list_packages=list_appx_packages):
+        self.path = Path(path)
+        self.roots = [Path(root) for root in roots]
+        self._list_packages = list_packages
+        self._data = self._empty()
+        self._shortcuts_stale = True
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._loaded = threading.Event()
+        self.generation = 0
+        # Name indexes of the entries, and the generation they were built from.
+        self._matchers = (None, None)
+        self._last_miss_refresh = None
+
+    @staticmethod
+    def _empty():
+        return {
+            "version": INDEX_VERSION,
+            "roots": [],
+            "appx": [],
+            "appx_time": 0,
+            "shortcuts": [],
+            "mtimes": {},
+        }
+
+    @property
+    def appx(self) -> List[Dict]:
+        return self._data["appx"]
+
+    @property
+    def shortcuts(self) -> List[Dict]:
+        return self._data["shortcuts"]
+
+    def load(self):
+        """Load the saved index, then bring it up to date."""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("version") != INDEX_VERSION:
+                data = self._empty()
+        except FileNotFoundError:
+            data = self._empty()
+        except Exception as e:
+            LOGGER.warning(f"Launcher index is corrupt, rebuilding it: {e}")
+            data = self._empty()
+        with self._lock:
+            self._data = data
+            self.generation += 1
+            self._shortcuts_stale = data["roots"] != [
+                str(root) for root in self.roots
+            ] or _mtimes_changed(data["mtimes"])
+        # A saved index is good enough to use while it's refreshed.
+        if data["appx_time"]:
+            self._loaded.set()
+        try:
+            self.refresh()
+        finally:
+            self._loaded.set()
+
+    def wait_until_loaded(self, timeout: Optional[float] = None) -> bool:
+        return self._loaded.wait(timeout)
+
+    def mark_shortcuts_stale(self):
+        """Make the next refresh rescan the shortcuts."""
+        self._shortcuts_stale = True
+
+    def refresh(self, force_appx: bool = False):
+        """Rescan whatever may be out of date, and save the index."""
+        # Only one refresh at a time - they'd just be repeating each other.
+        with self._refresh_lock:
+            changed = {}
+            if self._shortcuts_stale:
+                self._shortcuts_stale = False
+                start = time.perf_counter()
+                changed["mtimes"] = directory_mtimes(self.roots)
+                changed["shortcuts"] = scan_shortcuts(self.roots)
+                changed["roots"] = [str(root) for root in self.roots]
+                LOGGER.debug(
+                    f"Scanned {len(changed['shortcuts'])} shortcuts in "
+                    f"{time.perf_counter() - start:.2f}s"
+                )
+            appx_age = time.time() - self._data["appx_time"]
+            if force_appx or appx_age > APPX_REFRESH_INTERVAL:
+                try:
+                    changed["appx"] = appx_entries(self._list_packages())
+                    changed["appx_time"] = time.time()
+                except Exception as e:
+                    LOGGER.warning(f"Could not list Appx packages: {e}")
+            if changed:
+                with self._lock:
+                    data = dict(self._data)
+                    data.update(changed)
+                    self._data = data
+                    self.generation += 1
+                self.save()
+
+    def refresh_in_background(self, force_appx: bool = False):
+        threading.Thread(
+            target=self.refresh, kwargs={"force_appx": force_appx}, daemon=True
+        ).start()
+
+    def refresh_after_miss(self) -> bool:
+        """Refresh in the background after a failed match, in case the program
+        was only just installed.
+
+        Rate limited to once per `MISS_REFRESH_INTERVAL`. Returns whether a
+        refresh was started.
+
+        """
+        with self._lock:
+            now = time.monotonic()
+            last = self._last_miss_refresh
+            if last is not None and now - last < MISS_REFRESH_INTERVAL:
+                return False
+            self._last_miss_refresh = now
+        self.refresh_in_background(force_appx=True)
+        return True
+
+    def _get_matchers(self) -> Dict[str, NameIndex]:
+        with self._lock:
+            generation, matchers = self._matchers
+            if generation == self.generation:
+                return matchers
+            generation = self.generation
+            sources = (("appx", self.appx), ("shortcut", self.shortcuts))
+        matchers = {}
+        for kind, entries in sources:
+            # Match on the spoken words as well as the raw name.
+            matchers[kind] = NameIndex(
+                chain.from_iterable(
+                    [(entry["name"], entry), (" ".join(entry["tokens"]), entry)]
+                    for entry in entries
+                )
+            )
+        with self._lock:
+            self._matchers = (generation, matchers)
+        return matchers
+
+    def match(
+        self, program_name: str, match_start: bool = True, match_fuzzy: bool = True
+    ) -> Optional[Tuple[str, str]]:
+        """Match a program name against the index.
+
+        Returns ``(kind, target)``, where ``kind`` is "appx" or "shortcut" - or
+        None if nothing matches.
+
+        """
+        matchers = self._get_matchers()
+        # TODO: Apps take priority over start menu shortcuts under this model - do we want that?
+        for kind in ("appx", "shortcut"):
+            matches = matchers[kind].match(
+                program_name, match_start, match_fuzzy, match_fuzzy
+            )
+            if matches:
+                return kind, matches[0]["target"]
+        if match_fuzzy:
+            # Nothing matched outright - take the closest name of either kind,
+            # so mistranscriptions still launch something sensible.
+            best = None
+            for kind in ("appx", "shortcut"):
+                for score, entry in matchers[kind].ranked(
+                    program_name, 1, RANKED_MIN_SCORE
+                ):
+                    if best is None or score > best[0]:
+                        best = (score, kind, entry["target"])
+            if best:
+                return best[1:]
+        return None
+
+    def save(self):
+        with self._lock:
+            data = self._data
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.path.with_suffix(".tmp")
+            with open(temp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            LOGGER.warning(f"Could not save launcher index: {e}")
+
+
+# Captured `Get-AppxPackage` output (trimmed), as PowerShell prints it.
+_APPX_FIXTURE = """\r
+Name              : Microsoft.WindowsTerminal\r
+Publisher         : CN=Microsoft Corporation, O=Microsoft Corporation, L=Redmond, S=Washington, C=US\r
+Architecture      : X64\r
+Version           : 1.18.3181.0\r
+PackageFullName   : Microsoft.WindowsTerminal_1.18.3181.0_x64__8wekyb3d8bbwe\r
+InstallLocation   : C:\\Program Files\\WindowsApps\\Microsoft.WindowsTerminal_1.18.3181.0_x64__8wekyb3d8bbwe\r
+PackageFamilyName : Microsoft.WindowsTerminal_8wekyb3d8bbwe\r
+\r
+Name              : Microsoft.WindowsCalculator\r
+Publisher         : CN=Microsoft Corporation, O=Microsoft Corporation, L=Redmond, S=Washington, C=US\r
+Architecture      : X64\r
+Version           : 11.2307.4.0\r
+PackageFullName   : Microsoft.WindowsCalculator_11.2307.4.0_x64__8wekyb3d8bbwe\r
+InstallLocation   : C:\\Program Files\\WindowsApps\\Microsoft.WindowsCalculator_11.2307.4.0_x64__8wekyb3d8bbwe\r
+PackageFamilyName : Microsoft.WindowsCalculator_8wekyb3d8bbwe\r
+\r
+Name              : MicrosoftWindows.Client.WebExperience\r
+Publisher         : CN=Microsoft Windows, O=Microsoft Corporation, L=Redmond, S=Washington, C=US\r
+Version           : 423.23500.0.0\r
+\r
+\r
+"""
+
+# Shortcut files to create under the fixture roots, by root.
+_SHORTCUT_FIXTURES = {
+    "Desktop": ["WSL Emacs.lnk", "notes.txt"],
+    "Start Menu": [
+        "Firefox.lnk",
+        "GNU Emacs/Emacs.lnk",
+        "GNU Emacs/Emacs (Linux).lnk",
+        "Accessories/Snipping Tool.lnk",
+    ],
+}
+
+# ``(program_name, match_start, match_fuzzy, expected)``, where ``expected``
+# is ``(kind, target)`` with shortcut paths relative to the fixture directory.
+_KNOWN_MATCHES = [
+    (
+        "microsoft windows terminal",
+        True,
+        True,
+        ("appx", "Microsoft.WindowsTerminal_8wekyb3d8bbwe"),
+    ),
+    (
+        "windows calculator",
+        True,
+        True,
+        ("appx", "Microsoft.WindowsCalculator_8wekyb3d8bbwe"),
+    ),
+    (
+        "calculator windows",
+        True,
+        True,
+        ("appx", "Microsoft.WindowsCalculator_8wekyb3d8bbwe"),
+    ),
+    ("calculator windows", True, False, None),
+    (
+        "Microsoft.WindowsCalculator",
+        False,
+        False,
+        ("appx", "Microsoft.WindowsCalculator_8wekyb3d8bbwe"),
+    ),
+    ("firefox", False, False, ("shortcut", "Start Menu/Firefox.lnk")),
+    ("fire", True, False, ("shortcut", "Start Menu/Firefox.lnk")),
+    ("fire", False, False, None),
+    # Mistranscriptions fall back to the closest name, if it's close enough.
+    ("fire fox", True, True, ("shortcut", "Start Menu/Firefox.lnk")),
+    ("fire fox", True, False, None),
+    (
+        "windows terminus",
+        True,
+        True,
+        ("appx", "Microsoft.WindowsTerminal_8wekyb3d8bbwe"),
+    ),
+    ("zotero", True, True, None),
+    # Shorter names win, whichever root they're in.
+    ("macs", True, True, ("shortcut", "Start Menu/GNU Emacs/Emacs.lnk")),
+    ("wsl emacs", True, True, ("shortcut", "Desktop/WSL Emacs.lnk")),
+    (
+        "tool snipping",
+        True,
+        True,
+        ("shortcut", "Start Menu/Accessories/Snipping Tool.lnk"),
+    ),
+    ("tool snipping", True, False, None),
+    ("notes", True, True, None),
+]
+
+
+def self_check():
+    """Check parsing & matching against the captured fixtures above.
+
+    Builds a throwaway index over fixture directories, so it runs on any OS.
+    Raises `AssertionError` on the first failure.
+
+    """
+    packages = parse_appx_packages(_APPX_FIXTURE)
+    assert [package.get("Name") for package in packages] == [
+        "Microsoft.WindowsTerminal",
+        "Microsoft.WindowsCalculator",
+        "MicrosoftWindows.Client.WebExperience",
+    ], packages
+    # Values can contain colons.
+    assert packages[0]["InstallLocation"].startswith("C:\\Program Files"), packages[0]
+    # Packages without a family name can't be launched, so aren't indexed.
+    assert len(appx_entries(packages)) == 2, appx_entries(packages)
+    assert spoken_tokens("Microsoft.WindowsTerminal") == [
+        "microsoft",
+        "windows",
+        "terminal",
+    ]
+    assert spoken_tokens("VLC media player 3") == ["vlc", "media", "player", "3"]
+
+    n_listed = 0
+
+    def list_packages():
+        nonlocal n_listed
+        n_listed += 1
+        return packages
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        for root, names in _SHORTCUT_FIXTURES.items():
+            for name in names:
+                path = directory / root / name
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.touch()
+        roots = [directory / root for root in _SHORTCUT_FIXTURES]
+
+        def check(index):
+            for program_name, match_start, match_fuzzy, expected in _KNOWN_MATCHES:
+                match = index.match(program_name, match_start, match_fuzzy)
+                if match and match[0] == "shortcut":
+                    match = (
+                        "shortcut",
+                        Path(match[1]).relative_to(directory).as_posix(),
+                    )
+                assert match == expected, (program_name, match, expected)
+
+        index = LauncherIndex(directory / "index.json", roots, list_packages)
+        index.load()
+        assert n_listed == 1, n_listed
+        check(index)
+
+        # A fresh saved index is used as-is, without re-listing packages.
+        index = LauncherIndex(directory / "index.json", roots, list_packages)
+        index.load()
+        assert n_listed == 1, n_listed
+        check(index)
+
+        # New shortcuts are picked up once the directories change.
+        (directory / "Start Menu" / "Zotero.lnk").touch()
+        index.mark_shortcuts_stale()
+        index.refresh()
+        assert index.match("zotero") == (
+            "shortcut",
+            str(directory / "Start Menu" / "Zotero.lnk"),
+        ), index.match("zotero")
+
+        # Refreshes after misses are rate limited.
+        index.refresh_in_background = lambda force_appx=False: None
+        assert index.refresh_after_miss()
+        assert not index.refresh_after_miss()
@@ -1,5 +1,11 @@
-from typing import List
+from typing import List, Optional
+from collections import OrderedDict
 import re
+import math
+import time
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
 import talon
 from talon import ui, Module, actions, ctrl
@@ -22,10 +28,260 @@ class MultipleCandidatesError(OCRError):
     """Error raised when there are multiple candidates, but a single match is required."""
 
 
+# Captured regions are split into horizontal bands of this height, in screen
+# units (pixels, at 100% scaling). Each band is only re-OCR'd when its pixels
+# change. Keep it a multiple of 4 so bands stay pixel-aligned at 125%, 150%
+# etc.
+OCR_BAND_HEIGHT = 96
+# Bands are OCR'd with this much extra above & below, in screen units, so text
+# straddling a band edge isn't cut in half.
+OCR_BAND_OVERLAP = 32
+# Cached results older than this (in seconds) are re-OCR'd even if unchanged.
+OCR_CACHE_TTL = 30
+# Number of distinct regions (screens, window rects) to keep results for.
+OCR_CACHE_SIZE = 8
+# Regions taller than this (in screen units) are split into spans that are
+# OCR'd in parallel.
+OCR_SPAN_HEIGHT = 540
+# Max number of OCR jobs to run at once.
+OCR_THREADS = 4
+
+# Screens and spans get separate pools, because screen jobs wait on span jobs.
+_screen_pool = ThreadPoolExecutor(OCR_THREADS, thread_name_prefix="ocr_screen")
+_span_pool = ThreadPoolExecutor(OCR_THREADS, thread_name_prefix="ocr_span")
+
+
+def _image_bytes(image) -> Optional[memoryview]:
+    """Get the raw pixel bytes of a screenshot, or None if unsupported."""
+    try:
+        return memoryview(image).cast("B")
+    except TypeError:
+        pass
+    try:
+        return memoryview(image.tobytes())
+    except Exception:
+        return None
+
+
+class _Band(object):
+    def __init__(self, hash_, results, timestamp):
+        self.hash = hash_
+        self.results = results
+        self.time = timestamp
+
+
+def _hash_bands(image, pixels, scale, first, last, offset, height):
+    """Hash the pixel rows of bands ``first`` to ``last`` (exclusive).
+
+    ``image`` is a capture whose top is ``offset`` screen units below the top
+    of a region ``height`` units tall, taken at ``scale`` pixels per unit.
+    Returns a dict mapping each band index to its hash.
+
+    """
+    stride = len(pixels) // image.height
+    hashes = {}
+    for i in range(first, last):
+        top = round((i * OCR_BAND_HEIGHT - offset) * scale)
+        bottom = round((min((i + 1) * OCR_BAND_HEIGHT, height) - offset) * scale)
+        hashes[i] = zlib.crc32(pixels[top * stride : bottom * stride])
+    return hashes
+
+
+class _RegionCache(object):
+    """Cached OCR results for one screen region, indexed by band.
+
+    Each time the region is OCR'd, it's captured and every band is hashed.
+    Only bands whose hash changed (or whose results expired) are re-OCR'd.
+
+    Bands are laid out in screen units, and converted to pixel rows with the
+    capture's scale, so they line up on scaled (HiDPI) displays too.
+
+    """
+
+    def __init__(self, rect):
+        self.rect = rect
+        # Maps band index to `_Band`. Doubles as a spatial index - each band
+        # holds the results whose centre falls within it.
+        self.bands = {}
+        self._lock = threading.Lock()
+
+    def _band_index(self, result):
+        return int((result.rect.center.y - self.rect.y) // OCR_BAND_HEIGHT)
+
+    def _ocr_span(self, first, last, cancelled=None):
+        """OCR bands ``first`` to ``last`` (exclusive) in one capture.
+
+        Returns a dict mapping each band index to a ``(hash, results)`` tuple.
+        The hashes are taken from the same capture that was OCR'd. Returns
+        None if ``cancelled`` is set before the span starts.
+
+        """
+        if cancelled is not None and cancelled.is_set():
+            return None
+        top = first * OCR_BAND_HEIGHT
+        bottom = min(last * OCR_BAND_HEIGHT, self.rect.height)
+        capture_top = max(0, top - OCR_BAND_OVERLAP)
+        capture_bottom = min(self.rect.height, bottom + OCR_BAND_OVERLAP)
+        capture_rect = ui.Rect(
+            self.rect.x,
+            self.rect.y + capture_top,
+            self.rect.width,
+            capture_bottom - capture_top,
+        )
+        image = talon.screen.capture_rect(capture_rect)
+        by_band = self._bucket(ocr.ocr(image), first, last)
+        pixels = _image_bytes(image)
+        if pixels is None or not image.height:
+            # Can't hash, so these bands will always be re-OCR'd.
+            hashes = {}
+        else:
+            scale = image.height / capture_rect.height
+            hashes = _hash_bands(
+                image, pixels, scale, first, last, capture_top, self.rect.height
+            )
+        return {i: (hashes.get(i), results) for i, results in by_band.items()}
+
+    def _bucket(self, results, first, last):
+        by_band = {i: [] for i in range(first, last)}
+        for result in results:
+            i = self._band_index(result)
+            # Results in the overlap belong to neighbouring spans.
+            if first <= i < last:
+                by_band[i].append(result)
+        return by_band
+
+    def ocr(self, cancelled: Optional[threading.Event] = None) -> List[ocr.Result]:
+        """OCR the region, reusing results for bands that haven't changed.
+
+        If ``cancelled`` is set part way through, spans that haven't started
+        are skipped and an empty list is returned.
+
+        """
+        with self._lock:
+            image = talon.screen.capture_rect(self.rect)
+            pixels = _image_bytes(image)
+            if pixels is None or not image.height or not self.rect.height:
+                # Can't diff, so can't cache.
+                return ocr.ocr(image)
+            now = time.monotonic()
+            # Pixels per screen unit - more than 1 on scaled displays.
+            scale = image.height / self.rect.height
+            n_bands = math.ceil(self.rect.height / OCR_BAND_HEIGHT)
+            hashes = _hash_bands(image, pixels, scale, 0, n_bands, 0, self.rect.height)
+            dirty = []
+            for i in range(n_bands):
+                band = self.bands.get(i)
+                if not band or band.hash != hashes[i] or now - band.time > OCR_CACHE_TTL:
+                    dirty.append(i)
+            if len(dirty) > n_bands / 2:
+                # Mostly changed - re-OCR everything, in evenly sized spans.
+                n_spans = max(1, int(self.rect.height // OCR_SPAN_HEIGHT))
+                span_length = math.ceil(n_bands / n_spans)
+                spans = [
+                    (i, min(n_bands, i + span_length))
+                    for i in range(0, n_bands, span_length)
+                ]
+            else:
+                # Group contiguous dirty bands, so each group is one OCR call.
+                spans = []
+                for i in dirty:
+                    if spans and spans[-1][1] == i:
+                        spans[-1] = (spans[-1][0], i + 1)
+                    else:
+                        spans.append((i, i + 1))
+            if spans == [(0, n_bands)]:
+                # Already have the capture (and its hashes), so use it.
+                by_band = {
+                    i: (hashes[i], results)
+                    for i, results in self._bucket(ocr.ocr(image), 0, n_bands).items()
+                }
+            else:
+                by_band = {}
+                for span_results in _span_pool.map(
+                    lambda span: self._ocr_span(*span, cancelled), spans
+                ):
+                    if span_results is not None:
+                        by_band.update(span_results)
+            for i, (hash_, results) in by_band.items():
+                self.bands[i] = _Band(hash_, results, now)
+            if cancelled is not None and cancelled.is_set():
+                return []
+            return [r for i in range(n_bands) for r in self.bands[i].results]
+
+
+_region_caches = OrderedDict()
+_region_caches_lock = threading.Lock()
+
+
+def ocr_region(rect, cancelled: Optional[threading.Event] = None) -> List[ocr.Result]:
+    """OCR ``rect``, only re-OCR'ing the parts that changed since last time.
+
+    Returns an empty list if ``cancelled`` is set before it finishes.
+
+    """
+    key = (rect.x, rect.y, rect.width, rect.height)
+    with _region_caches_lock:
+        cache = _region_caches.get(key)
+        if cache:
+            _region_caches.move_to_end(key)
+        else:
+            cache = _RegionCache(ui.Rect(*key))
+            _region_caches[key] = cache
+            while len(_region_caches) > OCR_CACHE_SIZE:
+                _region_caches.popitem(last=False)
+    return cache.ocr(cancelled)
+
+
+def invalidate_ocr_cache() -> None:
+    """Discard all cached OCR results."""
+    with _region_caches_lock:
+        _region_caches.clear()
+
+
+def _sort_top_left(results: List[ocr.Result]) -> List[ocr.Result]:
+    return sorted(results, key=lambda r: (r.rect.y, r.rect.x))
+
+
 def filter_results(results: List[ocr.Result], regexp: str) -> List[ocr.Result]:
-    results = list(filter(lambda r: re.search(regexp, r.text), results))
-    # TODO: Sort top-left first
-    return results
+    """Get the results matching ``regexp``, sorted top-left first."""
+    pattern = re.compile(regexp)
+    return _sort_top_left([r for r in results if pattern.search(r.text)])
+
+
+def _screens_active_first():
+    """Get all screens, with the screen of the active window first."""
+    screens = list(ui.screens())
+    try:
+        active_screen = ui.active_window().screen
+    except Exception:
+        return screens
+    return sorted(screens, key=lambda screen: screen != active_screen)
+
+
+def find_first(regexp: str) -> List[ocr.Result]:
+    """OCR every screen in parallel, returning matches from the first screen.
+
+    Screens are checked in order, starting with the active window's screen, so
+    a match there always wins. Returns the matches on the first screen that
+    has any, sorted top-left first. Once that's known, OCR of the remaining
+    screens stops at the next span.
+
+    """
+    cancelled = threading.Event()
+    futures = [
+        _screen_pool.submit(ocr_region, screen.rect, cancelled)
+        for screen in _screens_active_first()
+    ]
+    try:
+        for future in futures:
+            matches = filter_results(future.result(), regexp)
+            if matches:
+                return matches
+    finally:
+        cancelled.set()
+        for future in futures:
+            future.cancel()
+    return []
 
 
 def click_candidate(results, button: int, ensure_one_match: bool):
@@ -49,17 +305,33 @@ OCR_OVERLAY_TEXT = "Automating UI with OCR"
 class Actions:
     def ocr_everything() -> List[ocr.Result]:
         """Run OCR on everything across all screens."""
+        rects = [screen.rect for screen in _screens_active_first()]
         results = []
-        for screen in ui.screens():
-            screenshot = talon.screen.capture_rect(screen.rect)
-            results.extend(ocr.ocr(screenshot))
-        return results
+        for screen_results in _screen_pool.map(ocr_region, rects):
+            results.extend(screen_results)
+        return _sort_top_left(results)
 
     def ocr_window() -> List[ocr.Result]:
         """Run OCR on just the current window."""
         window = ui.active_window()
-        screenshot = talon.screen.capture_rect(window.rect)
-        return ocr.ocr(screenshot)
+        return ocr_region(window.rect)
+
+    def ocr_find_first(regexp: str) -> ocr.Result:
+        """Find the first match for a regexp on any screen with OCR.
+
+        Screens are searched in parallel. A match on the active window's screen
+        always wins - otherwise, the next screen in order with a match.
+
+        """
+        results = find_first(regexp)
+        if results:
+            return results[0]
+        else:
+            raise TextNotFoundError(f'Could not find text via OCR: r"{regexp}"')
+
+    def ocr_invalidate_cache() -> None:
+        """Discard all cached OCR results, forcing the next OCR to start fresh."""
+        invalidate_ocr_cache()
 
     def ocr_find_text_in_window(regexp: str) -> List[ocr.Result]:
         """Find a regexp in the current window with OCR.
@@ -94,9 +366,12 @@ class Actions:
 
         """
         with automator_overlay(OCR_OVERLAY_TEXT):
-            click_candidate(
-                actions.self.ocr_find_text_anywhere(regexp), button, ensure_one_match
-            )
+            if ensure_one_match:
+                results = actions.self.ocr_find_text_anywhere(regexp)
+            else:
+                # Any match will do, so we can stop at the first.
+                results = [actions.self.ocr_find_first(regexp)]
+            click_candidate(results, button, ensure_one_match)
 
     def ocr_click_in_window(
         regexp: str, button: int = 0, ensure_one_match: bool = False
@@ -1,4 +1,4 @@
-from talon import Module, Context, actions, imgui, app, ui
+from talon import Module, Context, actions, imgui, app, ui, fs
 from typing import Optional, List, Tuple, Any
 from pathlib import Path
 import os
@@ -6,15 +6,29 @@ import subprocess
 import webbrowser
 import re
 import time
+import threading
 from itertools import chain
 
+from talon_init import TALON_HOME
+
+from user.utils.name_index import NameIndex, match_names, RANKED_MIN_SCORE
+from user.misc.launcher_index import LauncherIndex, shortcut_roots
 
-module = Module()
 
+module = Module()
 
-def duplicates_removed(input_list: List[Any]) -> List[Any]:
-    seen = set()
-    return [x for x in input_list if x not in seen and not seen.add(x)]
+# Window (and app) events that make the cached window indexes stale. These are
+# the events the switcher listens to, plus focus & title changes, which
+# reorder or rename windows.
+INDEX_INVALIDATING_EVENTS = {
+    "app_activate",
+    "app_launch",
+    "app_close",
+    "win_open",
+    "win_close",
+    "win_focus",
+    "win_title",
+}
 
 
 def wait_string_to_seconds_rough(time_string: str) -> float:
@@ -32,6 +46,50 @@ class FocusTimeoutError(RuntimeError):
     pass
 
 
+_window_indexes = None
+
+
+def window_indexes():
+    """Get name indexes of the open windows, keyed by "app" and "title".
+
+    Both indexes hold the same windows, in the same order, so their positions
+    can be compared directly. They're rebuilt lazily, after window events.
+
+    """
+    global _window_indexes
+    indexes = _window_indexes
+    if indexes is None:
+        windows = ui.windows()
+        indexes = {
+            "app": NameIndex((w.app.name, w) for w in windows),
+            "title": NameIndex((w.title, w) for w in windows),
+        }
+        _window_indexes = indexes
+    return indexes
+
+
+def _close_matches(index: NameIndex, target: str) -> List[int]:
+    """Positions of near matches for ``target``, best first.
+
+    The fallback for when nothing matches outright.
+
+    """
+    return [i for _, i in index.ranked_indices(target, min_score=RANKED_MIN_SCORE)]
+
+
+def invalidate_window_indexes():
+    global _window_indexes
+    _window_indexes = None
+
+
+def _on_ui_event(event, arg):
+    if event in INDEX_INVALIDATING_EVENTS:
+        invalidate_window_indexes()
+
+
+ui.register("", _on_ui_event)
+
+
 @module.action_class
 class Actions:
     """Class holding cleanly named switcher functions"""
@@ -62,59 +120,39 @@ class Actions:
 
         """
         # TODO: Maybe switch this to return a list?
-        target_name = target_name.lower()
-
-        candidates = [(key.lower(), value) for (key, value) in candidates]
-        results = []
-
-        for name, value in candidates:
-            if name == target_name:
-                results.append(value)
-
-        if match_start:
-            for name, value in candidates:
-                if name.startswith(target_name):
-                    results.append(value)
-
-        if match_anywhere:
-            for name, value in candidates:
-                if target_name in name:
-                    results.append(value)
-
-        # Expand the fuzziness - allow words out of order
-        if match_fuzzy:
-            target_words = target_name.split(" ")
-            for name, value in candidates:
-                # If all words are present
-                if all(map(lambda word: word in name.split(" "), target_words)):
-                    results.append(value)
-
-        return duplicates_removed(results)
+        return match_names(
+            target_name, candidates, match_start, match_anywhere, match_fuzzy
+        )
 
     def focus(app_name: Optional[str] = None, title: Optional[str] = None):
         """Focus a program by either the app name, title, or both."""
         assert app_name or title, "Must provide `app_name` and/or `title`."
         # apps = ui.apps(background=False)
-        windows = ui.windows()
+        index = window_indexes()
         # TODO 1: Filter windows to ensure they're valid focus targets
+        matches = None
         if app_name:
-            names_matcher = [(w.app.name, w) for w in windows]
-            windows = actions.user.heirarchical_name_match(
-                app_name, names_matcher, True, True, True
+            matches = index["app"].match_indices(app_name) or _close_matches(
+                index["app"], app_name
             )
-            if not windows:
+            if not matches:
                 raise IndexError(f'Window not found matching app name: "{app_name}"')
         if title:
-            titles_matcher = [(w.title, w) for w in windows]
-            windows = actions.user.heirarchical_name_match(
-                title, titles_matcher, True, True, True
-            )
-            if not windows:
+            app_matches = set(matches) if matches is not None else None
+
+            def matching_app(indices):
+                return [i for i in indices if app_matches is None or i in app_matches]
+
+            matches = matching_app(
+                index["title"].match_indices(title)
+            ) or matching_app(_close_matches(index["title"], title))
+            if not matches:
                 raise IndexError(
                     f'Window not found matching app name: "{app_name}" and title: "{title}"'
                     if app_name
                     else f'Window not found matching title: "{title}"'
                 )
+        windows = [index["app"].values[i] for i in matches]
 
         # TODO 1: Try focussing each in turn, only error out if none can be focussed?
         window = windows[0]
@@ -414,26 +452,27 @@ class WindowsActions:
             )
 
 
-def list_appx_packages():
-    out = subprocess.check_output(
-        # This will still flash the powershell window even with `-WindowStyle
-        # hidden`, which is a shame, but doesn't seem to be avoidable.
-        'powershell.exe -WindowStyle hidden -ExecutionPolicy Bypass -Command "Get-AppxPackage"',
-        shell=False,
-        text=True,
+_launcher_index = None
+
+
+def _on_shortcuts_changed(path, flags):
+    _launcher_index.mark_shortcuts_stale()
+    _launcher_index.refresh_in_background()
+
+
+def _start_launcher_index():
+    global _launcher_index
+    _launcher_index = LauncherIndex(
+        Path(TALON_HOME, "launcher_index.json"), shortcut_roots()
     )
-    apps = []
-    for app_text in out.split("\n\n"):
-        app_dict = {}
-        lines = app_text.split("\n")
-        # Some sections will be empty - ignore them.
-        if len(lines) > 1:
-            for line in lines:
-                sections = line.split(":")
-                if len(sections) >= 2:
-                    app_dict[sections[0].strip()] = ":".join(sections[1:])[1:]
-            apps.append(app_dict)
-    return apps
+    threading.Thread(target=_launcher_index.load, daemon=True).start()
+    for root in _launcher_index.roots:
+        if root.is_dir():
+            fs.watch(str(root), _on_shortcuts_changed)
+
+
+if app.platform == "windows":
+    _start_launcher_index()
 
 
 def launch_program_windows(
@@ -447,58 +486,26 @@ def launch_program_windows(
     except FileNotFoundError as e:
         pass
 
-    # Now try Windows Store apps.
-    #
-    # TODO: Apps take priority over start menu shortcuts under this model - do we want that?
-    apps = list_appx_packages()
-    appx_targets = [(app["Name"], app["PackageFamilyName"]) for app in apps]
-    matching_apps = actions.user.heirarchical_name_match(
-        program_name, appx_targets, match_start, match_fuzzy, match_fuzzy
-    )
-    if matching_apps:
-        app = matching_apps[0]
-        print(f'Launching "{app}" via `explorer.exe shell:AppsFolder`')
-        subprocess.run(f"explorer.exe shell:AppsFolder\\{app}!App", shell=False)
+    # Now try Windows Store apps, then the shortcuts in the start menu and on
+    # the desktop. These are cached - if nothing matches, refresh the cache in
+    # the background, in case the program was only just installed.
+    _launcher_index.wait_until_loaded()
+    match = _launcher_index.match(program_name, match_start, match_fuzzy)
+    if match:
+        kind, target = match
+        if kind == "appx":
+            print(f'Launching "{target}" via `explorer.exe shell:AppsFolder`')
+            subprocess.run(
+                f"explorer.exe shell:AppsFolder\\{target}!App", shell=False
+            )
+        else:
+            print(f'Launching "{target}"')
+            os.startfile(target)
         return
 
-    # Next, try matching against the shortcuts in the start menu and on the
-    # desktop
-    program_name = program_name.lower()
-
-    system_start_programs_path = (
-        Path(os.environ.get("PROGRAMDATA")) / "Microsoft/Windows/Start Menu/Programs"
-    )
-    user_start_programs_path = (
-        Path(os.environ.get("APPDATA")) / "Microsoft/Windows/Start Menu/Programs"
-    )
-    # Note this will only work if the desktop is on the default path
-    desktop_path = Path(os.environ.get("APPDATA")) / "Desktop"
-    # For now, only use shortcuts
-    LNK_PATTERN = "**/*.lnk"
-    # Note we remove the file extension when matching against the program name.
-    # We also never match against the folder.
-    #
-    # TODO: Match against the folder too, maybe?
-    programs = [
-        (path.stem.lower(), path)
-        for path in chain(
-            # Desktop takes priority - then user start, then global start.
-            desktop_path.glob(LNK_PATTERN),
-            user_start_programs_path.glob(LNK_PATTERN),
-            system_start_programs_path.glob(LNK_PATTERN),
+    if _launcher_index.refresh_after_miss():
+        raise ValueError(
+            f'Program could not be started: "{program_name}". Refreshing the '
+            "program list - try again in a moment."
         )
-    ]
-    programs = duplicates_removed(programs)
-    # HACK: Sort by length of name, so Linux versions get lower priority
-    programs.sort(key=lambda it: len(it[0]))
-
-    matching_paths = actions.user.heirarchical_name_match(
-        program_name, programs, match_start, match_fuzzy, match_fuzzy
-    )
-    if matching_paths:
-        path = matching_paths[0]
-        print(f'Launching "{path}"')
-        os.startfile(str(path))
-        return
-
     raise ValueError(f'Program could not be started: "{program_name}"')
@@ -10,9 +10,10 @@ import os
 import re
 import time
 import logging
+import functools
 import subprocess
 
-from talon import Context, Module, app, imgui, ui, fs, actions
+from talon import Context, Module, app, imgui, ui, fs, actions, cron
 from talon_init import TALON_USER
 
 LOGGER = logging.getLogger(__name__)
@@ -20,6 +21,9 @@ LOGGER.setLevel(logging.INFO)
 
 key = actions.key
 
+# Bursts of app & window events within this window cause only one list update.
+LIST_UPDATE_DELAY = "150ms"
+
 
 # Construct at startup a list of overides for application names (similar to how homophone list is managed)
 # ie for a given talon recognition word set  `one note`, recognized this in these switcher functions as `ONENOTE`
@@ -44,6 +48,7 @@ overrides = {}
 
 # a list of the currently running application names
 running_names = set()
+_launch_list = {}
 
 
 @mod.capture
@@ -86,28 +91,26 @@ def get_words(name):
     return out
 
 
-def update_lists():
-    global running_names
-    running_names.clear()
-    running = {}
-    launch = {}
-    for cur_app in ui.apps(background=False):
-        name = cur_app.name
-
-        if name.endswith(".exe"):
-            name = name.rsplit(".", 1)[0]
+@functools.lru_cache(maxsize=512)
+def _spoken_forms(app_name):
+    """Get the spoken forms for one app, as ``(spoken, app_name)`` pairs.
 
-        words = get_words(name)
-        for word in words:
-            if word and word not in running and len(word) > 2:
-                running[word.lower()] = cur_app.name
+    The last pair is always the app's full name.
 
-        running[name.lower()] = cur_app.name
-        running_names.add(cur_app.name)
+    """
+    name = app_name
+    if name.endswith(".exe"):
+        name = name.rsplit(".", 1)[0]
+    forms = []
+    for word in get_words(name):
+        if len(word) > 2:
+            forms.append((word.lower(), app_name))
+    forms.append((name.lower(), app_name))
+    return tuple(forms)
 
-    for override in overrides:
-        running[override] = overrides[override]
 
+def _launchable_apps():
+    launch = {}
     if app.platform == "mac":
         for base in "/Applications", "/Applications/Utilities":
             for name in os.listdir(base):
@@ -120,14 +123,86 @@ def update_lists():
                         if len(name) > 6 and len(word) < 3:
                             continue
                         launch[word] = path
+    return launch
+
+
+# Names of the running (foreground) apps, keyed by pid. Maintained from app
+# events, so the app list doesn't need to be re-enumerated on every event.
+_running_apps = {}
+# The lists as they were last pushed to Talon. Pushing a list makes Talon
+# recompile the grammar, so it's only done when a list actually changes.
+_published_lists = {}
+_flush_job = None
+_resync_needed = False
+list_update_stats = {"events": 0, "flushes": 0, "updates": 0, "skipped": 0}
+
+
+def _resync_running_apps():
+    _running_apps.clear()
+    for cur_app in ui.apps(background=False):
+        _running_apps[cur_app.pid] = cur_app.name
+
+
+def _publish_lists():
+    """Push the lists to Talon - but only the ones that have changed."""
+    global running_names
+    running = {}
+    # Where apps share a spoken form, the first app (by pid) wins, so the
+    # result doesn't depend on the order the app events arrived in. An app's
+    # full name still beats another app's word.
+    app_names = [_running_apps[pid] for pid in sorted(_running_apps)]
+    for app_name in app_names:
+        for spoken, name in _spoken_forms(app_name)[:-1]:
+            running.setdefault(spoken, name)
+    for app_name in reversed(app_names):
+        spoken, name = _spoken_forms(app_name)[-1]
+        running[spoken] = name
+    running.update(overrides)
+    running_names = set(_running_apps.values())
 
     lists = {
         "self.running": running,
-        "self.launch": launch,
+        "self.launch": _launch_list,
+    }
+    changed = {
+        name: list_
+        for name, list_ in lists.items()
+        if _published_lists.get(name) != list_
     }
+    if changed:
+        LOGGER.debug(f"Updating switcher lists: {list(changed)}")
+        list_update_stats["updates"] += 1
+        # batch update lists
+        ctx.lists.update(changed)
+        _published_lists.update(changed)
+    else:
+        list_update_stats["skipped"] += 1
+
+
+def update_lists():
+    """Re-enumerate the running apps and update the lists immediately."""
+    global _launch_list
+    _launch_list = _launchable_apps()
+    _resync_running_apps()
+    _publish_lists()
 
-    # batch update lists
-    ctx.lists.update(lists)
+
+def _flush():
+    global _flush_job, _resync_needed
+    _flush_job = None
+    list_update_stats["flushes"] += 1
+    if _resync_needed:
+        _resync_needed = False
+        _resync_running_apps()
+    _publish_lists()
+
+
+def _schedule_flush(resync=False):
+    """Update the lists after a short delay, coalescing bursts of events."""
+    global _flush_job, _resync_needed
+    _resync_needed = _resync_needed or resync
+    if not _flush_job:
+        _flush_job = cron.after(LIST_UPDATE_DELAY, _flush)
 
 
 def update_overrides(name, flags):
@@ -283,6 +358,10 @@ class Actions:
         """Hides list of running applications"""
         gui.hide()
 
+    def switcher_list_stats() -> dict:
+        """Get counts of app events, and of list updates pushed and skipped."""
+        return dict(list_update_stats)
+
 
 @imgui.open()
 def gui(gui: imgui.GUI):
@@ -295,7 +374,32 @@ def gui(gui: imgui.GUI):
 def ui_event(event, arg):
     if event in ("app_activate", "app_launch", "app_close", "win_open", "win_close"):
         LOGGER.debug(f"------------------ event:{event}  arg:{arg}")
-        update_lists()
+        list_update_stats["events"] += 1
+        if event == "app_close":
+            if _running_apps.pop(arg.pid, None) is not None:
+                _schedule_flush()
+        elif event in ("app_launch", "app_activate"):
+            # Focus changes don't affect the list, unless a background app has
+            # been brought forward.
+            if arg.pid not in _running_apps and not arg.background:
+                _running_apps[arg.pid] = arg.name
+                _schedule_flush()
+        else:
+            # Opening or closing a window can move its app to or from the
+            # background. Only that app needs checking.
+            try:
+                window_app = arg.app
+                pid, background = window_app.pid, window_app.background
+            except Exception:
+                # The window (or its app) is already gone - check them all.
+                _schedule_flush(resync=True)
+                return
+            if background:
+                if _running_apps.pop(pid, None) is not None:
+                    _schedule_flush()
+            elif pid not in _running_apps:
+                _running_apps[pid] = window_app.name
+                _schedule_flush()
 
 
 ui.register("", ui_event)
@@ -34,6 +34,9 @@ import random
 import uuid
 import struct
 import logging
+import queue
+import json
+from array import array
 from collections import defaultdict
 
 
@@ -47,8 +50,21 @@ TRANSITION_DEADZONE = 3
 # Recordings shorter than this (in seconds) will not be saved. Quickly exit
 # fullscreen to ignore accidental recordings.
 MINIMUM_RECORDING_LENGTH = 10
-# Long recordings will be split into files of this length.
-SPLIT_TIME = "5m"
+# Long recordings will be split into files of this length, in seconds. This is
+# also the most audio that will be held in memory at once, per mic.
+SPLIT_LENGTH = 5 * 60
+SAMPLE_RATE = 16000
+# Audio is captured into blocks of this length, in seconds. Blocks are only
+# taken as they're needed, so memory grows with the audio recorded (up to
+# `SPLIT_LENGTH`), not with the number of mics.
+BLOCK_LENGTH = 10
+# Spare blocks kept ready, so the audio callback doesn't have to allocate.
+MIN_SPARE_BLOCKS = 4
+# Spare blocks kept after writing, for reuse. Any more are freed.
+MAX_SPARE_BLOCKS = 8
+# How long (in seconds) to wait for a stopped recording to be saved before
+# giving up on deleting it.
+WRITE_WAIT_TIMEOUT = 30
 
 
 # Ensure the deadzone won't cause empty recordings to be saved.
@@ -66,6 +82,12 @@ IGNORED_MICS = list(
 
 
 NOISES_ROOT = Path(TALON_HOME, f"recordings/noises/")
+# Persistent index of every recording's duration, so the tree doesn't need to be
+# scanned (and every header parsed) to see how much has been recorded.
+INDEX_PATH = Path(NOISES_ROOT, ".index.json")
+# How long (in seconds) queries wait for the index to load before answering
+# with whatever has been indexed so far.
+INDEX_LOAD_TIMEOUT = 60
 
 
 # Allows accidental recordings to be deleted.
@@ -73,9 +95,6 @@ last_recording_uuid = ""
 last_recording_noise_name = ""
 last_recording_lock = threading.Lock()
 
-# So disk doesn't need to be hammered on every recording
-_durations_cache = {}
-_durations_cache_lock = threading.Lock()
 
 
 def recordings_path(device_name, noise_name):
@@ -89,10 +108,19 @@ def recordings_path(device_name, noise_name):
     return Path(NOISES_ROOT, mic_folder, str(noise_name))
 
 
-def _all_recordings():
-    """Get details of all recordings on disk.
+def _device_and_noise(path):
+    """Get the ``(device, noise)`` folder names a recording is stored under."""
+    relative_parts = Path(path).relative_to(NOISES_ROOT).parts
+    # TODO: Can "." ever be in the subpath? Put this here just in case for Mac/Linux
+    if str(relative_parts[0]) == ".":
+        relative_parts = relative_parts[1:]
+    return relative_parts[0], relative_parts[1]
 
-    Each recording is returned as a tuple (path, noise, device).
+
+def _scan_recordings():
+    """Get details of all recordings on disk. Slow - walks the whole tree.
+
+    Each recording is returned as a tuple (path, device, noise).
 
     """
     if not NOISES_ROOT.exists():
@@ -100,12 +128,7 @@ def _all_recordings():
 
     result = []
     for path in NOISES_ROOT.glob("**/*.flac"):
-        relative_parts = Path(path).relative_to(NOISES_ROOT).parts
-        # TODO: Can "." ever be in the subpath? Put this here just in case for Mac/Linux
-        if str(relative_parts[0]) == ".":
-            relative_parts = relative_parts[1:]
-        device = relative_parts[0]
-        noise = relative_parts[1]
+        device, noise = _device_and_noise(path)
         result.append((path, device, noise))
     return result
 
@@ -114,10 +137,9 @@ def get_flac_duration(filename: str) -> float:
     """Returns the duration of a FLAC file in seconds.
 
     From: https://gist.github.com/lukasklein/8c474782ed66c7115e10904fecbed86a
-    (Modified slightly e.g. to add a cache)
+    (Modified slightly)
 
-    This method assumes the file currently exists (if it's been deleted, the
-    cached duration may still be returned).
+    This reads the file's header. Use `_index` to get cached durations.
 
     """
 
@@ -127,47 +149,192 @@ def get_flac_duration(filename: str) -> float:
             result = (result << 8) + byte
         return result
 
-    with _durations_cache_lock:
-        if filename in _durations_cache:
-            return _durations_cache[filename]
-
-        with open(filename, "rb") as f:
-            if f.read(4) != b"fLaC":
-                raise ValueError("File is not a flac file")
+    with open(filename, "rb") as f:
+        if f.read(4) != b"fLaC":
+            raise ValueError("File is not a flac file")
+        header = f.read(4)
+        while len(header):
+            meta = struct.unpack("4B", header)  # 4 unsigned chars
+            block_type = meta[0] & 0x7F  # 0111 1111
+            size = bytes_to_int(header[1:4])
+
+            if block_type == 0:  # Metadata Streaminfo
+                streaminfo_header = f.read(size)
+                unpacked = struct.unpack("2H3p3p8B16p", streaminfo_header)
+
+                samplerate = bytes_to_int(unpacked[4:7]) >> 4
+                sample_bytes = [(unpacked[7] & 0x0F)] + list(unpacked[8:12])
+                total_samples = bytes_to_int(sample_bytes)
+                return float(total_samples) / samplerate
             header = f.read(4)
-            while len(header):
-                meta = struct.unpack("4B", header)  # 4 unsigned chars
-                block_type = meta[0] & 0x7F  # 0111 1111
-                size = bytes_to_int(header[1:4])
 
-                if block_type == 0:  # Metadata Streaminfo
-                    streaminfo_header = f.read(size)
-                    unpacked = struct.unpack("2H3p3p8B16p", streaminfo_header)
 
-                    samplerate = bytes_to_int(unpacked[4:7]) >> 4
-                    sample_bytes = [(unpacked[7] & 0x0F)] + list(unpacked[8:12])
-                    total_samples = bytes_to_int(sample_bytes)
-                    duration = float(total_samples) / samplerate
+class _RecordingIndex(object):
+    """Persistent index of every recording on disk, & its duration.
+
+    Stored as JSON at `INDEX_PATH`. Entries are keyed by path (relative to
+    `NOISES_ROOT`) and hold the device, noise, duration, mtime & size. Totals
+    per device & noise are kept up to date as entries change, so queries never
+    touch the disk.
+
+    On load, the index is reconciled against the directory. Only files that
+    are new, or whose mtime or size changed, have their headers parsed.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        # { device: { noise: duration } }
+        self._totals = defaultdict(lambda: defaultdict(float))
+        self._lock = threading.RLock()
+        self._loaded = threading.Event()
+
+    def _add_entry(self, key, entry):
+        self._remove_entry(key)
+        self._entries[key] = entry
+        self._totals[entry["device"]][entry["noise"]] += entry["duration"]
+
+    def _remove_entry(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            noises = self._totals[entry["device"]]
+            noises[entry["noise"]] -= entry["duration"]
+            if noises[entry["noise"]] <= 1e-6:
+                del noises[entry["noise"]]
+            if not noises:
+                del self._totals[entry["device"]]
+
+    def _make_entry(self, path, stat=None, duration=None):
+        stat = stat or os.stat(path)
+        device, noise = _device_and_noise(path)
+        return {
+            "device": device,
+            "noise": noise,
+            "duration": (
+                duration if duration is not None else get_flac_duration(path)
+            ),
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+        }
+
+    @staticmethod
+    def _key(path):
+        return Path(path).relative_to(NOISES_ROOT).as_posix()
+
+    def load(self):
+        """Load the index from disk & reconcile it with the directory.
+
+        Queries wait for this to finish - even if it fails.
+
+        """
+        try:
+            self._reconcile()
+        except Exception:
+            LOGGER.exception("Could not load the noise index")
+        finally:
+            self._loaded.set()
+
+    def _reconcile(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            saved = {}
+        except Exception as e:
+            LOGGER.warning(f"Noise index is corrupt, rebuilding it: {e}")
+            saved = {}
+        # Scan without the lock - this is the slow part.
+        entries = {}
+        for path, _, _ in _scan_recordings():
+            key = self._key(path)
+            try:
+                stat = os.stat(path)
+                old = saved.get(key)
+                if (
+                    old
+                    and old.get("mtime") == stat.st_mtime
+                    and old.get("size") == stat.st_size
+                ):
+                    entries[key] = old
+                else:
+                    entries[key] = self._make_entry(path, stat)
+            except Exception as e:
+                LOGGER.warning(f"Could not index noise file {path}: {e}")
+        with self._lock:
+            for key, entry in entries.items():
+                self._add_entry(key, entry)
+            try:
+                self._save()
+            except Exception as e:
+                LOGGER.warning(f"Could not save the noise index: {e}")
+        n_changed = len(saved.keys() ^ entries.keys())
+        LOGGER.info(
+            f"Noise index loaded: {len(self._entries)} recordings, "
+            f"{n_changed} added or removed since last run."
+        )
+
+    @property
+    def loaded(self):
+        return self._loaded.is_set()
+
+    def _wait_until_loaded(self):
+        if not self._loaded.wait(INDEX_LOAD_TIMEOUT):
+            LOGGER.warning(
+                "Noise index still loading - using the recordings indexed so far."
+            )
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_suffix(".tmp")
+        with open(temp_path, "w") as f:
+            json.dump(self._entries, f)
+        os.replace(temp_path, self.path)
+
+    def add(self, path, duration=None):
+        """Add (or update) the recording at ``path``."""
+        self._wait_until_loaded()
+        with self._lock:
+            self._add_entry(self._key(path), self._make_entry(path, duration=duration))
+            self._save()
+
+    def remove(self, paths):
+        """Remove the recordings at ``paths`` from the index."""
+        self._wait_until_loaded()
+        with self._lock:
+            for path in paths:
+                self._remove_entry(self._key(path))
+            self._save()
+
+    def paths(self):
+        """Get the absolute paths of all indexed recordings."""
+        self._wait_until_loaded()
+        with self._lock:
+            return [Path(NOISES_ROOT, key) for key in self._entries]
 
-                    _durations_cache[filename] = duration
-                    return duration
-                header = f.read(4)
+    def amounts_by_device(self):
+        """Get a copy of the totals, as ``{device: {noise: duration}}``."""
+        self._wait_until_loaded()
+        with self._lock:
+            return {device: dict(noises) for device, noises in self._totals.items()}
+
+    def amount(self, device, noise):
+        """Get the total duration of ``noise`` recorded on ``device``."""
+        self._wait_until_loaded()
+        with self._lock:
+            return self._totals.get(device, {}).get(noise, 0.0)
 
 
-def _duration_in_folder(folder):
-    """Get the amount of noise on disk in `folder`, in seconds. Recursive."""
-    total_duration = 0.0
-    if folder.exists():
-        for filename in Path(folder).glob("**/*.flac"):
-            total_duration += get_flac_duration(filename)
-    return total_duration
+_index = _RecordingIndex(INDEX_PATH)
+# Reconciling can be slow on a cold disk, so don't block Talon's startup.
+threading.Thread(target=_index.load, daemon=True).start()
 
 
 def _recordings_from_uuid(uuid_):
     """Get the paths of all noise files matching `uuid`."""
     matching_paths = []
-    for path, _, _ in _all_recordings():
-        if uuid_ in str(path):
+    for path in _index.paths():
+        if path.name.startswith(f"{uuid_}_"):
             matching_paths.append(path)
     return matching_paths
 
@@ -184,6 +351,101 @@ def _notify_with_deadzone(title, message, deadzone=1):
         app.notify(title, message)
 
 
+def _allocate_block():
+    """Allocate a zeroed float32 buffer holding `BLOCK_LENGTH` of audio."""
+    return array("f", bytes(4 * SAMPLE_RATE * BLOCK_LENGTH))
+
+
+class _BlockPool(object):
+    """Spare sample blocks, shared between all recording sessions.
+
+    A background thread keeps at least `MIN_SPARE_BLOCKS` ready while
+    recording, so taking a block in the audio callback is just a pop.
+
+    """
+
+    def __init__(self):
+        self._blocks = []
+        self._lock = Lock()
+        self._low = threading.Event()
+        threading.Thread(target=self._refill_forever, daemon=True).start()
+
+    def _refill_forever(self):
+        while True:
+            self._low.wait()
+            self._low.clear()
+            while True:
+                with self._lock:
+                    if len(self._blocks) >= MIN_SPARE_BLOCKS:
+                        break
+                block = _allocate_block()
+                with self._lock:
+                    self._blocks.append(block)
+
+    def prime(self):
+        """Start filling the pool, ready for a recording."""
+        self._low.set()
+
+    def take(self):
+        with self._lock:
+            block = self._blocks.pop() if self._blocks else None
+            if len(self._blocks) < MIN_SPARE_BLOCKS:
+                self._low.set()
+        # Only if the refill thread has fallen behind. Should be rare.
+        return block if block is not None else _allocate_block()
+
+    def give(self, blocks):
+        """Return written blocks to the pool."""
+        with self._lock:
+            space = MAX_SPARE_BLOCKS - len(self._blocks)
+            self._blocks.extend(blocks[: max(space, 0)])
+
+
+_block_pool = _BlockPool()
+
+
+# Full chunks are handed off here, to be written to disk by a background
+# thread. Each item is a `(session, blocks, n_samples, final)` tuple, where
+# `final` marks the last chunk of the session.
+_write_queue = queue.Queue()
+
+# Number of sessions whose last chunk hasn't been written yet. Used to wait
+# for a recording to be saved before it's deleted.
+_unflushed_sessions = 0
+_unflushed_condition = threading.Condition()
+
+
+def _wait_for_writes(timeout=None) -> bool:
+    """Wait until every stopped session has been written. False on timeout."""
+    with _unflushed_condition:
+        return _unflushed_condition.wait_for(
+            lambda: _unflushed_sessions == 0, timeout
+        )
+
+
+def _write_chunks_forever():
+    global _unflushed_sessions
+    while True:
+        session, blocks, n_samples, final = _write_queue.get()
+        try:
+            session._write_chunk(blocks, n_samples)
+        except Exception:
+            LOGGER.exception(f"Failed to write noise chunk: {session}")
+        # Whatever `_write_chunk` didn't already hand back.
+        _block_pool.give(blocks)
+        if final:
+            # Only a recording that made it to disk can be deleted.
+            if session._saved:
+                session._publish_as_last()
+            with _unflushed_condition:
+                _unflushed_sessions -= 1
+                _unflushed_condition.notify_all()
+
+
+_writer_thread = threading.Thread(target=_write_chunks_forever, daemon=True)
+_writer_thread.start()
+
+
 class _RecordingSession(object):
     def __init__(self, device, noise_name, uuid):
         self.device = device
@@ -191,13 +453,49 @@ class _RecordingSession(object):
         self.uuid = uuid
         self._recording = False
         self._lock = Lock()
-        self._frames = []
-        self._split_cron = None
+        # Samples are captured into blocks from `_block_pool`. The blocks for
+        # the current split are handed off to the writer thread when the split
+        # is full, or the recording ends.
+        self._blocks = []
+        self._n_samples = 0
+        # Whether any chunk of this session has been written to disk.
+        self._saved = False
 
     def _on_data(self, stream, in_frames, out_frames):
         with self._lock:
             if self._recording:
-                self._frames.extend(in_frames)
+                samples = array("f", in_frames)
+                block_size = SAMPLE_RATE * BLOCK_LENGTH
+                offset = 0
+                while offset < len(samples):
+                    used = self._n_samples % block_size
+                    if used == 0 and self._n_samples == len(self._blocks) * block_size:
+                        self._blocks.append(_block_pool.take())
+                    n = min(len(samples) - offset, block_size - used)
+                    self._blocks[-1][used : used + n] = samples[offset : offset + n]
+                    self._n_samples += n
+                    offset += n
+                    if self._n_samples >= SAMPLE_RATE * SPLIT_LENGTH:
+                        self._hand_off_chunk()
+
+    def _hand_off_chunk(self, final=False):
+        """Queue the current chunk to be written & start a new one.
+
+        Must be called with the lock held.
+
+        """
+        _write_queue.put((self, self._blocks, self._n_samples, final))
+        self._blocks = []
+        self._n_samples = 0
+
+    def _publish_as_last(self):
+        """Make this the recording "delete last noise recording" deletes."""
+        global last_recording_uuid, last_recording_noise_name
+        with last_recording_lock:
+            # This will fire once for every mic in this session, but that's
+            # fine.
+            last_recording_uuid = self.uuid
+            last_recording_noise_name = self.noise_name
 
     def __str__(self):
         return f'<"{self.noise_name}" on "{self.device.name}">'
@@ -215,24 +513,34 @@ class _RecordingSession(object):
             else:
                 return path
 
-    def _write_frames(self):
-        """Write the frames so far to a file & clear them."""
-        sample_rate = 16000
+    def _write_chunk(self, blocks, n_samples):
+        """Write the first ``n_samples`` held in ``blocks`` to a file.
+
+        This is slow, so it's run on the writer thread. Blocks that get written
+        are removed from ``blocks`` & returned to the pool.
+
+        """
         # Ignore short recordings, these are probably accidental.
-        if len(self._frames) >= sample_rate * MINIMUM_RECORDING_LENGTH:
+        if n_samples >= SAMPLE_RATE * MINIMUM_RECORDING_LENGTH:
             path = self._get_chunk_path()
-            # TODO: Do this on a delay later
-            #   ^ What did I mean by this???
-            frames = self._frames
-            self._frames = []
-            # TODO: Spawn thread for this? stopping the stream may also be slow.
             LOGGER.info(f"Writing noise file: {path}")
+            # `write_flac` encodes a whole buffer in one call - it can't be fed
+            # incrementally - and takes a list of floats. Blocks are handed
+            # back as they're copied, so only about one copy is held at once.
+            frames = []
+            while blocks:
+                block = blocks.pop(0)
+                frames.extend(block[: n_samples - len(frames)])
+                _block_pool.give([block])
             flac.write_flac(
-                str(path), frames, sample_rate=sample_rate, compression_level=1
+                str(path), frames, sample_rate=SAMPLE_RATE, compression_level=1
             )
+            del frames
+            self._saved = True
+            _index.add(path, duration=n_samples / SAMPLE_RATE)
 
             # This will fire once per device, so deadzone it.
-            duration = len(frames) / sample_rate
+            duration = n_samples / SAMPLE_RATE
             # HACK: Sometimes Windows will suppress this notification so throw
             #   it on a delay. (The delay also allows us the report of the total
             #   to factor in all mics in this session.)
@@ -270,45 +578,34 @@ class _RecordingSession(object):
             )
 
     def finish(self):
-        global last_recording_uuid, last_recording_noise_name
         with self._lock:
             LOGGER.info(f"Terminating recording: {self}")
             self._recording = False
-            self._write_frames()
-            try:
-                cron.cancel(self._split_cron)
-            except Exception as e:
-                LOGGER.info(f"Failed to cancel split cron job: {e}")
-            self._split_cron = None
-            with last_recording_lock:
-                # This will fire once for every mic in this session, but that's
-                # fine.
-                last_recording_uuid = self.uuid
-                last_recording_noise_name = self.noise_name
+            # It only becomes the "last recording" once this has been written.
+            self._hand_off_chunk(final=True)
         # This can take a while, so release the lock first
         self._stream.stop()
 
-    def _split_recording(self):
-        with self._lock:
-            self._write_frames()
-
     def record(self):
+        global _unflushed_sessions
         with self._lock:
             if self._recording:
                 raise RuntimeError("Already recording.")
 
             self._recording = True
-            self._frames = []
+            self._blocks = []
+            self._n_samples = 0
+            _block_pool.prime()
             ctx = cubeb.Context()
             params = cubeb.StreamParams(
                 format=cubeb.SampleFormat.FLOAT32NE,
-                rate=16000,
+                rate=SAMPLE_RATE,
                 channels=1,
             )
-            existing = (
-                _duration_in_folder(recordings_path(self.device.name, self.noise_name))
-                / 60
+            device_folder, noise_folder = _device_and_noise(
+                recordings_path(self.device.name, self.noise_name)
             )
+            existing = _index.amount(device_folder, noise_folder) / 60
             LOGGER.info(
                 f"Recording: {self}. {existing:0.1f} mins exist from this device already."
             )
@@ -322,7 +619,9 @@ class _RecordingSession(object):
                 data_cb=self._on_data,
             )
             self._stream.start()
-            self._split_cron = cron.interval(SPLIT_TIME, self._split_recording)
+            # Now `finish` will be called, which will (eventually) flush it.
+            with _unflushed_condition:
+                _unflushed_sessions += 1
 
 
 _active_sessions = []
@@ -355,10 +654,8 @@ def _get_free_uuid():
     """
     while True:
         uuid_ = str(uuid.uuid4())
-        for path, _, _ in _all_recordings():
-            if uuid_ in str(path):
-                continue
-        return uuid_
+        if not _recordings_from_uuid(uuid_):
+            return uuid_
 
 
 def record(noise_name):
@@ -456,10 +753,7 @@ _noises = [
 def amounts_recorded_by_device():
     """Get the amount of each noise (in seconds) recorded on each device."""
     # { device: { noise: amount } }
-    devices = defaultdict(lambda: defaultdict(float))
-    for path, device, noise in _all_recordings():
-        devices[device][noise] += get_flac_duration(path)
-    return devices
+    return _index.amounts_by_device()
 
 
 def amounts_recorded_total():
@@ -527,15 +821,29 @@ class NoiseActions:
 
     def delete_last_noise_recording() -> None:
         """Delete the previous recording session (across all devices)."""
+        # A recording that was just stopped may still be being written.
+        if not _wait_for_writes(WRITE_WAIT_TIMEOUT):
+            app.notify(
+                "Error Deleting Noises",
+                "The last recording is still being saved. Try again in a moment.",
+            )
+            return
         with last_recording_lock:
             uuid_ = last_recording_uuid
             noise_name = last_recording_noise_name
         if uuid_:
             n_deleted = 0
+            deleted = []
             for noise_file in _recordings_from_uuid(uuid_):
                 print("Deleting noise file:", noise_file)
-                os.remove(noise_file)
-                n_deleted += 1
+                try:
+                    os.remove(noise_file)
+                    n_deleted += 1
+                except FileNotFoundError:
+                    pass
+                # Missing files are stale entries. Remove them either way.
+                deleted.append(noise_file)
+            _index.remove(deleted)
             if n_deleted:
                 app.notify(
                     "Noise Deleted",
@@ -600,11 +908,12 @@ def _maybe_record():
             _original_mic = active_mic.name if active_mic else None
             print("Disabling mic while recording noises.")
             actions.speech.set_microphone("None")
-            with _gui_lock:
-                # This can take a while (e.g. on a cold disk drive) so pop a
-                # message
-                _gui_text = "Scanning noise recordings on disk, this may be slow..."
-            gui.show()
+            if not _index.loaded:
+                with _gui_lock:
+                    # The first scan can take a while (e.g. on a cold disk
+                    # drive) so pop a message
+                    _gui_text = "Scanning noise recordings on disk, this may be slow..."
+                gui.show()
             noise, existing = noise_with_least_data()
             LOGGER.info(
                 f'Recording noise with the least data: "{noise}", '
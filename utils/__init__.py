@@ -8,6 +8,14 @@ from functools import wraps
 import re
 from pathlib import Path
 
+from user.utils.number_words import (
+    NUMERALS,
+    DIGIT_STRINGS,
+    trailing_numerals_value,
+    digit_string_value,
+)
+from user.utils.words import spoken_digits, spoken_form
+
 
 # TODO: Remove references to these, replace with the actions
 ON_WINDOWS = platform.system() == "Windows"
@@ -105,76 +113,31 @@ def surround(by):
 
 # support for parsing numbers as command postfix
 def numeral_map():
-    numeral_map = dict((str(n), n) for n in range(0, 20))
-    for n in [20, 30, 40, 50, 60, 70, 80, 90]:
-        numeral_map[str(n)] = n
-    numeral_map["oh"] = 0  # synonym for zero
-    return numeral_map
+    return dict(NUMERALS)
+
+
+_numerals_rule = " (" + " | ".join(sorted(NUMERALS.keys())) + ")"
 
 
 def numerals():
-    return " (" + " | ".join(sorted(numeral_map().keys())) + ")+"
+    return _numerals_rule + "+"
 
 
 def optional_numerals():
-    return " (" + " | ".join(sorted(numeral_map().keys())) + ")*"
+    return _numerals_rule + "*"
 
 
 def text_to_number(m):
-    tmp = [str(s).lower() for s in m]
-    words = [parse_word(word) for word in tmp]
+    return trailing_numerals_value([parse_word(str(s).lower()) for s in m])
 
-    result = 0
-    factor = 1
-    for word in reversed(words):
-        if word not in optional_numerals():
-            # we consumed all the numbers and only the command name is left.
-            break
-
-        result = result + factor * int(numeral_map()[word])
-        factor = 10 * factor
-
-    return result
 
-
-number_conversions = {"oh": "0"}  # 'oh' => zero
-for i, w in enumerate(
-    ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine"]
-):
-    number_conversions[str(i)] = str(i)
-    number_conversions[w] = str(i)
-    number_conversions["%s\\number" % (w)] = str(i)
+number_conversions = DIGIT_STRINGS
 
 
 def parse_words_as_integer(words):
     # TODO: Once implemented, use number input value rather than manually
     # parsing number words with this function
-
-    # Ignore any potential non-number words
-    number_words = [w for w in words if str(w) in number_conversions]
-
-    # Somehow, no numbers were detected
-    if len(number_words) == 0:
-        return None
-
-    # Map number words to simple number values
-    number_values = list(map(lambda w: number_conversions[w.word], number_words))
-
-    # Filter out initial zero values
-    normalized_number_values = []
-    non_zero_found = False
-    for n in number_values:
-        if not non_zero_found and n == "0":
-            continue
-        non_zero_found = True
-        normalized_number_values.append(n)
-
-    # If the entire sequence was zeros, return single zero
-    if len(normalized_number_values) == 0:
-        normalized_number_values = ["0"]
-
-    # Create merged number string and convert to int
-    return int("".join(normalized_number_values))
+    return digit_string_value(words)
 
 
 class Modifiers(object):
@@ -429,42 +392,6 @@ def single_spaces(text: str) -> str:
     return _RE_DOUBLE_SPACES.sub(" ", text)
 
 
-# TODO: This is repeated from the numbers module, probably
-spoken_digits = {
-    "1": "one",
-    "2": "two",
-    "3": "three",
-    "4": "four",
-    "5": "five",
-    "6": "six",
-    "7": "seven",
-    "8": "eight",
-    "9": "nine",
-    "0": "zero",
-}
-
-
-def _digits_to_words(text: str) -> str:
-    """convert digits in ``text`` to their English words.
-
-    Note this will NOT create multiple-digit forms. Digits will be separated."""
-    for digit, english in spoken_digits.items():
-        text = text.replace(digit, f" {english} ")
-    return single_spaces(text)
-
-
-_RE_NONALPHABETIC_CHARS = re.compile(r"[^a-zA-Z]+")
-
-
-def spoken_form(text: str) -> str:
-    """Convert ``text`` into a format compatible with speech lists."""
-    # TODO: Replace numeric digits with spoken digits
-    text = text.replace("'", " ")
-    text = _digits_to_words(text)
-    text = _RE_NONALPHABETIC_CHARS.sub(" ", text)
-    return text.strip()
-
-
 def expand_acronym(acronym: str) -> str:
     """Create a spoken form for an acronym, e.g. "mp3" -> "M P three"."""
     return spoken_form(" ".join(acronym).upper())
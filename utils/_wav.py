@@ -1,22 +1,54 @@
 """Module for playing wav files in Talon.
 
-Only works with 16-bit signed wavs. Not designed to work with spamming.
+Only works with 16-bit signed wavs. Sounds are mixed into a single output
+stream, so they can overlap.
 
 Author: Ryan Hileman (lunixbochs).
 Modified by GitHub user Jcaw.
 
 """
 
-import struct
 import threading
 import wave
 import functools
+from array import array
 
 from talon.lib import cubeb
 
 
+# Every sound is resampled to this rate when it's loaded, so they can all be
+# mixed into one stream.
+MIXER_RATE = 48000
+# If more sounds than this are playing at once, the oldest are dropped.
+MAX_VOICES = 16
+
+_MIN_SAMPLE = -32768
+_MAX_SAMPLE = 32767
+
+
+def _resample(samples, from_rate, to_rate):
+    """Linearly resample ``samples`` (an `array("h")`) to a new rate."""
+    if from_rate == to_rate or not samples:
+        return samples
+    n_out = int(len(samples) * to_rate / from_rate)
+    step = from_rate / to_rate
+    last = len(samples) - 1
+    result = array("h", bytes(2 * n_out))
+    for i in range(n_out):
+        position = i * step
+        j = int(position)
+        if j >= last:
+            result[i] = samples[last]
+        else:
+            fraction = position - j
+            result[i] = int(
+                round(samples[j] + (samples[j + 1] - samples[j]) * fraction)
+            )
+    return result
+
+
 class _WavSource:
-    def __init__(self, path):
+    def __init__(self, path, rate=MIXER_RATE):
         self.path = path
         try:
             wav_file = wave.open(path)
@@ -24,25 +56,44 @@ class _WavSource:
             if self.params.sampwidth != 2:
                 raise Exception("only 16-bit signed PCM supported")
             nframes = self.params.nframes
-            frames = wav_file.readframes(nframes)
-            self.samples = struct.unpack(
-                "<{}h".format(nframes * self.params.nchannels), frames
-            )
-            self.samplerate = self.params.framerate
-            self.channels = self.params.nchannels
-            if self.channels == 2:
-                self.samples = self.samples[::2]
-                self.channels = 1
+            samples = array("h", wav_file.readframes(nframes))
+            if array("h", [1]).tobytes() != b"\x01\x00":
+                # Wavs are little-endian.
+                samples.byteswap()
+            if self.params.nchannels == 2:
+                samples = samples[::2]
+            self.samples = _resample(samples, self.params.framerate, rate)
+            self.samplerate = rate
+            self.channels = 1
         finally:
             wav_file.close()
 
 
-class _Player:
-    def __init__(self, rate, fmt, channels):
+class _Voice:
+    """One playing sound - a buffer, and a read cursor into it."""
+
+    def __init__(self, samples):
+        # Slicing a memoryview doesn't copy.
+        self.samples = memoryview(samples)
+        self.cursor = 0
+
+
+class _Mixer:
+    """Mixes any number of concurrent sounds into one output stream.
+
+    Each sound keeps its own read cursor into its (shared, immutable) sample
+    buffer, so consuming samples never copies or shifts the remainder.
+
+    """
+
+    def __init__(self, rate=MIXER_RATE):
         self.lock = threading.Lock()
+        self.rate = rate
         self.ctx = cubeb.Context()
-        params = cubeb.StreamParams(rate=rate, format=fmt, channels=channels)
-        self.buffer = []
+        params = cubeb.StreamParams(
+            rate=rate, format=cubeb.SampleFormat.S16LE, channels=1
+        )
+        self._voices = []
         self.stream = self.ctx.new_output_stream(
             "player", None, params, latency=-1, data_cb=self._source
         )
@@ -51,18 +102,41 @@ class _Player:
     def _source(self, stream, samples_in, samples_out):
         needed = len(samples_out)
         with self.lock:
-            if len(self.buffer) > 0:
-                frame = self.buffer[:needed]
-                if len(frame) < needed:
-                    frame += [0] * (needed - len(frame))
-                samples_out[:] = frame
-                self.buffer = self.buffer[needed:]
-                return needed
+            if self._voices:
+                samples_out[:] = self._mix(needed)
+            else:
+                samples_out[:] = [0] * needed
         return needed
 
+    def _mix(self, needed):
+        """Mix the next ``needed`` samples of every voice. Hold the lock."""
+        voices = self._voices
+        if len(voices) == 1:
+            # Common case - no need to sum or clip.
+            voice = voices[0]
+            frame = voice.samples[voice.cursor : voice.cursor + needed].tolist()
+            voice.cursor += needed
+            if len(frame) < needed:
+                frame += [0] * (needed - len(frame))
+        else:
+            frame = [0] * needed
+            for voice in voices:
+                chunk = voice.samples[voice.cursor : voice.cursor + needed]
+                voice.cursor += needed
+                for i, sample in enumerate(chunk):
+                    frame[i] += sample
+            frame = [min(_MAX_SAMPLE, max(_MIN_SAMPLE, s)) for s in frame]
+        self._voices = [
+            voice for voice in voices if voice.cursor < len(voice.samples)
+        ]
+        return frame
+
     def append(self, samples):
+        """Start playing ``samples``, on top of anything already playing."""
         with self.lock:
-            self.buffer += samples
+            self._voices.append(_Voice(samples))
+            if len(self._voices) > MAX_VOICES:
+                self._voices = self._voices[-MAX_VOICES:]
 
 
 # Cache to avoid repeated, slow disk I/O
@@ -71,23 +145,17 @@ def load_wav(path):
     return _WavSource(path)
 
 
-_players = {}
+_mixer = None
+_mixer_lock = threading.Lock()
 
 
 def play_wav(path):
-    global _players
+    global _mixer
     wav = load_wav(path)
-    # Player seems to leak. Creating many players eventually causes audio to
-    # corrupt. We can re-use old players to prevent it.
-    #
-    # NOTE this will play identically sampled wavs one by one, but differently
-    # sampled wavs in parallel.
-    #
-    # TODO: Allow multiple wavs to be played at once without corrupting.
-    player_key = (wav.samplerate, wav.channels)
-    player = _players.get(player_key)
-    if not player:
-        player = _Player(wav.samplerate, cubeb.SampleFormat.S16LE, wav.channels)
-        _players[player_key] = player
-    player.append(wav.samples)
-    return player
+    # Creating many streams eventually causes audio to corrupt, so every sound
+    # shares one mixer.
+    with _mixer_lock:
+        if not _mixer:
+            _mixer = _Mixer()
+    _mixer.append(wav.samples)
+    return _mixer
@@ -1,32 +1,115 @@
 import re
-from typing import Optional, Callable, List
+from typing import Optional, Callable, List, Tuple
 from talon import actions
 
+from user.utils.words import separate_words
+
+
+# How much surrounding text formatters may ask for. Formatters declare what
+# they need with `needs_context` - see `context_needed`.
+#
+# Just the adjacent character.
+CHAR_CONTEXT = 1
+# Enough to see past a run of quotes, for natural language spacing.
+SPACING_CONTEXT = 16
+# Enough to find the end of the last sentence.
+SENTENCE_CONTEXT = 200
+# Used when a formatter doesn't declare what it needs, or the caller wants
+# "all" the text.
+FULL_CONTEXT = 30000
+
+# Fetch function for a lazy `SurroundingText`. Takes ``(chars_before,
+# chars_after)``, returns ``(text_before, text_after)``.
+FETCH_FUNC_TYPE = Callable[[int, int], Tuple[str, str]]
+
 
 class SurroundingText:
-    def __init__(self, text_before=None, text_after=None):
-        self.text_before = text_before
-        self.text_after = text_after
+    """The text either side of the cursor.
+
+    Either pass the text up front, or pass ``fetch`` to only get as much text
+    as is actually read. A lazy instance fetches on first access, and again
+    only if more text is needed later. Use `prefetch` to get everything a
+    group of readers will need in one go.
+
+    """
+
+    def __init__(
+        self,
+        text_before: Optional[str] = None,
+        text_after: Optional[str] = None,
+        fetch: Optional[FETCH_FUNC_TYPE] = None,
+    ):
+        self._fetch = fetch
+        self._before = text_before
+        self._after = text_after
+        # How many chars we have on each side. Eager text is all there is.
+        self._n_before = 0 if fetch else float("inf")
+        self._n_after = 0 if fetch else float("inf")
+        self.n_fetches = 0
+
+    def prefetch(self, chars_before: int, chars_after: int) -> None:
+        """Make sure at least this much text is available, in one fetch."""
+        if not self._fetch or (
+            chars_before <= self._n_before and chars_after <= self._n_after
+        ):
+            return
+        # Always get a little of both sides, so a reader that only looks at
+        # ``char_before`` then ``char_after`` sees one consistent snapshot.
+        chars_before = max(chars_before, self._n_before, CHAR_CONTEXT)
+        chars_after = max(chars_after, self._n_after, CHAR_CONTEXT)
+        self._before, self._after = self._fetch(chars_before, chars_after)
+        self.n_fetches += 1
+        # If we got less than we asked for, we've hit the edge of the buffer -
+        # there's no more to fetch.
+        self._n_before = (
+            chars_before if len(self._before) >= chars_before else float("inf")
+        )
+        self._n_after = chars_after if len(self._after) >= chars_after else float("inf")
+
+    def before_point(self, n_chars: int) -> Optional[str]:
+        """Get up to ``n_chars`` of the text before the cursor."""
+        self.prefetch(n_chars, CHAR_CONTEXT)
+        if self._before is None:
+            return None
+        return self._before[max(len(self._before) - n_chars, 0) :]
+
+    def after_point(self, n_chars: int) -> Optional[str]:
+        """Get up to ``n_chars`` of the text after the cursor."""
+        self.prefetch(CHAR_CONTEXT, n_chars)
+        if self._after is None:
+            return None
+        return self._after[:n_chars]
+
+    @property
+    def text_before(self) -> Optional[str]:
+        self.prefetch(FULL_CONTEXT, CHAR_CONTEXT)
+        return self._before
+
+    @property
+    def text_after(self) -> Optional[str]:
+        self.prefetch(CHAR_CONTEXT, FULL_CONTEXT)
+        return self._after
 
     @property
     def char_before(self):
-        return self.text_before[-1] if self.text_before else None
+        text_before = self.before_point(CHAR_CONTEXT)
+        return text_before[-1] if text_before else None
 
     @property
     def char_after(self):
-        return self.text_after[0] if self.text_after else None
+        text_after = self.after_point(CHAR_CONTEXT)
+        return text_after[0] if text_after else None
 
     def __str__(self) -> str:
+        # Only show what's already been fetched - don't fetch more to print it.
         PREVIEW_LENGTH = 100
         text_before_preview = (
-            None
-            if self.text_before is None
-            else (f'"{self.text_before[-PREVIEW_LENGTH:]}"')
+            None if self._before is None else (f'"{self._before[-PREVIEW_LENGTH:]}"')
         )
         text_after_preview = (
             None
-            if self.text_after is None
-            else f'"{self.text_after[:min(PREVIEW_LENGTH, len(self.text_after))]}"'
+            if self._after is None
+            else f'"{self._after[:min(PREVIEW_LENGTH, len(self._after))]}"'
         )
         return f"<SurroundingText.\nText before: {text_before_preview}\nText after: {text_after_preview}>"
 
@@ -48,6 +131,33 @@ class ComplexInsert:
 FORMATTING_FUNC_TYPE = Callable[[str, Optional[SurroundingText]], ComplexInsert]
 
 
+def needs_context(chars_before: int, chars_after: int):
+    """Declare how much surrounding text a formatter reads, on each side."""
+
+    def decorator(formatter: FORMATTING_FUNC_TYPE) -> FORMATTING_FUNC_TYPE:
+        formatter.context_needed = (chars_before, chars_after)
+        return formatter
+
+    return decorator
+
+
+def context_needed(formatters: List[FORMATTING_FUNC_TYPE]) -> Tuple[int, int]:
+    """How much surrounding text do ``formatters`` need between them?
+
+    Formatters that don't declare it with `needs_context` are assumed to need
+    `FULL_CONTEXT`.
+
+    """
+    chars_before, chars_after = 0, 0
+    for formatter in formatters:
+        before, after = getattr(
+            formatter, "context_needed", (FULL_CONTEXT, FULL_CONTEXT)
+        )
+        chars_before = max(chars_before, before)
+        chars_after = max(chars_after, after)
+    return chars_before, chars_after
+
+
 _RE_ALL_ALPHANUMERIC = re.compile(r"^[a-zA-Z0-9]+$")
 _RE_ALL_WHITESPACE = re.compile(r"^[ \n\t\r]+$")
 _RE_PUNCTUATION = re.compile(r"[^a-zA-Z0-9]")
@@ -128,8 +238,10 @@ def _should_space(before, after):
 def _language_spaced(words, surrounding_text=None):
     text = " ".join(words)
     if text and surrounding_text:
-        prefix = " " if _should_space(surrounding_text.text_before, text) else ""
-        suffix = " " if _should_space(text, surrounding_text.text_after) else ""
+        text_before = surrounding_text.before_point(SPACING_CONTEXT) or ""
+        text_after = surrounding_text.after_point(SPACING_CONTEXT) or ""
+        prefix = " " if _should_space(text_before, text) else ""
+        suffix = " " if _should_space(text, text_after) else ""
     else:
         prefix, suffix = "", ""
     return ComplexInsert(insert=prefix + text, text_after=suffix)
@@ -158,6 +270,7 @@ def _delimiter_spaced(delimiter, text, surrounding_text=None):
     return ComplexInsert(insert=prefix + center, text_after=suffix)
 
 
+@needs_context(CHAR_CONTEXT, CHAR_CONTEXT)
 def apply_camel_case(text, surrounding_text=None):
     words = text.lower().split(" ")
     if len(words) >= 1:
@@ -173,20 +286,24 @@ def apply_camel_case(text, surrounding_text=None):
     return ComplexInsert("".join(words))
 
 
+@needs_context(0, 0)
 def apply_studley_case(text, surrounding_text=None):
     words = text.lower().split(" ")
     studley_words = map(capitalize, words)
     return ComplexInsert("".join(studley_words))
 
 
+@needs_context(CHAR_CONTEXT, CHAR_CONTEXT)
 def apply_snake(text, surrounding_text=None):
     return _delimiter_spaced("_", text, surrounding_text)
 
 
+@needs_context(CHAR_CONTEXT, CHAR_CONTEXT)
 def apply_spine(text, surrounding_text=None):
     return _delimiter_spaced("-", text, surrounding_text)
 
 
+@needs_context(CHAR_CONTEXT, CHAR_CONTEXT)
 def apply_dotword(text, surrounding_text=None):
     return _delimiter_spaced(".", text, surrounding_text)
 
@@ -199,9 +316,11 @@ def make_apply_delimiter(delimiter):
         nonlocal delimiter
         return _delimiter_spaced(delimiter, text, surrounding_text)
 
+    do_apply_delimiter.context_needed = (CHAR_CONTEXT, CHAR_CONTEXT)
     return do_apply_delimiter
 
 
+@needs_context(CHAR_CONTEXT, CHAR_CONTEXT)
 def apply_dunder(text, surrounding_text=None):
     if surrounding_text and is_alphanumeric(surrounding_text.char_before):
         prefix = "_"
@@ -222,6 +341,7 @@ def apply_dunder(text, surrounding_text=None):
     return ComplexInsert(insert=prefix + center + inner_suffix, text_after=outer_suffix)
 
 
+@needs_context(CHAR_CONTEXT, 0)
 def apply_programming_keywords(
     text: str, surrounding_text: Optional[SurroundingText] = None
 ) -> ComplexInsert:
@@ -233,7 +353,7 @@ def apply_programming_keywords(
     """
     text = text.lower()
     space_before = surrounding_text and re.search(
-        r"[^ \t\n([{<]\Z", surrounding_text.text_before
+        r"[^ \t\n([{<]\Z", surrounding_text.before_point(CHAR_CONTEXT) or ""
     )
     if space_before:
         text = " " + text
@@ -245,6 +365,7 @@ def apply_programming_keywords(
     return ComplexInsert(text)
 
 
+@needs_context(CHAR_CONTEXT, CHAR_CONTEXT)
 def apply_euler_function_call(
     text: str, surrounding_text: Optional[SurroundingText] = None
 ) -> ComplexInsert:
@@ -264,6 +385,7 @@ def apply_euler_function_call(
     return complex
 
 
+@needs_context(CHAR_CONTEXT, CHAR_CONTEXT)
 def apply_elisp_private(
     text: str, surrounding_text: Optional[SurroundingText] = None
 ) -> ComplexInsert:
@@ -296,6 +418,7 @@ def _lisp_pad_before(surrounding_text):
     )
 
 
+@needs_context(CHAR_CONTEXT, CHAR_CONTEXT)
 def apply_lisp_function_call(
     text: str, surrounding_text: Optional[SurroundingText] = None
 ) -> ComplexInsert:
@@ -319,6 +442,7 @@ def apply_lisp_function_call(
     return complex
 
 
+@needs_context(CHAR_CONTEXT, CHAR_CONTEXT)
 def apply_lisp_keyword(
     text: str, surrounding_text: Optional[SurroundingText] = None
 ) -> ComplexInsert:
@@ -329,6 +453,7 @@ def apply_lisp_keyword(
     return complex
 
 
+@needs_context(SPACING_CONTEXT, SPACING_CONTEXT)
 def apply_elisp_doc_symbol(
     text: str, surrounding_text: Optional[SurroundingText] = None
 ) -> ComplexInsert:
@@ -377,7 +502,6 @@ _RE_SENTENCE_TERMINATOR = re.compile(r"[\.\…\!\?]+[^a-zA-Z0-9]*$")
 _RE_START_OF_DOCUMENT = re.compile(r"^[ \n\t\r]*$")
 _RE_START_OF_TODO = re.compile(r"((TODO)|(FIXME)|(HACK))[-: \t]*$")
 _RE_DOUBLE_NEWLINE = re.compile(r"\n[ \r\t]*\n[ \r\t]*$")
-_RE_LOWERCASE_LETTER = re.compile(r"[a-z]")
 
 
 def _is_new_sentence(text_before: str) -> bool:
@@ -396,6 +520,7 @@ def _is_new_sentence(text_before: str) -> bool:
     )
 
 
+@needs_context(SENTENCE_CONTEXT, SPACING_CONTEXT)
 def apply_title(text, surrounding_text=None):
     words = text.split(" ")
     title_words = [_format_title_word(word) for word in words]
@@ -406,12 +531,13 @@ def apply_title(text, surrounding_text=None):
         # since the kinds of words that are lowercase will start titles
         # less often.
         and surrounding_text
-        and _is_new_sentence(surrounding_text.text_before)
+        and _is_new_sentence(surrounding_text.before_point(SENTENCE_CONTEXT) or "")
     ):
         title_words[0] = capitalize(title_words[0])
     return _language_spaced(title_words, surrounding_text)
 
 
+@needs_context(SENTENCE_CONTEXT, SPACING_CONTEXT)
 def apply_sentence(text, surrounding_text=None):
     # TODO: Ideally we'd just pass this through a dedicated grammar formatter.
     words = text.split(" ")
@@ -421,12 +547,13 @@ def apply_sentence(text, surrounding_text=None):
         # When there's no context, we can't tell - so we never capitalize. The
         # user has to explicitly ask for it.
         and surrounding_text
-        and _is_new_sentence(surrounding_text.text_before)
+        and _is_new_sentence(surrounding_text.before_point(SENTENCE_CONTEXT) or "")
     ):
         words[0] = capitalize(words[0])
     return _language_spaced(words, surrounding_text)
 
 
+@needs_context(SPACING_CONTEXT, SPACING_CONTEXT)
 def apply_capitalized_sentence(text, surrounding_text=None):
     words = text.split(" ")
     if words:
@@ -436,6 +563,7 @@ def apply_capitalized_sentence(text, surrounding_text=None):
 
 # TODO: Maybe switch to `make_apply_brackets`? Perhaps not if we want to always
 #   capitalize
+@needs_context(SPACING_CONTEXT, SPACING_CONTEXT)
 def apply_speech(text, surrounding_text=None):
     """Format `text` as a capitalized quotation wrapped in speech marks."""
     # Fixme: doesn't capitalize.
@@ -467,21 +595,26 @@ def make_apply_brackets(open_, close_):
         out.text_after = close_ + out.text_after
         return out
 
+    apply_brackets.context_needed = apply_sentence.context_needed
     return apply_brackets
 
 
+@needs_context(0, 0)
 def apply_squash(text, surrounding_text=None):
     return ComplexInsert("".join(text.split(" ")))
 
 
+@needs_context(0, 0)
 def apply_lowercase(text, surrounding_text=None):
     return ComplexInsert(text.lower())
 
 
+@needs_context(0, 0)
 def apply_uppercase(text, surrounding_text=None):
     return ComplexInsert(text.upper())
 
 
+@needs_context(CHAR_CONTEXT, CHAR_CONTEXT)
 def apply_spaced(text, surrounding_text=None):
     prefix = "" if is_whitespace(surrounding_text.char_before) else " "
     suffix = " " if is_whitespace(surrounding_text.char_after) else " "
@@ -503,6 +636,7 @@ def add_prefix(prefix: str, formatting_func: FORMATTING_FUNC_TYPE):
         text = prefix + text
         return formatting_func(text, surrounding_text)
 
+    apply_formatting.context_needed = context_needed([formatting_func])
     return apply_formatting
 
 
@@ -530,6 +664,9 @@ def _chain_formatters(
 ):
     if not formatters:
         raise ValueError("Must provide at least 1 formatter.")
+    if surrounding_text:
+        # Get everything the chain will read in one go.
+        surrounding_text.prefetch(*context_needed(formatters))
     # There's no consistent way to combine complex inserts, so we convert all
     # but the last into text.
     for formatter in formatters[:-1]:
@@ -545,6 +682,7 @@ def formatter_chain(*formatters: List[FORMATTING_FUNC_TYPE]) -> FORMATTING_FUNC_
         nonlocal formatters
         return _chain_formatters(text, formatters, surrounding_text)
 
+    apply_chain.context_needed = context_needed(formatters)
     return apply_chain
 
 
@@ -553,22 +691,6 @@ def single_spaces(text: str):
     return _RE_MANY_SPACES.sub(" ", text)
 
 
-def _separate_punctuation(text: str):
-    """Separate ``text`` into a list of words and punctuation."""
-    components = []
-    last_char = ""
-    for char in text:
-        start_of_punctuation = is_alphanumeric(last_char) and not is_alphanumeric(char)
-        start_of_word = not is_alphanumeric(last_char) and is_alphanumeric(char)
-        is_transition = start_of_punctuation or start_of_word or not last_char
-        if is_transition:
-            # Start a new word
-            components.append("")
-        components[-1] += char
-        last_char = char
-    return components
-
-
 def is_alpha(text: str):
     """Is ``text`` solely composed of alphabetical characters?"""
     return _RE_ALPHA.match(text)
@@ -579,51 +701,6 @@ def is_numeric(text: str):
     return _RE_NUMERIC.match(text)
 
 
-def _split_word(word: str) -> str:
-    """Split a word into component camel/studley components.
-
-    E.g: thisIsATest -> this Is A Test
-
-    This method assumes `word` is entirely alphanumeric.
-
-    """
-    # TODO: Cope with non-alphanumeric
-    result = ""
-    last_char = ""
-    has_lowercase = _RE_LOWERCASE_LETTER.search(word)
-    for char in word:
-        start_of_number = is_alpha(last_char) and is_numeric(char)
-        end_of_number = is_numeric(last_char) and is_alpha(char)
-        # A capital letter means a new word, unless the entire symbol is
-        # uppercase. Numbers are also their own "word".
-        if (has_lowercase and char.isupper()) or start_of_number or end_of_number:
-            # This will miss the first letter of the first word. That's good -
-            # we don't want to pad the front.
-            result += " "
-        result += char
-        last_char = char
-    return result.strip()
-
-
-def separate_words(text) -> str:
-    """Separate ``text`` into a string of its constituent words.
-
-    E.g:
-
-        thisIsATest -> this Is A Test
-        This, is a sentence. -> This, is a sentence.
-
-    """
-    # Separate off each word, *then* split each word into component words.
-    result = ""
-    for component in _separate_punctuation(text):
-        if is_alphanumeric(component):
-            result += _split_word(component)
-        else:
-            result += component
-    return result
-
-
 def _strip_formatting(text: str) -> str:
     return (
         single_spaces(_RE_PUNCTUATION.sub(" ", text.replace("'", ""))).lower().strip()
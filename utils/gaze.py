@@ -3,14 +3,36 @@
 Replaces the broken eye_mouse.mouse.eye_hist pattern with talon.tracking_system.
 """
 
+import bisect
+import math
+import statistics
+import threading
+from array import array
 from collections import deque
 from dataclasses import dataclass
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 import talon
 from talon import ui
 from talon.types import Point2d
 
+# numpy is optional - the helpers below are vectorized when it's available.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Default I-VT velocity threshold, in normalized screen units per second.
+# Saccades are much faster than this, fixations much slower.
+FIXATION_VELOCITY_THRESHOLD = 1.0
+# Default I-DT dispersion threshold, in normalized screen units.
+FIXATION_DISPERSION_THRESHOLD = 0.03
+# Shortest gaze period counted as a fixation, in seconds.
+FIXATION_MIN_DURATION = 0.1
+# Number of recent fixations to keep.
+MAX_FIXATIONS = 256
+
 
 @dataclass
 class GazePoint:
@@ -22,21 +44,167 @@ class GazePoint:
     ts: float = 0.0
 
 
+@dataclass
+class Fixation:
+    """A period where the gaze held still."""
+
+    start: float
+    end: float
+    x: float
+    y: float
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    @property
+    def gaze(self) -> Point2d:
+        return Point2d(self.x, self.y)
+
+
+# Column names, in the order they're stored. Missing eyes are stored as NaN.
+_COLUMNS = ("ts", "x", "y", "left_x", "left_y", "right_x", "right_y")
+
+
+class GazeBuffer:
+    """Fixed-capacity gaze store, backed by one typed array per column.
+
+    Each sample is written twice - at ``i`` and ``i + capacity`` - so the most
+    recent samples are always contiguous. That means `view` can hand out
+    zero-copy memoryviews of the latest samples, without unwrapping the ring.
+
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._columns = {
+            name: array("d", bytes(8 * 2 * capacity)) for name in _COLUMNS
+        }
+        # Index the next sample will be written to.
+        self._head = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, ts, x, y, left_x, left_y, right_x, right_y):
+        with self._lock:
+            i = self._head
+            j = i + self.capacity
+            for name, value in zip(
+                _COLUMNS, (ts, x, y, left_x, left_y, right_x, right_y)
+            ):
+                column = self._columns[name]
+                column[i] = value
+                column[j] = value
+            self._head = (i + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+
+    def clear(self):
+        with self._lock:
+            self._head = 0
+            self._count = 0
+
+    def view(self, n: Optional[int] = None) -> dict:
+        """Get zero-copy views of the latest ``n`` samples (default: all).
+
+        Returns a dict mapping each column name to a memoryview, oldest sample
+        first. A view stays valid until ``capacity - n`` more samples arrive -
+        copy it if you need to hold on to it for longer.
+
+        """
+        with self._lock:
+            n = self._count if n is None else min(n, self._count)
+            return self._view(n)
+
+    def view_since(self, since: float) -> dict:
+        """Get zero-copy views of every sample at or after time ``since``."""
+        with self._lock:
+            end = self._head + self.capacity
+            ts = memoryview(self._columns["ts"])[end - self._count : end]
+            return self._view(self._count - bisect.bisect_left(ts, since))
+
+    def _view(self, n: int) -> dict:
+        """Views of the latest ``n`` samples. Must be called with the lock held."""
+        end = self._head + self.capacity
+        return {
+            name: memoryview(column)[end - n : end]
+            for name, column in self._columns.items()
+        }
+
+    def copy(self, n: Optional[int] = None) -> dict:
+        """Like `view`, but copies the samples (as lists) while they're locked.
+
+        Use this when the samples need to stay consistent with each other -
+        a view can be written to while it's being read.
+
+        """
+        with self._lock:
+            n = self._count if n is None else min(n, self._count)
+            end = self._head + self.capacity
+            return {
+                name: column[end - n : end].tolist()
+                for name, column in self._columns.items()
+            }
+
+    def sample(self, index: int) -> Optional[GazePoint]:
+        """Get one sample as a `GazePoint`. Negative indexes count back."""
+        with self._lock:
+            if index < 0:
+                index += self._count
+            if not 0 <= index < self._count:
+                return None
+            i = self._head + self.capacity - self._count + index
+            values = {name: column[i] for name, column in self._columns.items()}
+        return GazePoint(
+            gaze=Point2d(values["x"], values["y"]),
+            left_gaze=_optional_point(values["left_x"], values["left_y"]),
+            right_gaze=_optional_point(values["right_x"], values["right_y"]),
+            ts=values["ts"],
+        )
+
+
+def _optional_point(x, y) -> Optional[Point2d]:
+    return None if math.isnan(x) else Point2d(x, y)
+
+
 class GazeHistory:
     """Maintains a rolling history of gaze positions.
 
+    Samples live in a `GazeBuffer`, so recording a frame doesn't allocate.
+    Fixations are detected online (I-VT) as samples arrive, so the last
+    fixation before a given time can be found in O(log n).
+
     Usage:
         gaze = GazeHistory()
         gaze.start()
         # ... later ...
-        recent = gaze.history[-3:]  # last 3 samples
+        recent = gaze.buffer.view(3)  # last 3 samples, no copy
         gaze.stop()
     """
 
-    def __init__(self, max_history: int = 30):
+    def __init__(
+        self,
+        max_history: int = 1024,
+        velocity_threshold: float = FIXATION_VELOCITY_THRESHOLD,
+        min_fixation_duration: float = FIXATION_MIN_DURATION,
+    ):
         self._max_history = max_history
-        self._history: deque[GazePoint] = deque(maxlen=max_history)
+        self.buffer = GazeBuffer(max_history)
         self._active = False
+        self.velocity_threshold = velocity_threshold
+        self.min_fixation_duration = min_fixation_duration
+        # Completed fixations, oldest first. Start times are kept separately
+        # so they can be bisected.
+        self._fixations = deque(maxlen=MAX_FIXATIONS)
+        self._fixation_ends = deque(maxlen=MAX_FIXATIONS)
+        self._fixations_lock = threading.Lock()
+        # Running state of the fixation in progress.
+        self._previous = None
+        self._fixation_start = None
+        self._fixation_end = None
+        self._fixation_sums = (0.0, 0.0, 0)
 
     def start(self):
         """Start collecting gaze samples."""
@@ -52,27 +220,97 @@ class GazeHistory:
 
     def _on_gaze(self, frame):
         """Handle incoming gaze frame."""
-        point = GazePoint(
-            gaze=frame.gaze,
-            left_gaze=frame.left.gaze if hasattr(frame.left, "gaze") else None,
-            right_gaze=frame.right.gaze if hasattr(frame.right, "gaze") else None,
-            ts=frame.ts,
+        left = frame.left.gaze if hasattr(frame.left, "gaze") else None
+        right = frame.right.gaze if hasattr(frame.right, "gaze") else None
+        nan = math.nan
+        x, y, ts = frame.gaze.x, frame.gaze.y, frame.ts
+        self.buffer.append(
+            ts,
+            x,
+            y,
+            left.x if left else nan,
+            left.y if left else nan,
+            right.x if right else nan,
+            right.y if right else nan,
         )
-        self._history.append(point)
+        self._track_fixation(ts, x, y)
+
+    def _track_fixation(self, ts, x, y):
+        """Online I-VT: extend the current fixation, or close it on a saccade."""
+        previous = self._previous
+        self._previous = (ts, x, y)
+        if previous:
+            dt = ts - previous[0]
+            if dt <= 0:
+                return
+            velocity = math.hypot(x - previous[1], y - previous[2]) / dt
+            if velocity < self.velocity_threshold:
+                if self._fixation_start is None:
+                    self._fixation_start = previous[0]
+                    self._fixation_sums = (previous[1], previous[2], 1)
+                sum_x, sum_y, n = self._fixation_sums
+                self._fixation_sums = (sum_x + x, sum_y + y, n + 1)
+                self._fixation_end = ts
+                return
+        self._close_fixation()
+
+    def _close_fixation(self):
+        if self._fixation_start is None:
+            return
+        start, end = self._fixation_start, self._fixation_end
+        sum_x, sum_y, n = self._fixation_sums
+        self._fixation_start = None
+        if end - start >= self.min_fixation_duration:
+            with self._fixations_lock:
+                self._fixations.append(Fixation(start, end, sum_x / n, sum_y / n))
+                self._fixation_ends.append(end)
+
+    def last_fixation_before(self, timestamp: float) -> Optional[Fixation]:
+        """Get the last fixation that ended at or before ``timestamp``.
+
+        Only completed fixations are considered. O(log n).
+
+        """
+        with self._fixations_lock:
+            i = bisect.bisect_right(self._fixation_ends, timestamp)
+            return self._fixations[i - 1] if i else None
+
+    def __len__(self):
+        return len(self.buffer)
 
     @property
     def history(self) -> list[GazePoint]:
-        """Get the gaze history as a list."""
-        return list(self._history)
+        """Get the gaze history as a list.
+
+        This copies every sample - prefer `buffer.view` where possible.
+
+        """
+        columns = self.buffer.copy()
+        return [
+            GazePoint(
+                gaze=Point2d(x, y),
+                left_gaze=_optional_point(left_x, left_y),
+                right_gaze=_optional_point(right_x, right_y),
+                ts=ts,
+            )
+            for ts, x, y, left_x, left_y, right_x, right_y in zip(
+                *(columns[name] for name in _COLUMNS)
+            )
+        ]
 
     @property
     def latest(self) -> Optional[GazePoint]:
         """Get the most recent gaze sample."""
-        return self._history[-1] if self._history else None
+        return self.buffer.sample(-1)
 
     def clear(self):
         """Clear the history buffer."""
-        self._history.clear()
+        self.buffer.clear()
+        self._previous = None
+        self._fixation_start = None
+        with self._fixations_lock:
+            self._fixations.clear()
+            self._fixation_ends.clear()
 
 
 def gaze_to_pixels(gaze: Point2d, screen=None) -> Point2d:
@@ -127,6 +365,170 @@ def mean_gaze(points: list[GazePoint]) -> Optional[Point2d]:
     return Point2d(x, y)
 
 
+def _as_array(view):
+    """Wrap a column view as a numpy array (without copying), if possible."""
+    return np.frombuffer(view, dtype=np.float64) if np is not None else view
+
+
+def windowed_mean(view: dict) -> Optional[Point2d]:
+    """Mean gaze position over a `GazeBuffer` view."""
+    if not len(view["x"]):
+        return None
+    if np is not None:
+        return Point2d(
+            float(np.mean(_as_array(view["x"]))), float(np.mean(_as_array(view["y"])))
+        )
+    return Point2d(statistics.fmean(view["x"]), statistics.fmean(view["y"]))
+
+
+def windowed_median(view: dict) -> Optional[Point2d]:
+    """Median gaze position over a `GazeBuffer` view. Robust to outliers."""
+    if not len(view["x"]):
+        return None
+    if np is not None:
+        return Point2d(
+            float(np.median(_as_array(view["x"]))),
+            float(np.median(_as_array(view["y"]))),
+        )
+    return Point2d(statistics.median(view["x"]), statistics.median(view["y"]))
+
+
+def velocities(view: dict):
+    """Gaze speed between consecutive samples, in screen units per second.
+
+    Returns one fewer value than there are samples.
+
+    """
+    ts, xs, ys = view["ts"], view["x"], view["y"]
+    if np is not None:
+        ts, xs, ys = _as_array(ts), _as_array(xs), _as_array(ys)
+        dt = np.diff(ts)
+        dt[dt <= 0] = np.nan
+        return np.hypot(np.diff(xs), np.diff(ys)) / dt
+    return [
+        math.hypot(xs[i + 1] - xs[i], ys[i + 1] - ys[i]) / (ts[i + 1] - ts[i])
+        if ts[i + 1] > ts[i]
+        else math.nan
+        for i in range(len(ts) - 1)
+    ]
+
+
+def _fixation(view, start, end) -> Fixation:
+    """Make a fixation from samples ``start`` to ``end`` (inclusive)."""
+    xs, ys = view["x"][start : end + 1], view["y"][start : end + 1]
+    return Fixation(
+        view["ts"][start],
+        view["ts"][end],
+        statistics.fmean(xs),
+        statistics.fmean(ys),
+    )
+
+
+def fixations_ivt(
+    view: dict,
+    velocity_threshold: float = FIXATION_VELOCITY_THRESHOLD,
+    min_duration: float = FIXATION_MIN_DURATION,
+) -> List[Fixation]:
+    """Detect fixations in a `GazeBuffer` view by velocity threshold (I-VT)."""
+    speeds = velocities(view)
+    result = []
+    start = None
+    for i, speed in enumerate(speeds):
+        if speed < velocity_threshold:
+            if start is None:
+                start = i
+        elif start is not None:
+            if view["ts"][i] - view["ts"][start] >= min_duration:
+                result.append(_fixation(view, start, i))
+            start = None
+    if start is not None and view["ts"][-1] - view["ts"][start] >= min_duration:
+        result.append(_fixation(view, start, len(view["ts"]) - 1))
+    return result
+
+
+class _SlidingExtremes(object):
+    """Min & max of a sliding window over ``values``, in amortized O(1).
+
+    The window's ends may only move forwards.
+
+    """
+
+    def __init__(self, values):
+        self._values = values
+        # Indexes of candidate extremes, oldest first. Values are increasing
+        # in `_min` and decreasing in `_max`.
+        self._min = deque()
+        self._max = deque()
+
+    def push(self, i: int) -> None:
+        value = self._values[i]
+        while self._min and self._values[self._min[-1]] >= value:
+            self._min.pop()
+        self._min.append(i)
+        while self._max and self._values[self._max[-1]] <= value:
+            self._max.pop()
+        self._max.append(i)
+
+    def drop_before(self, start: int) -> None:
+        while self._min and self._min[0] < start:
+            self._min.popleft()
+        while self._max and self._max[0] < start:
+            self._max.popleft()
+
+    def range(self) -> float:
+        return self._values[self._max[0]] - self._values[self._min[0]]
+
+
+def fixations_idt(
+    view: dict,
+    dispersion_threshold: float = FIXATION_DISPERSION_THRESHOLD,
+    min_duration: float = FIXATION_MIN_DURATION,
+) -> List[Fixation]:
+    """Detect fixations in a `GazeBuffer` view by dispersion threshold (I-DT).
+
+    Both ends of the window only ever move forwards, so the dispersion is
+    tracked with sliding min/max windows. O(n) overall.
+
+    """
+    ts, xs, ys = view["ts"], view["x"], view["y"]
+    n = len(ts)
+    window_x, window_y = _SlidingExtremes(xs), _SlidingExtremes(ys)
+    # Samples up to (not including) this index are in the windows.
+    pushed = 0
+
+    def extend(end):
+        nonlocal pushed
+        for i in range(max(pushed, start), end + 1):
+            window_x.push(i)
+            window_y.push(i)
+        pushed = max(pushed, end + 1)
+
+    def dispersion():
+        return window_x.range() + window_y.range()
+
+    result = []
+    start = 0
+    while start < n:
+        # Grow the window to the minimum duration.
+        end = bisect.bisect_left(ts, ts[start] + min_duration, start)
+        if end >= n:
+            break
+        window_x.drop_before(start)
+        window_y.drop_before(start)
+        extend(end)
+        if dispersion() <= dispersion_threshold:
+            while end + 1 < n:
+                extend(end + 1)
+                if dispersion() > dispersion_threshold:
+                    break
+                end += 1
+            result.append(_fixation(view, start, end))
+            start = end + 1
+        else:
+            start += 1
+    return result
+
+
 # Global gaze history instance for shared use
 _global_gaze = None
 
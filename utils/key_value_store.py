@@ -1,17 +1,55 @@
+import logging
+import queue
 import threading
-from copy import copy
+import time
+from types import MappingProxyType
 from collections import defaultdict
+from contextlib import contextmanager
 
 from user.utils import Hook
 
 
+LOGGER = logging.getLogger(__name__)
+
+
 class KeyValueStore:
-    def __init__(self):
-        """Create a new key-value store."""
+    """Thread-safe key-value store with hooks that fire on updates.
+
+    The store is copy-on-write. Writers build a new dict under the lock, then
+    swap it in, so reads never need the lock and snapshots never need to be
+    copied.
+
+    Hooks run asynchronously, in order, on a dedicated dispatch thread. A slow
+    hook will never block a writer or a reader.
+
+    """
+
+    def __init__(self, coalesce_window=None):
+        """Create a new key-value store.
+
+        If ``coalesce_window`` is set (in seconds), hooks don't run on every
+        update. Instead, they run once at the end of the window, for all the
+        keys that changed within it.
+
+        """
+        # Never mutated - it's replaced wholesale on every write.
         self._store = {}
         self._lock = threading.Lock()
         self._key_hooks = defaultdict(Hook)
         self._update_hook = Hook()
+        self._coalesce_window = coalesce_window
+        # Keys that have changed since hooks were last dispatched.
+        self._pending_keys = set()
+        self._batch_depth = 0
+        # Each item is a ``(changed_keys, time_queued)`` tuple.
+        self._dispatch_queue = queue.Queue()
+        self._dispatch_thread = None
+        self._metrics_lock = threading.Lock()
+        self._n_dispatches = 0
+        self._total_hook_time = 0.0
+        self._max_hook_time = 0.0
+        self._last_hook_time = 0.0
+        self._max_queue_lag = 0.0
 
     def set(self, key, value):
         """Set ``key`` to ``value``."""
@@ -19,31 +57,31 @@ class KeyValueStore:
 
     def get(self, key, default=None):
         """Get the value associated with ``key``."""
-        with self._lock:
-            return self._store.get(key, default)
+        return self._store.get(key, default)
 
     def get_many(self, *keys):
         """Get the value of multiple keys, as a dict."""
-        with self._lock:
-            return {key: self._store.get(key) for key in keys}
+        store = self._store
+        return {key: store.get(key) for key in keys}
 
     def freeze(self):
         """Get a thread-safe snapshot of the store.
 
-        It's only a shallow copy.
+        This doesn't copy - it's a read-only view of the store as it was at the
+        time of the call. Later updates won't be reflected in it.
 
         """
-        return copy(self._store)
+        return MappingProxyType(self._store)
 
     def update(self, dict_):
         """Update all keys in ``dict_`` to their respective values."""
-        # TODO: Probably don't want to run hooks within the lock.
         if dict_:
             with self._lock:
-                for key, value in dict_.items():
-                    self._store[key] = value
-                    self._key_hooks[key].run(self._store)
-                self._update_hook.run(self._store)
+                new_store = dict(self._store)
+                new_store.update(dict_)
+                self._store = new_store
+                self._pending_keys.update(dict_.keys())
+            self._changed()
 
     def delete(self, *keys):
         """Delete keys from the store.
@@ -53,23 +91,107 @@ class KeyValueStore:
         """
         # First check is to avoid unnecessary computation.
         if self._store:
-            # NOTE: Could be a race here, but it doesn't matter#?.
             with self._lock:
-                # Second check is to avoid a race.
-                if self._store:
-                    for key in keys:
-                        del self._store[key]
-                        self._key_hooks[key].run(self._store)
-                    self._update_hook.run(self._store)
+                new_store = dict(self._store)
+                for key in keys:
+                    del new_store[key]
+                self._store = new_store
+                self._pending_keys.update(keys)
+            self._changed()
 
     def reset(self):
         """Delete all keys."""
         self.delete(*self._store.keys())
 
+    @contextmanager
+    def batch(self):
+        """Context manager that defers hooks until the context exits.
+
+        Hooks will then run once, for every key changed within the batch.
+        Batches can be nested.
+
+        """
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+            self._changed()
+
+    def _changed(self):
+        """Queue hooks for pending changes, unless we're in a batch."""
+        with self._lock:
+            if self._batch_depth or not self._pending_keys:
+                return
+            keys, self._pending_keys = self._pending_keys, set()
+            if not self._dispatch_thread:
+                self._dispatch_thread = threading.Thread(
+                    target=self._dispatch_loop, daemon=True
+                )
+                self._dispatch_thread.start()
+        self._dispatch_queue.put((keys, time.perf_counter()))
+
+    def _dispatch_loop(self):
+        while True:
+            keys, time_queued = self._dispatch_queue.get()
+            if self._coalesce_window:
+                time.sleep(self._coalesce_window)
+            # Fold in everything else that's queued up - hooks only need to
+            # see the latest state.
+            while True:
+                try:
+                    more_keys, _ = self._dispatch_queue.get_nowait()
+                except queue.Empty:
+                    break
+                keys |= more_keys
+            start = time.perf_counter()
+            self._run_hooks(keys)
+            self._record_dispatch(start - time_queued, time.perf_counter() - start)
+
+    def _run_hooks(self, keys):
+        snapshot = self.freeze()
+        for key in keys:
+            hook = self._key_hooks.get(key)
+            if hook:
+                hook.run(snapshot)
+        self._update_hook.run(snapshot)
+
+    def _record_dispatch(self, queue_lag, hook_time):
+        with self._metrics_lock:
+            self._n_dispatches += 1
+            self._total_hook_time += hook_time
+            self._last_hook_time = hook_time
+            self._max_hook_time = max(self._max_hook_time, hook_time)
+            self._max_queue_lag = max(self._max_queue_lag, queue_lag)
+        LOGGER.debug(
+            f"Store hooks took {hook_time * 1000:.1f}ms "
+            f"(queued for {queue_lag * 1000:.1f}ms)"
+        )
+
+    def metrics(self):
+        """Get stats about hook dispatch, as a dict. Times are in seconds.
+
+        Use this to see whether a hook is the bottleneck.
+
+        """
+        with self._metrics_lock:
+            n = self._n_dispatches
+            return {
+                "dispatches": n,
+                "queue_depth": self._dispatch_queue.qsize(),
+                "last_hook_time": self._last_hook_time,
+                "mean_hook_time": self._total_hook_time / n if n else 0.0,
+                "max_hook_time": self._max_hook_time,
+                "max_queue_lag": self._max_queue_lag,
+            }
+
     def hook(self, function, run_now=True):
         """Hook a function to fire whenever the store is updated.
 
-        `function` should take the store as its argument.
+        `function` should take the store as its argument. It will be called on
+        the store's dispatch thread.
 
         """
         self._update_hook.add(function)
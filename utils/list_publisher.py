@@ -0,0 +1,155 @@
+"""Publish frequently-changing lists to Talon without lagging the grammar.
+
+Every assignment to ``context.lists`` recompiles the grammar, so lists that
+track the editor state (visible words, symbols near point) can't be pushed on
+every update. `ListPublisher` makes them cheap enough to leave on:
+
+- Entries are ranked by the caller and capped, so the list stays small.
+- Updates are coalesced - a burst of them publishes once, at the end.
+- Publishes are rate-limited to one per ``min_interval``.
+- Nothing is published if the list hasn't changed since last time.
+
+"""
+
+import time
+import logging
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from talon import cron
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def most_common(words: Iterable[str]) -> List[str]:
+    """Rank ``words`` by how often they appear, most frequent first.
+
+    Ties keep the order in which the words were first seen.
+
+    """
+    return [word for word, _ in Counter(words).most_common()]
+
+
+class ListPublisher(object):
+    """Keeps ``list_name`` on ``context`` up to date, as cheaply as possible.
+
+    Call `update` as often as you like, from any thread. The list is published
+    on Talon's main thread once updates settle for ``delay`` (a `cron`
+    duration), and no more than once every ``min_interval`` seconds.
+
+    """
+
+    def __init__(
+        self,
+        context,
+        list_name: str,
+        max_entries: int = 200,
+        delay: str = "300ms",
+        min_interval: float = 1.0,
+    ):
+        self.context = context
+        self.list_name = list_name
+        self.max_entries = max_entries
+        self.delay = delay
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._pending = None
+        self._job = None
+        self._published = None
+        self._last_publish = 0.0
+        self._stats = {
+            "updates": 0,
+            "published": 0,
+            "skipped": 0,
+            "truncated": 0,
+            "last_publish_time": 0.0,
+            "total_publish_time": 0.0,
+            "max_publish_time": 0.0,
+        }
+
+    def update(self, entries: Iterable[Tuple[str, str]]) -> None:
+        """Queue a new list, given as ``(spoken, value)`` pairs, best first.
+
+        Only the first ``max_entries`` distinct spoken forms are kept. If a
+        spoken form appears twice, the first one wins.
+
+        """
+        capped = {}
+        truncated = False
+        for spoken, value in entries:
+            if not spoken or spoken in capped:
+                continue
+            if len(capped) >= self.max_entries:
+                truncated = True
+                break
+            capped[spoken] = value
+        with self._lock:
+            self._stats["updates"] += 1
+            if truncated:
+                self._stats["truncated"] += 1
+            self._pending = capped
+            if self._job is None:
+                self._job = cron.after(self.delay, self._flush)
+
+    def _flush(self) -> None:
+        with self._lock:
+            wait = self.min_interval - (time.monotonic() - self._last_publish)
+            if wait > 0:
+                # Published too recently - try again once the interval is up.
+                self._job = cron.after(f"{int(wait * 1000) + 1}ms", self._flush)
+                return
+            self._job = None
+            entries, self._pending = self._pending, None
+        if entries is not None:
+            self._publish(entries)
+
+    def _publish(self, entries: Dict[str, str]) -> None:
+        if entries == self._published:
+            with self._lock:
+                self._stats["skipped"] += 1
+            return
+        start = time.perf_counter()
+        # This is what recompiles the grammar.
+        self.context.lists[self.list_name] = entries
+        publish_time = time.perf_counter() - start
+        self._published = entries
+        self._last_publish = time.monotonic()
+        with self._lock:
+            stats = self._stats
+            stats["published"] += 1
+            stats["last_publish_time"] = publish_time
+            stats["total_publish_time"] += publish_time
+            stats["max_publish_time"] = max(stats["max_publish_time"], publish_time)
+        LOGGER.debug(
+            f"Published {len(entries)} entries to {self.list_name} "
+            f"in {publish_time * 1000:.1f}ms"
+        )
+
+    def flush_now(self) -> None:
+        """Publish any pending update immediately, ignoring the rate limit."""
+        with self._lock:
+            if self._job is not None:
+                cron.cancel(self._job)
+                self._job = None
+            entries, self._pending = self._pending, None
+        if entries is not None:
+            self._publish(entries)
+
+    @property
+    def published(self) -> Optional[Dict[str, str]]:
+        """The list as it was last published, or None if it never has been."""
+        return self._published
+
+    def stats(self) -> dict:
+        """Get stats about publishing, as a dict. Times are in seconds.
+
+        ``published`` is the number of grammar recompiles this list caused.
+
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        n = stats["published"]
+        stats["mean_publish_time"] = stats["total_publish_time"] / n if n else 0.0
+        return stats
@@ -7,12 +7,12 @@ you started a word like \"right click\").
 
 
 import time
-import collections
 import threading
 import math
 import logging
 import sys
-from copy import deepcopy
+import bisect
+from array import array
 from typing import Tuple, Optional
 
 from talon import cron, ctrl, actions, speech_system
@@ -20,37 +20,155 @@ from talon.types import Point2d
 
 # Amount of mouse history to record, in secs.
 HISTORY_LENGTH = 30
-# Time between position samples, in ms.
+# Time between position samples while the mouse is moving, in ms. This is the
+# fastest the mouse will be polled.
 TICK_INTERVAL = 16
+# Longest time between position samples while the mouse is idle, in ms. The
+# poll rate backs off towards this while the mouse is still.
+IDLE_TICK_INTERVAL = 250
 
 
 LOGGER = logging.getLogger(__name__)
 
 
-class SnapshotQueue(object):
-    """Queue that can have a thread-safe snapshot taken."""
+class PositionRingBuffer(object):
+    """Fixed-capacity ring buffer of timestamped positions. Thread-safe.
 
-    def __init__(self, maxlen):
+    Samples are stored in preallocated, typed array columns rather than as
+    individual Python objects, so memory is fixed (16 bytes per sample) no
+    matter how much history is kept. Timestamps must be appended in order,
+    which allows lookups by binary search.
+
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._times = array("d", bytes(8 * capacity))
+        self._xs = array("i", bytes(4 * capacity))
+        self._ys = array("i", bytes(4 * capacity))
+        # Physical index of the oldest sample.
+        self._start = 0
+        self._count = 0
         self._lock = threading.Lock()
-        self._queue = collections.deque([], maxlen=maxlen)
 
-    def append(self, item):
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, x, y):
         with self._lock:
-            self._queue.append(item)
+            if self._count < self.capacity:
+                i = (self._start + self._count) % self.capacity
+                self._count += 1
+            else:
+                # Full - overwrite the oldest sample.
+                i = self._start
+                self._start = (self._start + 1) % self.capacity
+            self._times[i] = timestamp
+            self._xs[i] = x
+            self._ys[i] = y
+
+    def _physical(self, logical_index):
+        return (self._start + logical_index) % self.capacity
+
+    def _sample(self, logical_index):
+        i = self._physical(logical_index)
+        return self._times[i], self._xs[i], self._ys[i]
+
+    def latest(self):
+        """Get the latest ``(time, x, y)`` sample, or None if empty."""
+        with self._lock:
+            if self._count:
+                return self._sample(self._count - 1)
+
+    def nearest(self, timestamp, interpolate=False):
+        """Get the sample nearest to ``timestamp``, as ``(time, x, y)``.
 
-    def snapshot(self, deep=False):
-        """Get a snapshot of the current contents, as a list. Thread-safe.
+        If ``interpolate`` is True and ``timestamp`` falls between two samples,
+        the position is linearly interpolated between them, and the returned
+        time is ``timestamp`` itself.
 
-        :param bool deep: Optional. If True, the snapshot will be a deep copy,
-          otherwise a shallow copy (i.e. the members can mutate under you).
-          Deeper copies will be slower. Default is False.
+        Returns None if the buffer is empty.
 
         """
         with self._lock:
-            if deep:
-                return [deepcopy(item) for item in self._queue]
+            if not self._count:
+                return None
+            # Index of the first sample at or after `timestamp`.
+            after = bisect.bisect_left(_TimeView(self), timestamp)
+            if after == 0:
+                return self._sample(0)
+            if after == self._count:
+                return self._sample(self._count - 1)
+            t1, x1, y1 = self._sample(after - 1)
+            t2, x2, y2 = self._sample(after)
+            if interpolate and t2 > t1:
+                fraction = (timestamp - t1) / (t2 - t1)
+                return (
+                    timestamp,
+                    int(round(x1 + (x2 - x1) * fraction)),
+                    int(round(y1 + (y2 - y1) * fraction)),
+                )
+            if timestamp - t1 <= t2 - timestamp:
+                return t1, x1, y1
             else:
-                return list(self._queue)
+                return t2, x2, y2
+
+    def at_or_before(self, timestamp, interpolate=False):
+        """Get the last sample at or before ``timestamp``, as ``(time, x, y)``.
+
+        Use this when samples are only stored on change - the position holds
+        until the next sample. If ``timestamp`` is before the first sample, the
+        first sample is returned.
+
+        If ``interpolate`` is True, the position is linearly interpolated
+        towards the next sample, and the returned time is ``timestamp``.
+
+        Returns None if the buffer is empty.
+
+        """
+        with self._lock:
+            if not self._count:
+                return None
+            # Index of the first sample after `timestamp`.
+            after = bisect.bisect_right(_TimeView(self), timestamp)
+            if after == 0:
+                return self._sample(0)
+            t1, x1, y1 = self._sample(after - 1)
+            if interpolate and after < self._count:
+                t2, x2, y2 = self._sample(after)
+                if t2 > t1:
+                    fraction = (timestamp - t1) / (t2 - t1)
+                    return (
+                        timestamp,
+                        int(round(x1 + (x2 - x1) * fraction)),
+                        int(round(y1 + (y2 - y1) * fraction)),
+                    )
+            return t1, x1, y1
+
+    def nbytes(self):
+        """Memory used by the sample columns, in bytes."""
+        return sum(
+            column.itemsize * len(column)
+            for column in (self._times, self._xs, self._ys)
+        )
+
+
+class _TimeView(object):
+    """Sequence view over a ring buffer's timestamps, in logical order.
+
+    Lets `bisect` search the buffer without copying it. Only use while holding
+    the buffer's lock.
+
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+
+    def __len__(self):
+        return self._buffer._count
+
+    def __getitem__(self, logical_index):
+        return self._buffer._times[self._buffer._physical(logical_index)]
 
 
 class TimestampedPosition:
@@ -68,31 +186,60 @@ class TimestampedPosition:
 
 
 class MouseHistory(object):
-    def __init__(self, length_in_secs, tick_in_ms):
+    def __init__(self, length_in_secs, tick_in_ms, idle_tick_in_ms=None):
         """Create an object to store the mouse history.
 
+        The mouse is polled adaptively. Samples are only stored when the
+        position changes, and the poll rate backs off while the mouse is idle,
+        then jumps back up to ``tick_in_ms`` as soon as it moves.
+
         :param length: amount of history to store, in seconds.
-        :param tick: tick length, in milliseconds.
+        :param tick: tick length while moving, in milliseconds.
+        :param idle_tick: Optional. Longest tick length while idle, in
+          milliseconds. Defaults to `IDLE_TICK_INTERVAL`.
 
         """
         self.length = length_in_secs
         self.tick = tick_in_ms
-
-        self._mouse_capture_job = cron.interval(
-            f"{tick_in_ms}ms", self._record_mouse_position
-        )
+        self.idle_tick = max(idle_tick_in_ms or IDLE_TICK_INTERVAL, tick_in_ms)
 
         tick_in_secs = float(tick_in_ms) / 1000
+        # Only changes are stored, so this is enough for at least
+        # `length_in_secs` of continuous movement.
         self.item_limit = math.ceil(float(length_in_secs) / tick_in_secs)
-        self.history = SnapshotQueue(maxlen=self.item_limit)
+        self.history = PositionRingBuffer(self.item_limit)
+
+        self._current_tick = tick_in_ms
+        self._last_position = None
+        self._last_poll_time = None
+        self._last_sample_time = None
+        self._stopped = False
+        self._mouse_capture_job = cron.after(
+            f"{self._current_tick}ms", self._record_mouse_position
+        )
 
     def __del__(self):
+        self.stop()
+
+    def stop(self):
+        """Stop tracking the mouse."""
+        self._stopped = True
         try:
             cron.cancel(self._mouse_capture_job)
         except Exception:
             pass
 
     def _record_mouse_position(self):
+        if self._stopped:
+            return
+        try:
+            self._poll()
+        finally:
+            self._mouse_capture_job = cron.after(
+                f"{self._current_tick}ms", self._record_mouse_position
+            )
+
+    def _poll(self):
         timestamp = time.time()
         try:
             position = ctrl.mouse_pos()
@@ -103,30 +250,45 @@ class MouseHistory(object):
             # TODO: Maybe don't spam the log here
             print(f"Error getting mouse pos: {e}", file=sys.stderr)
             position = (0, 0)
-        self.history.append(TimestampedPosition(position, timestamp))
+        position = (int(position[0]), int(position[1]))
+        if position != self._last_position:
+            if (
+                self._last_position is not None
+                and self._last_poll_time != self._last_sample_time
+            ):
+                # The mouse was idle until at least the last poll. Anchor it
+                # there, so lookups (& interpolation) don't smear the movement
+                # back across the whole idle period.
+                self.history.append(self._last_poll_time, *self._last_position)
+            self.history.append(timestamp, *position)
+            self._last_position = position
+            self._last_sample_time = timestamp
+            self._current_tick = self.tick
+        else:
+            self._current_tick = min(self._current_tick * 2, self.idle_tick)
+        self._last_poll_time = timestamp
 
-    def position_at_time(self, timestamp):
+    def position_at_time(self, timestamp, interpolate=False):
         """Get the mouse position at a particular timestamp.
 
-        :returns: a tuple of the timestamp the position was taken, plus the
-          position.
-        :rtype: tuple(int, (int, int))
+        :param bool interpolate: Optional. If True, interpolate between the
+          samples either side of ``timestamp``. Default is False.
+        :returns: the position at ``timestamp``, or None if there's no history
+          yet.
+        :rtype: TimestampedPosition
 
         """
         self._log_size()
-        diff, pos = min(
-            [(abs(timestamp - pos.time), pos) for pos in self.history.snapshot()]
-        )
-        return pos
+        sample = self.history.at_or_before(timestamp, interpolate=interpolate)
+        if sample:
+            time_, x, y = sample
+            return TimestampedPosition((x, y), time_)
 
     def _log_size(self):
         """Log the size of the mouse history, iff debugging."""
-        # On my Windows machine, 30 secs of history logs at around 4.7 Mb.
-        if LOGGER.level >= logging.DEBUG:
+        if LOGGER.isEnabledFor(logging.DEBUG):
             LOGGER.debug(
-                "Size of mouse history: {} Mb".format(
-                    sys.getsizeof(self.history) / (10 ^ 6)
-                )
+                "Size of mouse history: {} Mb".format(self.history.nbytes() / 10**6)
             )
 
 
@@ -141,13 +303,14 @@ def position_at_time(timestamp):
 def restart_tracking():
     """Restart the history tracker.
 
-    This must be called for changes in `HISTORY_LENGTH` or `TICK_INTERVAL` to
-    propogate.
+    This must be called for changes in `HISTORY_LENGTH`, `TICK_INTERVAL` or
+    `IDLE_TICK_INTERVAL` to propogate.
 
     """
     # TODO: Test this
-    global _MOUSE_HISTORY, HISTORY_LENGTH, TICK_INTERVAL
-    _MOUSE_HISTORY = MouseHistory(HISTORY_LENGTH, TICK_INTERVAL)
+    global _MOUSE_HISTORY, HISTORY_LENGTH, TICK_INTERVAL, IDLE_TICK_INTERVAL
+    _MOUSE_HISTORY.stop()
+    _MOUSE_HISTORY = MouseHistory(HISTORY_LENGTH, TICK_INTERVAL, IDLE_TICK_INTERVAL)
 
 
 def actual_word_start(word):
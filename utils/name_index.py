@@ -0,0 +1,275 @@
+"""Index for matching spoken names against lists of window titles, apps, etc.
+
+Build a `NameIndex` once per candidate set, then query it as many times as you
+like. Lookups don't scan the candidates:
+
+- Exact matches are a dict lookup.
+- Prefix matches are a bisect into the sorted names.
+- Substring matches intersect n-gram posting lists, then verify the survivors.
+- Token matches intersect per-word posting lists.
+
+For a candidate list that's only queried once, `match_names` scans it
+instead, since indexing it would cost more than the lookup saves.
+
+`PhraseIndex` is similar, but matches runs of whole words, e.g. spoken
+fragments of buffer names.
+
+"""
+
+import bisect
+from collections import Counter, defaultdict
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+
+# Longest n-gram indexed for substring search. Shorter targets are looked up
+# directly; longer targets intersect the postings of their n-grams.
+NGRAM_LENGTH = 3
+# Lowest `NameIndex.ranked` score worth acting on, when falling back to a
+# fuzzy match. Mistranscriptions ("fire fox", "crome") score above this;
+# names that merely share a few letters score well below it.
+RANKED_MIN_SCORE = 0.45
+
+
+def _ngrams(text, n):
+    return {text[i : i + n] for i in range(len(text) - n + 1)}
+
+
+class NameIndex:
+    """Match names against a fixed list of ``(name, value)`` candidates.
+
+    Matching is case-insensitive. Where several candidates match equally
+    well, they're returned in their original order.
+
+    """
+
+    def __init__(self, candidates: Iterable[Tuple[str, Any]]):
+        self.names = []
+        self.values = []
+        self._exact = defaultdict(list)
+        # ``(name, position)`` pairs, sorted, for prefix bisection.
+        self._sorted = []
+        self._grams = defaultdict(set)
+        self._tokens = defaultdict(set)
+        for i, (name, value) in enumerate(candidates):
+            name = name.lower()
+            self.names.append(name)
+            self.values.append(value)
+            self._exact[name].append(i)
+            self._sorted.append((name, i))
+            for n in range(1, NGRAM_LENGTH + 1):
+                for gram in _ngrams(name, n):
+                    self._grams[gram].add(i)
+            for token in name.split(" "):
+                self._tokens[token].add(i)
+        self._sorted.sort()
+
+    def __len__(self):
+        return len(self.names)
+
+    def exact(self, target: str) -> List[int]:
+        """Positions of candidates named exactly ``target``."""
+        return list(self._exact.get(target.lower(), ()))
+
+    def prefix(self, target: str) -> List[int]:
+        """Positions of candidates whose names start with ``target``."""
+        target = target.lower()
+        start = bisect.bisect_left(self._sorted, (target,))
+        result = []
+        for name, i in self._sorted[start:]:
+            if not name.startswith(target):
+                break
+            result.append(i)
+        return sorted(result)
+
+    def substring(self, target: str) -> List[int]:
+        """Positions of candidates whose names contain ``target``."""
+        target = target.lower()
+        if not target:
+            return list(range(len(self)))
+        if len(target) <= NGRAM_LENGTH:
+            return sorted(self._grams.get(target, ()))
+        # Every n-gram of the target must appear in the name. That narrows the
+        # candidates down - then check the survivors properly.
+        postings = sorted(
+            (self._grams.get(gram, set()) for gram in _ngrams(target, NGRAM_LENGTH)),
+            key=len,
+        )
+        survivors = set.intersection(*postings)
+        return sorted(i for i in survivors if target in self.names[i])
+
+    def tokens(self, target: str) -> List[int]:
+        """Positions of candidates containing every word in ``target``."""
+        postings = sorted(
+            (self._tokens.get(word, set()) for word in target.lower().split(" ")),
+            key=len,
+        )
+        return sorted(set.intersection(*postings))
+
+    def match_indices(
+        self,
+        target: str,
+        match_start: bool = True,
+        match_anywhere: bool = True,
+        match_fuzzy: bool = True,
+    ) -> List[int]:
+        """Positions of matching candidates, best to worst.
+
+        Exact matches come first, then prefix matches, then substring matches,
+        then matches that contain all the target's words, in any order.
+
+        """
+        tiers = [self.exact(target)]
+        if match_start:
+            tiers.append(self.prefix(target))
+        if match_anywhere:
+            tiers.append(self.substring(target))
+        if match_fuzzy:
+            tiers.append(self.tokens(target))
+        seen = set()
+        return [i for tier in tiers for i in tier if not (i in seen or seen.add(i))]
+
+    def match(self, target: str, *args, **kwargs) -> List[Any]:
+        """Like `match_indices`, but returns the candidates' values."""
+        return [self.values[i] for i in self.match_indices(target, *args, **kwargs)]
+
+    def ranked(
+        self, target: str, limit: int = 10, min_score: float = 0.0
+    ) -> List[Tuple[float, Any]]:
+        """Fuzzy-match ``target``, returning ``(score, value)`` pairs.
+
+        Scores are in the range 0-1. Candidates are scored by the n-grams they
+        share with the target, so typos and transcription errors still match.
+        Exact, prefix and whole-word matches get a bonus.
+
+        """
+        return [
+            (score, self.values[i])
+            for score, i in self.ranked_indices(target, limit, min_score)
+        ]
+
+    def ranked_indices(
+        self, target: str, limit: Optional[int] = None, min_score: float = 0.0
+    ) -> List[Tuple[float, int]]:
+        """Like `ranked`, but returns ``(score, position)`` pairs."""
+        target = target.lower()
+        grams = _ngrams(target, min(NGRAM_LENGTH, len(target)))
+        if not grams:
+            return []
+        shared = defaultdict(int)
+        for gram in grams:
+            for i in self._grams.get(gram, ()):
+                shared[i] += 1
+        target_words = set(target.split(" "))
+        scored = []
+        for i, n_shared in shared.items():
+            name = self.names[i]
+            n_name_grams = max(len(name) - len(next(iter(grams))) + 1, 1)
+            # Mostly, how much of the target is covered - but use the Dice
+            # coefficient to prefer names without much else in them.
+            coverage = n_shared / len(grams)
+            dice = 2 * n_shared / (len(grams) + n_name_grams)
+            score = (3 * coverage + dice) / 4
+            if name == target:
+                score = 1.0
+            elif name.startswith(target):
+                score = 0.5 + score / 2
+            elif target_words <= set(name.split(" ")):
+                score = 0.25 + score * 3 / 4
+            if score >= min_score:
+                scored.append((score, i))
+        scored.sort(key=lambda it: (-it[0], it[1]))
+        return scored[:limit]
+
+
+def match_names(
+    target: str,
+    candidates: Iterable[Tuple[str, Any]],
+    match_start: bool = True,
+    match_anywhere: bool = True,
+    match_fuzzy: bool = True,
+) -> List[Any]:
+    """Match ``target`` against ``candidates`` once, without building an index.
+
+    Same tiers & order as `NameIndex.match`, but a linear scan - cheaper than
+    indexing a candidate list that will only be queried once. If fuzzy matching
+    is on and nothing matches, falls back to `NameIndex.ranked` (scoring above
+    `RANKED_MIN_SCORE`), so mistranscribed names still match.
+
+    """
+    target = target.lower()
+    target_words = target.split(" ")
+    candidates = [(name.lower(), value) for name, value in candidates]
+    tiers = [lambda name: name == target]
+    if match_start:
+        tiers.append(lambda name: name.startswith(target))
+    if match_anywhere:
+        tiers.append(lambda name: target in name)
+    if match_fuzzy:
+        tiers.append(lambda name: set(target_words) <= set(name.split(" ")))
+    seen = set()
+    result = []
+    for matches in tiers:
+        for i, (name, value) in enumerate(candidates):
+            if i not in seen and matches(name):
+                seen.add(i)
+                result.append(value)
+    if match_fuzzy and not result:
+        # Only index the candidates when it's needed - this should be rare.
+        result = [
+            value
+            for _, value in NameIndex(candidates).ranked(
+                target, None, RANKED_MIN_SCORE
+            )
+        ]
+    return result
+
+
+class PhraseIndex:
+    """Find the candidates whose words contain a run of words.
+
+    Candidates are ``(words, value)`` pairs. Each word is posted with the
+    positions it appears at in each candidate, so the index grows with the
+    total number of words - the runs themselves are never stored.
+
+    """
+
+    def __init__(self, candidates: Iterable[Tuple[Sequence[str], Any]]):
+        self.values = []
+        # word -> {candidate position: [word positions]}
+        self._postings = defaultdict(lambda: defaultdict(list))
+        # How many candidates each word appears in.
+        self.word_counts = Counter()
+        for i, (words, value) in enumerate(candidates):
+            self.values.append(value)
+            for position, word in enumerate(words):
+                self._postings[word][i].append(position)
+            self.word_counts.update(set(words))
+
+    def __len__(self):
+        return len(self.values)
+
+    def find_indices(self, words: Sequence[str]) -> List[int]:
+        """Positions of candidates containing ``words``, in order, adjacent."""
+        if not words:
+            return []
+        postings = [self._postings.get(word) for word in words]
+        if not all(postings):
+            return []
+        # Only candidates with every word can match - check those.
+        rarest = min(postings, key=len)
+        result = []
+        for i in rarest:
+            if not all(i in posting for posting in postings):
+                continue
+            starts = set(postings[0][i])
+            for offset, posting in enumerate(postings[1:], 1):
+                starts &= {position - offset for position in posting[i]}
+                if not starts:
+                    break
+            if starts:
+                result.append(i)
+        return sorted(result)
+
+    def find(self, words: Sequence[str]) -> List[Any]:
+        """Like `find_indices`, but returns the candidates' values."""
+        return [self.values[i] for i in self.find_indices(words)]
@@ -0,0 +1,326 @@
+"""Parsing for spoken numbers, shared by the number captures & helpers.
+
+Every number word is looked up in one precompiled table, mapping it to its
+kind and value. Compound numbers ("five hundred and twenty one thousand") are
+then evaluated by a chain of generators - each a small state machine - so a
+number is parsed in a single pass, without building intermediate lists.
+
+Originally based on lunixbochs' number parsing:
+https://github.com/lunixbochs/community/blob/master/text/numbers.py
+
+"""
+
+import random
+import time
+import logging
+from typing import Iterable, List, Optional
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+digits = [
+    "zero",
+    "one",
+    "two",
+    "three",
+    "four",
+    "five",
+    "six",
+    "seven",
+    "eight",
+    "nine",
+]
+teens = [
+    "eleven",
+    "twelve",
+    "thirteen",
+    "fourteen",
+    "fifteen",
+    "sixteen",
+    "seventeen",
+    "eighteen",
+    "nineteen",
+]
+tens = [
+    "ten",
+    "twenty",
+    "thirty",
+    "forty",
+    "fifty",
+    "sixty",
+    "seventy",
+    "eighty",
+    "ninety",
+]
+scales = [
+    "hundred",
+    "thousand",
+    "million",
+    "billion",
+    "trillion",
+    "quadrillion",
+    "quintillion",
+    "sextillion",
+    "septillion",
+    "octillion",
+    "nonillion",
+    "decillion",
+]
+
+digits_map = {n: i for i, n in enumerate(digits)}
+teens_map = {n: i + 11 for i, n in enumerate(teens)}
+tens_map = {n: 10 * (i + 1) for i, n in enumerate(tens)}
+# Oh misrecognizes a lot so try disabling it
+# digits_map["oh"] = 0
+
+scales_map = {scales[0]: 100}
+scales_map.update({n: 10 ** ((i + 1) * 3) for i, n in enumerate(scales[1:])})
+
+# Word kinds, for `NUMBER_WORDS`.
+DIGIT = "digit"
+TEEN = "teen"
+TENS = "tens"
+SCALE = "scale"
+AND = "and"
+
+# Maps every word that can appear in a spoken number to ``(kind, value)``.
+NUMBER_WORDS = {}
+for _kind, _map in ((DIGIT, digits_map), (TEEN, teens_map), (TENS, tens_map)):
+    NUMBER_WORDS.update({word: (_kind, value) for word, value in _map.items()})
+NUMBER_WORDS.update({word: (SCALE, value) for word, value in scales_map.items()})
+NUMBER_WORDS["and"] = (AND, None)
+
+# Numerals that can be spoken as a postfix to a command - "0" to "19", then the
+# tens. See `trailing_numerals_value`.
+NUMERALS = {str(n): n for n in range(0, 20)}
+NUMERALS.update({str(n): n for n in range(20, 100, 10)})
+NUMERALS["oh"] = 0  # synonym for zero
+
+# Maps single digits - as digits, words, or Dragon's "<word>\number" form - to
+# their value, as a string. See `digit_string_value`.
+DIGIT_STRINGS = {"oh": "0"}  # 'oh' => zero
+for _i, _word in enumerate(digits):
+    DIGIT_STRINGS[str(_i)] = str(_i)
+    DIGIT_STRINGS[_word] = str(_i)
+    DIGIT_STRINGS["%s\\number" % (_word)] = str(_i)
+
+
+def _small_numbers(words):
+    """Fold digits, teens & tens into numbers. Other words are passed through.
+
+    "twenty one" -> 21. Raises `ValueError` on a word that isn't a number word.
+
+    """
+    pending_tens = None
+    for word in words:
+        if isinstance(word, int):
+            # Already a number - e.g. from a capture.
+            kind, value = None, word
+        else:
+            try:
+                kind, value = NUMBER_WORDS[word]
+            except KeyError:
+                raise ValueError(f'Not a number word: "{word}"')
+        if kind == DIGIT and pending_tens is not None:
+            yield pending_tens + value
+            pending_tens = None
+            continue
+        if pending_tens is not None:
+            yield pending_tens
+            pending_tens = None
+        if kind == TENS:
+            pending_tens = value
+        elif kind in (None, DIGIT, TEEN):
+            yield value
+        else:
+            yield word
+    if pending_tens is not None:
+        yield pending_tens
+
+
+def _fuse_scale(words, limit=None):
+    """Fuse scales (hundred, thousand) leftward onto numbers."""
+    n = None
+    scale = 1
+    for w in words:
+        if w in tens_map:
+            scale *= tens_map[w]
+            continue
+        elif w in scales_map and (limit is None or scales_map[w] < limit):
+            scale *= scales_map[w]
+            continue
+        elif w == "and":
+            continue
+
+        if n is not None:
+            yield n * scale
+        n = None
+        scale = 1
+
+        if isinstance(w, int):
+            n = w
+        else:
+            yield w
+
+    if n is not None:
+        yield n * scale
+
+
+def _fuse_num(words):
+    """Fuse small numbers leftward onto larger numbers."""
+    acc = None
+    sig = 0
+    for w in words:
+        if isinstance(w, int):
+            if acc is None:
+                acc = w
+                sig = 10 ** len(str(w))
+            elif acc > w:
+                nsig = 10 ** len(str(w))
+                if nsig >= sig:
+                    acc *= nsig
+                acc += w
+                sig = min(sig, nsig)
+            else:
+                yield acc
+                acc = w
+                sig = 0
+        else:
+            if acc is not None:
+                yield acc
+                acc = None
+                sig = 0
+            yield w
+    if acc is not None:
+        yield acc
+
+
+def natural_value(words: Iterable) -> Optional[int]:
+    """Evaluate a naturally-spoken number, e.g. "five hundred and twenty one".
+
+    ``words`` may mix number words with ints (e.g. the values of
+    `<number_small>` captures). Only the first number spoken is returned - the
+    rest of the words aren't evaluated at all.
+
+    """
+    # Fuse hundreds first, so each group is complete ("four hundred and eighty
+    # four") before it's scaled by "thousand", "million", etc.
+    numbers = _small_numbers(words)
+    fused = _fuse_num(_fuse_scale(_fuse_num(_fuse_scale(numbers, 1000))))
+    return next(fused, None)
+
+
+def trailing_numerals_value(words: List[str]) -> int:
+    """Read the numerals at the end of ``words`` as one number.
+
+    Each numeral counts as one decimal place, so ``["go", "1", "2"]`` -> 12.
+    Stops at the first word (from the end) that isn't a numeral.
+
+    """
+    result = 0
+    factor = 1
+    for word in reversed(words):
+        value = NUMERALS.get(word)
+        if value is None:
+            # we consumed all the numbers and only the command name is left.
+            break
+        result += factor * value
+        factor *= 10
+    return result
+
+
+def digit_string_value(words: Iterable) -> Optional[int]:
+    """Read the digits in ``words`` as one number, ignoring any other words.
+
+    Returns None if there are no digits.
+
+    """
+    number = "".join(
+        value for value in map(DIGIT_STRINGS.get, map(str, words)) if value
+    )
+    # int() already ignores leading zeros.
+    return int(number) if number else None
+
+
+def number_to_words(n: int) -> List[str]:
+    """Spell out ``n`` the way it would naturally be spoken."""
+    if n == 0:
+        return ["zero"]
+    words = []
+    groups = []
+    while n:
+        n, group = divmod(n, 1000)
+        groups.append(group)
+    for scale_index in reversed(range(len(groups))):
+        group = groups[scale_index]
+        if not group:
+            continue
+        hundreds, rest = divmod(group, 100)
+        if hundreds:
+            words += [digits[hundreds], "hundred"]
+            if rest:
+                words.append("and")
+        if rest >= 20 or rest == 10:
+            words.append(tens[rest // 10 - 1])
+            if rest % 10:
+                words.append(digits[rest % 10])
+        elif rest > 10:
+            words.append(teens[rest - 11])
+        elif rest:
+            words.append(digits[rest])
+        if scale_index:
+            words.append(scales[scale_index])
+    return words
+
+
+# Phrasings with a defined (if unusual) reading.
+_KNOWN_NUMBERS = [
+    (
+        [1, "hundred", "thousand", "and", 5, "thousand", "and", 6, "thousand"],
+        1050006000,
+    ),
+    ([1, "hundred", "and", 5, "thousand"], 105000),
+    ([1, "thousand", "thousand"], 1000000),
+    ([1, "million", 5, "hundred", 1, "thousand"], 1501000),
+    (
+        [1, "million", 5, "hundred", "and", 1, "thousand", 1, "hundred", "and", 6],
+        1501106,
+    ),
+    ([1, "million", 1, 1], 10000011),
+    ([1, "million", 10, 10], 100001010),
+]
+
+
+def self_check(n_samples=10000, max_value=10**15, seed=None):
+    """Check randomly-generated spoken numbers all parse back correctly.
+
+    Raises `AssertionError` on the first failure.
+
+    """
+    for words, expected in _KNOWN_NUMBERS:
+        assert natural_value(words) == expected, (words, natural_value(words))
+    rng = random.Random(seed)
+    for _ in range(n_samples):
+        n = rng.randrange(max_value // 10 ** rng.randrange(15))
+        words = number_to_words(n)
+        assert natural_value(words) == n, (words, natural_value(words))
+        digit_words = [digits[int(d)] for d in str(n)]
+        assert digit_string_value(digit_words) == n, digit_words
+        numerals = ["go"] + list(str(n))
+        assert trailing_numerals_value(numerals) == n, numerals
+
+
+def benchmark(n_samples=100000, seed=0):
+    """Time parsing of a corpus of spoken numbers. Logs (and returns) us/number."""
+    rng = random.Random(seed)
+    corpus = [
+        number_to_words(rng.randrange(10 ** rng.randrange(1, 13)))
+        for _ in range(n_samples)
+    ]
+    start = time.perf_counter()
+    for words in corpus:
+        natural_value(words)
+    per_number = (time.perf_counter() - start) / n_samples * 1e6
+    LOGGER.info(f"Parsed {n_samples} spoken numbers: {per_number:.2f}us each")
+    return per_number
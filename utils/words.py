@@ -0,0 +1,179 @@
+"""Splitting names into words, and converting them to spoken forms.
+
+These run over every buffer name, symbol, app name etc. each time their lists
+refresh, and most of those names haven't changed since the last refresh. So
+each function tokenizes in one regex pass, and remembers its recent results.
+
+"""
+
+import re
+import time
+import random
+import logging
+from functools import lru_cache
+
+
+LOGGER = logging.getLogger(__name__)
+
+# How many recent results each function remembers.
+CACHE_SIZE = 8192
+
+spoken_digits = {
+    "1": "one",
+    "2": "two",
+    "3": "three",
+    "4": "four",
+    "5": "five",
+    "6": "six",
+    "7": "seven",
+    "8": "eight",
+    "9": "nine",
+    "0": "zero",
+}
+
+
+# Runs of alphanumeric chars, and the runs of punctuation between them. The
+# groups say which is which.
+_RE_COMPONENT = re.compile(r"([a-zA-Z0-9]+)|([^a-zA-Z0-9]+)")
+# Words within an alphanumeric run. Numbers are their own word. A capital
+# letter starts a new word - unless there are no lowercase letters at all, in
+# which case the capitals stay together.
+_RE_MIXED_CASE_WORD = re.compile(r"[0-9]+|[a-zA-Z][a-z]*")
+_RE_UPPERCASE_WORD = re.compile(r"[0-9]+|[A-Z]+")
+_RE_LOWERCASE_LETTER = re.compile(r"[a-z]")
+# Spoken forms are made of letter runs & single digits. Everything else goes.
+_RE_SPOKEN_TOKEN = re.compile(r"[a-zA-Z]+|[0-9]")
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def split_word(word: str) -> str:
+    """Split a word into component camel/studley components.
+
+    E.g: thisIsATest -> this Is A Test
+
+    This method assumes `word` is entirely alphanumeric.
+
+    """
+    if _RE_LOWERCASE_LETTER.search(word):
+        return " ".join(_RE_MIXED_CASE_WORD.findall(word))
+    else:
+        return " ".join(_RE_UPPERCASE_WORD.findall(word))
+
+
+def separate_punctuation(text: str):
+    """Separate ``text`` into a list of words and punctuation."""
+    return [match.group() for match in _RE_COMPONENT.finditer(text)]
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def separate_words(text: str) -> str:
+    """Separate ``text`` into a string of its constituent words.
+
+    E.g:
+
+        thisIsATest -> this Is A Test
+        This, is a sentence. -> This, is a sentence.
+
+    """
+    # Separate off each word, *then* split each word into component words.
+    return "".join(
+        split_word(word) if word else punctuation
+        for word, punctuation in _RE_COMPONENT.findall(text)
+    )
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def spoken_form(text: str) -> str:
+    """Convert ``text`` into a format compatible with speech lists."""
+    # Digits are spoken individually - this will NOT create multiple-digit
+    # forms.
+    return " ".join(
+        spoken_digits.get(token, token) for token in _RE_SPOKEN_TOKEN.findall(text)
+    )
+
+
+def cache_info() -> dict:
+    """Get the hit rate of each cache, e.g. to check `CACHE_SIZE` is enough."""
+    return {
+        func.__name__: func.cache_info()
+        for func in (split_word, separate_words, spoken_form)
+    }
+
+
+def clear_caches() -> None:
+    for func in (split_word, separate_words, spoken_form):
+        func.cache_clear()
+
+
+_CORPUS_WORDS = [
+    "buffer",
+    "list",
+    "init",
+    "config",
+    "user",
+    "http",
+    "server",
+    "test",
+    "utils",
+    "main",
+    "index",
+    "voice",
+    "mode",
+    "org",
+    "data",
+]
+_CORPUS_EXTENSIONS = [".py", ".el", ".org", ".md", ".json", ".talon", ".txt"]
+
+
+def _random_name(rng) -> str:
+    words = rng.sample(_CORPUS_WORDS, rng.randrange(1, 4))
+    if rng.random() < 0.2:
+        words.append(str(rng.randrange(100)))
+    style = rng.randrange(6)
+    if style == 0:
+        name = "_".join(words)
+    elif style == 1:
+        name = words[0] + "".join(word.capitalize() for word in words[1:])
+    elif style == 2:
+        name = "".join(word.capitalize() for word in words)
+    elif style == 3:
+        name = "-".join(words).upper() if rng.random() < 0.3 else "-".join(words)
+    elif style == 4:
+        # Special buffers, e.g. "*scratch*"
+        name = f"*{' '.join(words)}*"
+    else:
+        name = " ".join(word.capitalize() for word in words)
+    if style < 4 and rng.random() < 0.5:
+        name += rng.choice(_CORPUS_EXTENSIONS)
+    return name
+
+
+def benchmark(n_names=2000, n_refreshes=20, churn=0.05, seed=0):
+    """Time repeated refreshes of a list of identifiers & file names.
+
+    Each refresh replaces ``churn`` of the names, like a buffer list would
+    change between updates. Logs (and returns) the microseconds per name on
+    the first (cold) refresh, and on average after that.
+
+    """
+    rng = random.Random(seed)
+    names = [_random_name(rng) for _ in range(n_names)]
+    clear_caches()
+
+    def refresh():
+        start = time.perf_counter()
+        for name in names:
+            spoken_form(separate_words(name))
+        return (time.perf_counter() - start) / len(names) * 1e6
+
+    cold = refresh()
+    warm = 0.0
+    for _ in range(n_refreshes):
+        for _ in range(int(n_names * churn)):
+            names[rng.randrange(n_names)] = _random_name(rng)
+        warm += refresh() / n_refreshes
+    LOGGER.info(
+        f"Tokenized {n_names} names: {cold:.2f}us each cold, {warm:.2f}us each "
+        f"on later refreshes"
+    )
+    return cold, warm